@@ -0,0 +1,94 @@
+import argparse
+import sys
+import time
+
+from src.modules.run_analytics import RunAnalytics
+from src.utils import json_codec
+from src.utils.helper import RESULTS_PATH
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Аналитика прогонов по results.csv")
+    parser.add_argument("--store", default="analytics", help="каталог колоночного хранилища")
+    parser.add_argument("--source", default=str(RESULTS_PATH))
+    parser.add_argument("--no-ingest", action="store_true", help="не дочитывать results.csv, только отчет")
+    parser.add_argument("--since", default=None, help="YYYY-MM-DD включительно")
+    parser.add_argument("--until", default=None, help="YYYY-MM-DD включительно")
+    parser.add_argument("--wallet", default=None, help="история одного кошелька")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--json", action="store_true")
+    return parser.parse_args()
+
+
+def _format_sec(value):
+    return "-" if value is None else "inf" if value == float("inf") else f"{value:.0f}"
+
+
+def print_report(report: dict) -> None:
+    print(f"Строк: {report['rows']}, кошельков: {report['wallets']}")
+
+    print("\nПо дням:")
+    for day in report["days"]:
+        print(
+            f"  {day['day']}  действий={day['actions']:<7} успешно={day['success'] / max(day['actions'], 1):.1%}  "
+            f"кошельков={day['wallets']}"
+        )
+
+    print("\nПо сетям:")
+    for chain, stats in sorted(report["chains"].items(), key=lambda item: -item[1]["actions"]):
+        latency = stats["latency_sec"] or {}
+        print(
+            f"  {chain:<12} действий={stats['actions']:<7} успешно={stats['success_rate']:.1%}  "
+            f"газ={stats['gas_eth']:.6f} ETH ({stats['gas_eth_per_success']:.8f} на успех)  поинты={stats['points']}  "
+            f"p50/p90/p99<={_format_sec(latency.get('p50'))}/{_format_sec(latency.get('p90'))}/"
+            f"{_format_sec(latency.get('p99'))} сек"
+        )
+
+    print("\nЧаще всего падают:")
+    for hotspot in report["hotspots"]:
+        print(
+            f"  {hotspot['failures']:<6} из {hotspot['total']:<6} ({hotspot['failure_rate']:.0%})  "
+            f"{hotspot['chain']}: {hotspot['prompt']}"
+        )
+
+    points = report["points"]
+    print(f"\nПоинты: в среднем {points['per_wallet']:.2f} на кошелек, с поинтами {points['wallets_with_points']}")
+    for wallet in points["top"]:
+        print(f"  {wallet['address']}  {wallet['points']}")
+
+
+def print_wallet(report: dict) -> None:
+    print(
+        f"{report['address']}: успешно {report['success']}, ошибок {report['failure']}, "
+        f"газ {report['gas_eth']:.6f} ETH, поинты {report['points']}, "
+        f"с {report['first_seen']} по {report['last_seen']}"
+    )
+    for row in report["history"]:
+        duration = "-" if row["duration_sec"] is None else f"{row['duration_sec']:.1f}"
+        print(f"  {row['time']}  {row['status']:<7} {row['chain']:<10} {duration:>7} сек  {row['prompt']}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    store = RunAnalytics.open(args.store)
+
+    if not args.no_ingest:
+        started_at = time.perf_counter()
+        added = store.ingest(args.source)
+        store.save()
+        print(f"Добавлено строк: {added} за {time.perf_counter() - started_at:.2f} сек", file=sys.stderr)
+
+    if args.wallet:
+        report = store.wallet_report(args.wallet, limit=args.top)
+        if report is None:
+            print(f"Кошелек {args.wallet} не найден в результатах", file=sys.stderr)
+            sys.exit(1)
+    else:
+        report = store.report(since=args.since, until=args.until, top=args.top)
+
+    if args.json:
+        print(json_codec.dumps_str(report))
+    elif args.wallet:
+        print_wallet(report)
+    else:
+        print_report(report)
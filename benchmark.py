@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+from loguru import logger
+
+from src.benchmark.runner import run_benchmark, run_memory_benchmark
+from src.config import Config
+from src.utils.hydra import load_hydra_config
+
+if sys.platform == 'win32':
+    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк пропускной способности на замоканных RPC и Brian API")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--keys", type=int, nargs="+", default=[32])
+    parser.add_argument("--rpc-latency-ms", type=float, default=20)
+    parser.add_argument("--api-latency-ms", type=float, default=150)
+    parser.add_argument("--config-name", default="config")
+    parser.add_argument("--output", default=None)
+    parser.add_argument(
+        "--memory-wallets", type=int, default=None,
+        help="замерить память на одновременно открытый кошелек вместо пропускной способности",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    config = Config(**load_hydra_config(
+        config_dir=str(Path.cwd().resolve()), config_name=args.config_name, return_hydra_section=False
+    ))
+
+    if args.memory_wallets:
+        report = asyncio.run(run_memory_benchmark(config, args.memory_wallets))
+        print(
+            f"wallets={report['wallets']} memory={report['memory_kb']:.0f} KB "
+            f"per wallet={report['memory_per_wallet_kb']:.2f} KB"
+        )
+        sys.exit(0)
+
+    report = asyncio.run(run_benchmark(
+        config,
+        concurrency_levels=args.concurrency,
+        keys_counts=args.keys,
+        rpc_latency_sec=args.rpc_latency_ms / 1000,
+        api_latency_sec=args.api_latency_ms / 1000,
+        output_path=args.output,
+    ))
+
+    for case in report["cases"]:
+        print(
+            f"concurrency={case['concurrency']:<4} keys={case['keys_count']:<6} "
+            f"wallets/h={case['wallets_per_hour']:.0f} rpc/tx={case['rpc_calls_per_tx']} "
+            f"p50/p95/p99={case['action_latency_ms']['p50']:.0f}/{case['action_latency_ms']['p95']:.0f}/"
+            f"{case['action_latency_ms']['p99']:.0f} ms mem/wallet={case['memory_per_concurrent_wallet_kb']:.0f} KB"
+        )
+    print(f"Результаты сохранены в {report['output_path']}")
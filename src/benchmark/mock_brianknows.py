@@ -0,0 +1,86 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Optional
+
+ROUTER_ADDRESS = "0x2626664c2603336E57B271c5C0b26F421741e481"
+
+
+class MockResponse:
+    def __init__(self, status: int, content_type: str = "application/json"):
+        self.status = status
+        self.content_type = content_type
+
+
+class MockBrowserClient:
+    def __init__(self, username: str, proxy: Optional[str] = None, latency_sec: float = 0.0, steps_per_build: int = 1):
+        self.username = username
+        self.proxy = proxy
+        self.latency_sec = latency_sec
+        self.steps_per_build = steps_per_build
+        self.user_agent = "Mozilla/5.0 (benchmark)"
+        self.meta = {}
+        self.calls = Counter()
+        self._authorized = False
+
+    async def request(self, url: str, method: str = "GET", **kwargs) -> dict:
+        path = url.split("brianknows.org", 1)[-1]
+        self.calls[path] += 1
+
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+
+        if path == "/api/auth/me":
+            if not self._authorized:
+                return {"response": MockResponse(401, "text/plain"), "data": "Unauthorized"}
+            return {"response": MockResponse(200), "data": {"account": {"id": self.username}}}
+
+        if path == "/api/auth/nonce":
+            return {"response": MockResponse(200, "text/plain"), "data": os.urandom(8).hex()}
+
+        if path == "/api/auth/verify":
+            self._authorized = True
+            return {"response": MockResponse(200), "data": {"ok": True}}
+
+        if path == "/api/builds":
+            return {"response": MockResponse(200), "data": self._build(kwargs.get("json", {}))}
+
+        if path == "/api/points":
+            return {"response": MockResponse(200), "data": {"ok": True}}
+
+        return {"response": MockResponse(404, "text/plain"), "data": "Not Found"}
+
+    def _build(self, payload: dict) -> dict:
+        steps = [
+            {
+                "chainId": payload.get("chain"),
+                "to": ROUTER_ADDRESS,
+                "from": self.username,
+                "value": "0",
+                "data": "0x3593564c" + "00" * 64,
+            }
+            for _ in range(self.steps_per_build)
+        ]
+        return {
+            "result": [
+                {
+                    "action": "swap",
+                    "data": {"description": f"benchmark: {payload.get('query')}", "steps": steps},
+                }
+            ]
+        }
+
+    def save(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def set_param(self, key, value):
+        self.meta[key] = value
+
+    def get_param(self, key, default=None):
+        return self.meta.get(key, default)
+
+    def del_param(self, key):
+        self.meta.pop(key, None)
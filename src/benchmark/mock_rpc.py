@@ -0,0 +1,97 @@
+import asyncio
+import os
+from collections import Counter
+from typing import Any
+
+from eth_abi import decode, encode
+from web3.providers.async_base import AsyncBaseProvider
+
+BASE_CHAIN_ID = 8453
+
+
+class MockAsyncProvider(AsyncBaseProvider):
+    def __init__(
+            self,
+            latency_sec: float = 0.0,
+            gas_price_wei: int = 10_000_000,
+            chain_id: int = BASE_CHAIN_ID,
+            balance_wei: int = 10 ** 18,
+    ):
+        super().__init__()
+        self.balance_wei = balance_wei
+        self.latency_sec = latency_sec
+        self.gas_price_wei = gas_price_wei
+        self.chain_id = chain_id
+        self.block_number = 1_000_000
+        self.calls = Counter()
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+    async def make_request(self, method: str, params: Any) -> dict:
+        self.calls[method] += 1
+
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+
+        handler = getattr(self, f"_rpc_{method}", None)
+        if handler is None:
+            return {"jsonrpc": "2.0", "id": 0, "error": {"code": -32601, "message": f"{method} not mocked"}}
+
+        return {"jsonrpc": "2.0", "id": 0, "result": handler(params)}
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _rpc_eth_chainId(self, params):
+        return hex(self.chain_id)
+
+    def _rpc_eth_gasPrice(self, params):
+        return hex(self.gas_price_wei)
+
+    def _rpc_eth_getBalance(self, params):
+        return hex(self.balance_wei)
+
+    def _rpc_eth_call(self, params):
+        # Только Multicall3.aggregate3: все вызовы балансов возвращают balance_wei
+        data = bytes.fromhex(params[0]["data"][2:])
+        (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+        results = [(True, self.balance_wei.to_bytes(32, "big")) for _ in calls]
+        return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+
+    def _rpc_eth_getTransactionCount(self, params):
+        return hex(0)
+
+    def _rpc_eth_estimateGas(self, params):
+        return hex(21000 if not params[0].get("data") else 150_000)
+
+    def _rpc_eth_sendRawTransaction(self, params):
+        return "0x" + os.urandom(32).hex()
+
+    def _rpc_eth_feeHistory(self, params):
+        block_count = int(params[0], 16) if isinstance(params[0], str) else params[0]
+        base_fee = self.gas_price_wei * 9 // 10
+        return {
+            "oldestBlock": hex(self.block_number - block_count + 1),
+            "baseFeePerGas": [hex(base_fee)] * (block_count + 1),
+            "gasUsedRatio": [0.5] * block_count,
+            "reward": [[hex(self.gas_price_wei // 100 * (idx + 1)) for idx in range(len(params[2]))]] * block_count,
+        }
+
+    def _rpc_eth_getTransactionReceipt(self, params):
+        self.block_number += 1
+        return {
+            "transactionHash": params[0],
+            "blockHash": "0x" + os.urandom(32).hex(),
+            "blockNumber": hex(self.block_number),
+            "transactionIndex": "0x0",
+            "cumulativeGasUsed": hex(120_000),
+            "gasUsed": hex(120_000),
+            "effectiveGasPrice": hex(self.gas_price_wei),
+            "contractAddress": None,
+            "logs": [],
+            "logsBloom": "0x" + "00" * 256,
+            "status": "0x1",
+            "type": "0x2",
+        }
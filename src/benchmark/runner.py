@@ -0,0 +1,307 @@
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from eth_account import Account
+from web3 import Web3
+
+from src.benchmark.mock_brianknows import MockBrowserClient
+from src.benchmark.mock_rpc import MockAsyncProvider
+from src.config import Config
+from src.modules import step_executor as step_executor_module
+from src.modules.brianknows_client import BrianknowsClient
+from src.modules.browser_client import BrowserClient
+from src.modules.chain_registry import ChainRegistry
+from src.modules.step_executor import StepExecutor
+from src.utils import progress_bar
+
+VIRTUAL_TOKENS = [
+    Web3.to_checksum_address("0x0b3e328455c4059eeb9e3f84b5543f74e24e7e1b"),
+    Web3.to_checksum_address("0xac1bd2486aaf3b5c0fc3fd868558b082a531b2b4"),
+]
+
+
+class BenchmarkStats:
+    def __init__(self):
+        self.action_latencies: List[float] = []
+        self.rpc_calls = Counter()
+        self.api_calls = Counter()
+        self.loop_lags: List[float] = []
+        self.wallets_done = 0
+        self.providers: List[MockAsyncProvider] = []
+
+
+class BenchBrianknowsClient(BrianknowsClient):
+    def __init__(self, stats: BenchmarkStats, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    async def build_and_run_promt(self, chain, query, results=None):
+        start = time.perf_counter()
+        try:
+            return await super().build_and_run_promt(chain, query, results)
+        finally:
+            self.stats.action_latencies.append(time.perf_counter() - start)
+
+
+class BenchStepExecutor(StepExecutor):
+    def __init__(self, stats: BenchmarkStats, rpc_latency_sec: float, api_latency_sec: float, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = stats
+        self.rpc_latency_sec = rpc_latency_sec
+        self.api_latency_sec = api_latency_sec
+        self.browser_client: Optional[MockBrowserClient] = None
+
+    def _make_provider(self, rpc: str, proxy: Optional[str] = None):
+        # Провайдеры общие для всех кошельков (ChainRegistry.get_w3), вызовы считаем в конце прогона
+        provider = MockAsyncProvider(latency_sec=self.rpc_latency_sec)
+        self.stats.providers.append(provider)
+        return provider
+
+    def _make_browser_client(self, address: str):
+        self.browser_client = MockBrowserClient(address, self.proxy, latency_sec=self.api_latency_sec)
+        return self.browser_client
+
+    def _make_brianknows_client(self, browser_client, transaction_executors, address):
+        return BenchBrianknowsClient(
+            self.stats,
+            browser_client=browser_client,
+            transaction_executors=transaction_executors,
+            address=address,
+            proxy=self.proxy,
+        )
+
+    async def get_virtual_tokens(self, chain, max_pages=1):
+        return list(VIRTUAL_TOKENS)
+
+    async def run_step(self, private_key: str) -> None:
+        try:
+            await super().run_step(private_key)
+            self.stats.wallets_done += 1
+        finally:
+            if self.browser_client is not None:
+                self.stats.api_calls.update(self.browser_client.calls)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+def write_keys_file(path: Path, keys_count: int) -> None:
+    with open(path, "w") as f:
+        for _ in range(keys_count):
+            f.write(Account.create().key.hex() + "\n")
+
+
+def make_bench_config(base_config: Config, keys_file_path: str, concurrency: int) -> Config:
+    step_executor_config = base_config.step_executor.model_copy(update={
+        "wait_before_after_authorization_sec": (0, 0),
+        "wait_before_action_sec": (0, 0),
+        "timeout_between_wallets_src": (0, 0),
+    })
+    return base_config.model_copy(update={
+        "keys_file_path": keys_file_path,
+        "proxy_mode": "no_proxy",
+        "concurrency": concurrency,
+        "step_executor": step_executor_config,
+    })
+
+
+async def monitor_loop_lag(stats: BenchmarkStats, interval_sec: float = 0.05) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval_sec)
+        stats.loop_lags.append(max(0.0, loop.time() - start - interval_sec))
+
+
+async def run_benchmark_case(
+        base_config: Config,
+        concurrency: int,
+        keys_count: int,
+        rpc_latency_sec: float,
+        api_latency_sec: float,
+) -> dict:
+    from src.main import run_account
+
+    stats = BenchmarkStats()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        keys_file_path = Path(tmp_dir) / "keys.txt"
+        write_keys_file(keys_file_path, keys_count)
+
+        config = make_bench_config(base_config, str(keys_file_path), concurrency)
+
+        # Планировщик газа ходит в настоящий RPC, поэтому в бенчмарке он не участвует
+        chain_registry = ChainRegistry(
+            config.step_executor.networks,
+            config.step_executor.chains,
+            config.base_web3_transaction_executor,
+            gas_estimate_cache_config=config.gas_estimate_cache,
+        )
+
+        def step_executor_factory():
+            return BenchStepExecutor(
+                stats, rpc_latency_sec, api_latency_sec,
+                config.step_executor, config.base_web3_transaction_executor,
+                chain_registry=chain_registry,
+            )
+
+        tracemalloc.start()
+        memory_baseline, _ = tracemalloc.get_traced_memory()
+        lag_task = asyncio.create_task(monitor_loop_lag(stats))
+
+        start = time.perf_counter()
+        try:
+            await run_account(config, step_executor_factory)
+        finally:
+            elapsed = time.perf_counter() - start
+            lag_task.cancel()
+            _, memory_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    for provider in stats.providers:
+        stats.rpc_calls.update(provider.calls)
+
+    transactions = stats.rpc_calls["eth_sendRawTransaction"]
+    rpc_total = sum(stats.rpc_calls.values())
+
+    return {
+        "concurrency": concurrency,
+        "keys_count": keys_count,
+        "rpc_latency_ms": rpc_latency_sec * 1000,
+        "api_latency_ms": api_latency_sec * 1000,
+        "elapsed_sec": elapsed,
+        "wallets_done": stats.wallets_done,
+        "wallets_per_hour": stats.wallets_done / elapsed * 3600 if elapsed else None,
+        "actions": len(stats.action_latencies),
+        "transactions": transactions,
+        "rpc_calls_total": rpc_total,
+        "rpc_calls_per_tx": rpc_total / transactions if transactions else None,
+        "rpc_calls_by_method": dict(stats.rpc_calls),
+        "api_calls_by_path": dict(stats.api_calls),
+        "action_latency_ms": {
+            f"p{pct}": (percentile(stats.action_latencies, pct) or 0) * 1000 for pct in (50, 95, 99)
+        },
+        "loop_lag_ms": {
+            "p50": (percentile(stats.loop_lags, 50) or 0) * 1000,
+            "p99": (percentile(stats.loop_lags, 99) or 0) * 1000,
+            "max": max(stats.loop_lags, default=0) * 1000,
+        },
+        "memory_peak_kb": (memory_peak - memory_baseline) / 1024,
+        "memory_per_concurrent_wallet_kb": (memory_peak - memory_baseline) / 1024 / concurrency,
+    }
+
+
+class MemoryBenchStepExecutor(StepExecutor):
+    def __init__(self, storage_dir: str, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.storage_dir = storage_dir
+
+    def _make_provider(self, rpc: str, proxy: Optional[str] = None):
+        return MockAsyncProvider()
+
+    def _make_browser_client(self, address: str) -> BrowserClient:
+        return BrowserClient(address, self.proxy, storage_dir=self.storage_dir)
+
+
+async def run_memory_benchmark(base_config: Config, wallets_count: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        private_keys = [Account.create().key.hex() for _ in range(wallets_count + 1)]
+        for private_key in private_keys:
+            # User-Agent заранее, чтобы fake_useragent не попал в замер
+            (Path(tmp_dir) / f"{Account.from_key(private_key).address}_ua.txt").write_text("Mozilla/5.0 (benchmark)")
+
+        chain_registry = ChainRegistry(
+            base_config.step_executor.networks,
+            base_config.step_executor.chains,
+            base_config.base_web3_transaction_executor,
+        )
+        step_executor = MemoryBenchStepExecutor(
+            tmp_dir, base_config.step_executor, base_config.base_web3_transaction_executor,
+            chain_registry=chain_registry,
+        )
+        step_executor.setup_w3()
+
+        # Первый кошелек прогревает общие ресурсы: провайдеры, кеши web3 и eth_account
+        warmup = step_executor.make_wallet_context(Account.from_key(private_keys.pop()))
+        del warmup
+        gc.collect()
+
+        tracemalloc.start()
+        memory_baseline, _ = tracemalloc.get_traced_memory()
+
+        contexts = [step_executor.make_wallet_context(Account.from_key(private_key)) for private_key in private_keys]
+
+        gc.collect()
+        memory_current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del contexts
+
+    return {
+        "wallets": wallets_count,
+        "memory_kb": (memory_current - memory_baseline) / 1024,
+        "memory_per_wallet_kb": (memory_current - memory_baseline) / 1024 / wallets_count,
+    }
+
+
+def get_version() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+async def run_benchmark(
+        base_config: Config,
+        concurrency_levels: List[int],
+        keys_counts: List[int],
+        rpc_latency_sec: float,
+        api_latency_sec: float,
+        output_path: Optional[str] = None,
+) -> dict:
+    progress_bar.set_time_scale(0)
+    # Результаты бенчмарка не должны попадать в results.csv
+    step_executor_module.write_file = lambda *args, **kwargs: None
+
+    cases = []
+    for keys_count in keys_counts:
+        for concurrency in concurrency_levels:
+            cases.append(await run_benchmark_case(
+                base_config, concurrency, keys_count, rpc_latency_sec, api_latency_sec
+            ))
+
+    report = {
+        "version": get_version(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "cases": cases,
+    }
+
+    if output_path is None:
+        output_path = os.path.join("bench_results", f"{datetime.now():%Y-%m-%d_%H-%M-%S}_{report['version']}.json")
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    report["output_path"] = output_path
+    return report
@@ -1,20 +1,136 @@
-from typing import List, Literal
+from decimal import Decimal
+from typing import Dict, List, Literal, Optional
 
 from pydantic import BaseModel
 
-from src.modules.step_executor import StepExecutorConfig
-from src.modules.web3_transaction_exectutor import Web3TransactionExecutorConfig
+# Конфиг не должен тянуть web3 и прочие тяжелые модули: его загружают и процессы, которым они не нужны
+from src.modules.activity_index import ActivityIndexConfig
+from src.modules.concurrency_controller import AdaptiveConcurrencyConfig
+from src.modules.distributed import DistributedConfig
+from src.modules.fee_strategy import FeeStrategyConfig
+from src.modules.gas_estimate_cache import GasEstimateCacheConfig
+from src.modules.gas_scheduler import GasSchedulerConfig
+from src.modules.requeue import RequeueConfig
+from src.utils.metrics import MetricsConfig
+from src.utils.profiler import ProfilingConfig
+
+
+# Настройки DNS и HTTP-транспорта здесь, а не в их модулях: те импортируют aiohttp
+class DnsConfig(BaseModel):
+    prefer_ipv4: bool = True
+    allow_ipv6: bool = False
+    min_ttl_sec: float = 30
+    max_ttl_sec: float = 600
+    negative_ttl_sec: float = 5
+
+
+class HttpTransportConfig(BaseModel):
+    backend: Literal["aiohttp", "http2"] = "aiohttp"  # http2 требует pip install "httpx[http2]"
+    timeout_sec: float = 60
+    http2_max_connections: int = 20  # на один прокси; в HTTP/2 одно соединение держит много запросов
+    http2_max_clients: int = 64  # клиентов по прокси в памяти, давно не использованные закрываются
+
+
+class TxReplacementConfig(BaseModel):
+    enabled: bool = False
+    stuck_after_sec: int = 90
+    bump_percent: int = 15
+    max_replacements: int = 3
+    max_fee_multiplier: float = 3.0
+    max_fee_gwei: Optional[Decimal] = None
+
+
+class Web3TransactionExecutorConfig(BaseModel):
+    gas_price_multiplier: float
+    balance_check_interval: int
+    transaction_wait_attempts: int
+    transaction_wait_retry_interval: int
+    max_gas_price_eth_gwei_bridge_action: Optional[Decimal] = None
+    max_gas_price_eth_gwei_usual_actions: Optional[Decimal] = None
+    explorer_url: str = "https://basescan.org"
+    replacement: TxReplacementConfig = TxReplacementConfig()
+
+
+class NetworkConfig(BaseModel):
+    rpcs: List[str]
+    explorer_url: str = "https://basescan.org"
+    block_time_sec: float = 2
+    gas_price_multiplier: Optional[float] = None
+    max_gas_price_eth_gwei_bridge_action: Optional[Decimal] = None
+    max_gas_price_eth_gwei_usual_actions: Optional[Decimal] = None
+
+
+class BalancesConfig(BaseModel):
+    enabled: bool = False
+    batch_size: int = 300
+    min_eth_balance: Decimal = Decimal("0.0003")
+    gas_reserve_eth: Decimal = Decimal("0.0001")
+    refresh_interval_sec: int = 600
+    tokens: Dict[str, Dict[str, str]] = {}
+    eth_usd_price: Optional[Decimal] = None
+    eth_usd_feed_chain: str = "base"
+    eth_usd_feed_address: str = "0x71041dddad3595F9CEd3DcCFBe3D1F4b0a16Bb70"
+
+
+class PlanConfig(BaseModel):
+    enabled: bool = False
+    path: str = "plans/current"
+    rebuild: bool = False
+
+
+class PromptConfig(BaseModel):
+    title: str
+    enabled: bool
+    start: List
+    end: List
+    chains: Optional[List[str]] = None
+
+
+class BuildLookaheadConfig(BaseModel):
+    enabled: bool = False
+    build_ttl_sec: int = 120
+    balance_tolerance_percent: float = 5
+
+
+class StepExecutorConfig(BaseModel):
+    networks: Dict[str, NetworkConfig]
+
+    prompts: List[PromptConfig]
+    chains: List
+    chains_per_wallet: int = 1
+
+    swap_eth_amount: tuple[float, float]
+    swap_eth_percent: tuple[int, int]
+    bridge_eth_percent: tuple[int, int]
+    wrap_eth_percent: tuple[int, int]
+    deposit_dollars_of_eth: tuple[int, int]
+
+    wait_before_after_authorization_sec: tuple[int, int]
+    wait_before_action_sec: tuple[int, int]
+    timeout_between_wallets_src: tuple[int, int]
+
+    # Бюджеты времени: по истечении ожидания прерываются, невыполненные действия плана повторятся позже
+    action_timeout_sec: Optional[int] = None
+    wallet_timeout_sec: Optional[int] = None
+
+    lookahead: BuildLookaheadConfig = BuildLookaheadConfig()
 
 
 class TelegramConfig(BaseModel):
     enabled: bool
     token: str
     chat_id: int
+    level: str = "INFO"
+    flush_interval_sec: float = 10
+    min_send_interval_sec: float = 3
+    max_buffer_size: int = 500
 
 
 class LogsConfig(BaseModel):
     file_path: str
+    json_file_path: Optional[str] = None
     level: str
+    enqueue: bool = True
     telegram: TelegramConfig
 
 
@@ -22,10 +138,36 @@ class Config(BaseModel):
     keys_file_path: str
 
     shuffle_keys: bool
+    concurrency: int = 1
+    adaptive_concurrency: AdaptiveConcurrencyConfig = AdaptiveConcurrencyConfig()
+    requeue: RequeueConfig = RequeueConfig()
+    processes: int = 1
+    shutdown_timeout_sec: int = 60
     proxy_mode: Literal["no_proxy", "use_proxy"]
 
     base_web3_transaction_executor: Web3TransactionExecutorConfig
 
+    gas_scheduler: GasSchedulerConfig = GasSchedulerConfig()
+
+    gas_estimate_cache: GasEstimateCacheConfig = GasEstimateCacheConfig()
+
+    fee_strategy: FeeStrategyConfig = FeeStrategyConfig()
+
+    balances: BalancesConfig = BalancesConfig()
+
+    plan: PlanConfig = PlanConfig()
+
+    activity: ActivityIndexConfig = ActivityIndexConfig()
+
+    distributed: DistributedConfig = DistributedConfig()
+
     step_executor: StepExecutorConfig
 
     logs: LogsConfig
+
+    metrics: MetricsConfig = MetricsConfig()
+
+    profiling: ProfilingConfig = ProfilingConfig()
+
+    dns: DnsConfig = DnsConfig()
+    http: HttpTransportConfig = HttpTransportConfig()
@@ -1,77 +1,288 @@
+import asyncio
 import os
 
+from typing import TYPE_CHECKING, Callable, Optional
+
 from pathlib import Path
 from loguru import logger
 
 from src.config import Config
 from src.modules.data_file_iterator import DataFileIterator
-from src.modules.step_executor import StepExecutor
-from src.utils.hydra import load_hydra_config
-from src.utils.logger import setup_logging
+from src.modules.distributed import run_coordinator, run_worker
+from src.modules.exceptions import DeadlineExceeded, NotTimeForActivityError, ProxyUnavailable
+from src.modules.sharded_runner import run_sharded
+from src.utils.config_snapshot import load_config
+from src.modules.http_transport import setup_http_transport
+from src.utils.dns_resolver import setup_dns
+from src.utils.logger import setup_logging, shutdown_logging
+from src.utils.metrics import setup_metrics, shutdown_metrics
+from src.utils.profiler import profile_run
 from src.utils.proxy import check_proxy
 from src.utils.logo import logo_print
 
+# web3/eth_account грузятся только когда нужны (координатору, например, не нужны)
+if TYPE_CHECKING:
+    from src.modules.action_plan import ActionPlan
+    from src.modules.activity_index import ActivityIndex
+    from src.modules.balance_prefetcher import BalancePrefetcher
+    from src.modules.chain_registry import ChainRegistry
+    from src.modules.concurrency_controller import ConcurrencyController
+    from src.modules.step_executor import StepExecutor
 
-async def run_account(
-        main_config: Config
-) -> None:
-    logger.info(f"Начинаю работу по файлам ключей...")
 
-    keys_file_iterator = DataFileIterator(
-        path=main_config.keys_file_path, shuffle=main_config.shuffle_keys
+async def process_account(
+        main_config: Config,
+        step_executor: "StepExecutor",
+        idx: int,
+        total: int,
+        private_key: str,
+        other_data: list,
+) -> Optional[Exception]:
+    # None - кошелек отработан или пропущен, иначе ошибка, по которой решается судьба повтора
+    from eth_account import Account
+
+    logger.info(f"Начальный шаг с номером #{idx + 1}/{total}")
+
+    try:
+        step_executor.check_activity(private_key)
+    except NotTimeForActivityError as e:
+        logger.warning(f"Кошелек отработан ({e}), пропускаем его и приступаем к следующему...")
+        return None
+
+    if not step_executor.is_wallet_funded(Account.from_key(private_key).address):
+        logger.warning("Баланс кошелька ниже минимального во всех сетях, пропускаем без запросов")
+        return None
+
+    if main_config.proxy_mode == "use_proxy":
+        proxy = None
+        is_proxy_valid = False
+
+        if len(other_data) > 0:
+            proxy = other_data[0]
+            logger.info(f"Пробуем прокси {proxy}, прикрепленный к ключу")
+
+            is_proxy_valid = await check_proxy(proxy)
+
+        if not is_proxy_valid:
+            logger.error(f"Прикрепленный прокси: {proxy} не рабочий!")
+            return ProxyUnavailable(f"Прокси {proxy} не рабочий")
+
+        logger.info(f"Используем прокси {proxy}")
+
+        step_executor.setup_w3(proxy)
+    else:
+        step_executor.setup_w3()
+
+    try:
+        await step_executor.run_step(str(private_key))
+    except DeadlineExceeded as e:
+        logger.warning(f"{e}, кошелек освобожден, невыполненные действия будут повторены позже")
+        return e
+    except Exception as e:
+        logger.error("Ошибка при отработке кошелька: " + str(e))
+        return e
+    finally:
+        step_executor.cleanup_w3()
+
+    return None
+
+
+def create_activity_index(main_config: Config, compact: bool = True) -> Optional["ActivityIndex"]:
+    from src.modules.activity_index import ActivityIndex
+
+    if not main_config.activity.enabled:
+        return None
+    return ActivityIndex(main_config.activity, compact=compact)
+
+
+def create_concurrency_controller(main_config: Config) -> Optional["ConcurrencyController"]:
+    from src.modules.concurrency_controller import ConcurrencyController
+
+    if not main_config.adaptive_concurrency.enabled:
+        return None
+    return ConcurrencyController(main_config.adaptive_concurrency, main_config.concurrency)
+
+
+def create_chain_registry(main_config: Config) -> "ChainRegistry":
+    from src.modules.chain_registry import ChainRegistry
+
+    return ChainRegistry(
+        main_config.step_executor.networks,
+        main_config.step_executor.chains,
+        main_config.base_web3_transaction_executor,
+        main_config.gas_scheduler,
+        main_config.gas_estimate_cache,
+        main_config.fee_strategy,
     )
 
+
+async def prepare_action_plan(
+        main_config: Config,
+        keys_file_iterator: DataFileIterator,
+        chain_registry: "ChainRegistry",
+        balance_prefetcher: Optional["BalancePrefetcher"] = None,
+) -> "ActionPlan":
+    from src.modules.action_plan import load_or_build_plan
+    from src.modules.step_executor import StepExecutor
+
     step_executor = StepExecutor(
         main_config.step_executor,
         main_config.base_web3_transaction_executor,
+        chain_registry=chain_registry,
+        balance_prefetcher=balance_prefetcher,
     )
+    action_plan = await load_or_build_plan(main_config.plan, keys_file_iterator, step_executor, balance_prefetcher)
+    action_plan.log_summary()
+    return action_plan
+
+
+async def run_account(
+        main_config: Config,
+        step_executor_factory: Optional[Callable[[], "StepExecutor"]] = None,
+        keys_file_iterator: Optional[DataFileIterator] = None,
+        stop_event=None,
+        action_plan: Optional["ActionPlan"] = None,
+        activity_index: Optional["ActivityIndex"] = None,
+) -> None:
+    from eth_account import Account
+
+    from src.modules.balance_prefetcher import BalancePrefetcher
+    from src.modules.http_transport import close_transport
+    from src.modules.chain_registry import close_rpc_session
+    from src.modules.concurrency_controller import worker_slot, workers_count
+    from src.modules.requeue import RetryItem, WalletRequeue
+    from src.modules.step_executor import StepExecutor
+
+    logger.info(f"Начинаю работу по файлам ключей...")
+
+    if keys_file_iterator is None:
+        keys_file_iterator = DataFileIterator(
+            path=main_config.keys_file_path, shuffle=main_config.shuffle_keys
+        )
+
+    if activity_index is None:
+        activity_index = create_activity_index(main_config)
+    if activity_index is not None:
+        activity_index.log_eligibility(private_key for private_key, *_ in keys_file_iterator)
 
-    for idx, (private_key, *other_data) in enumerate(keys_file_iterator):
-        logger.info(f"Начальный шаг с номером #{idx + 1}/{len(keys_file_iterator)}")
+    chain_registry = create_chain_registry(main_config)
 
-        if main_config.proxy_mode == "use_proxy":
-            proxy = None
-            is_proxy_valid = False
+    balance_prefetcher = None
+    if main_config.balances.enabled:
+        balance_prefetcher = BalancePrefetcher(main_config.balances, chain_registry)
+        await balance_prefetcher.prefetch([
+            Account.from_key(private_key).address for private_key, *_ in keys_file_iterator
+            if activity_index is None or activity_index.is_eligible(private_key)
+        ])
 
-            if len(other_data) > 0:
-                proxy = other_data[0]
-                logger.info(f"Пробуем прокси {proxy}, прикрепленный к ключу")
+    # Итог по плану выводит тот, кто его построил (в шардах это родительский процесс)
+    owns_plan = action_plan is None and main_config.plan.enabled
+    if owns_plan:
+        action_plan = await prepare_action_plan(main_config, keys_file_iterator, chain_registry, balance_prefetcher)
 
-                is_proxy_valid = await check_proxy(proxy)
+    if step_executor_factory is None:
+        def step_executor_factory():
+            return StepExecutor(
+                main_config.step_executor,
+                main_config.base_web3_transaction_executor,
+                chain_registry=chain_registry,
+                balance_prefetcher=balance_prefetcher,
+                action_plan=action_plan,
+                activity_index=activity_index,
+            )
 
-            if not is_proxy_valid:
-                logger.error(f"Прикрепленный прокси: {proxy} не рабочий!")
+    keys = enumerate(keys_file_iterator)
+    total = len(keys_file_iterator)
+    concurrency_controller = create_concurrency_controller(main_config)
+    requeue = WalletRequeue(main_config.requeue) if main_config.requeue.enabled else None
+
+    async def next_wallet() -> Optional[RetryItem]:
+        if stop_event is not None and stop_event.is_set():
+            logger.warning("Получен сигнал остановки, новые кошельки не берем")
+            return None
+
+        # Сначала новые ключи по порядку, потом повторы упавших кошельков, когда подойдет их время
+        for idx, (private_key, *other_data) in keys:
+            if activity_index is not None and not activity_index.is_eligible(private_key):
+                # Проверка по индексу до прокси, сессий и RPC
                 continue
+            if requeue is not None:
+                # В работе с момента выдачи, а не со входа в слот: иначе соседний воркер
+                # увидит пустую очередь без кошельков в работе и завершится
+                requeue.started()
+            return RetryItem(idx, private_key, other_data, attempt=1)
 
-            logger.info(f"Используем прокси {proxy}")
+        if requeue is None:
+            return None
+        return await requeue.next_retry(stop_event)
 
-            step_executor.setup_w3(proxy)
-        else:
-            step_executor.setup_w3()
+    async def worker():
+        # У каждого воркера свой StepExecutor, так как он хранит w3 и прокси текущего кошелька
+        step_executor = step_executor_factory()
+        while (item := await next_wallet()) is not None:
+            if requeue is None:
+                async with worker_slot(concurrency_controller):
+                    await process_account(
+                        main_config, step_executor, item.idx, total, item.private_key, item.other_data
+                    )
+                continue
 
-        try:
-            await step_executor.run_step(str(private_key))
-        # except NotTimeForActivityError as e:
-        #    logger.warning("Кошелек отработан, пропускаем его и приступаем к следующему...")
-        #    continue
-        except Exception as e:
-            logger.error("Ошибка при отработке кошелька: " + str(e))
-            continue
+            failure = None
+            try:
+                async with worker_slot(concurrency_controller):
+                    failure = await process_account(
+                        main_config, step_executor, item.idx, total, item.private_key, item.other_data
+                    )
+            finally:
+                await requeue.finished(item, failure)
 
-        step_executor.cleanup_w3()
+    if concurrency_controller is not None:
+        concurrency_controller.start()
+
+    try:
+        await asyncio.gather(*[
+            worker() for _ in range(workers_count(main_config.concurrency, concurrency_controller))
+        ])
+    finally:
+        if concurrency_controller is not None:
+            concurrency_controller.stop()
+        chain_registry.close()
+        await close_transport()
+        await close_rpc_session()
+        if requeue is not None:
+            requeue.log_summary()
+        if action_plan is not None:
+            if owns_plan:
+                action_plan.log_summary()
+            action_plan.close()
 
 
 async def main(config_name: str = "config") -> None:
     config_dir = Path.cwd().resolve()
-    config_hydra = load_hydra_config(
+    config = load_config(
         config_dir=str(config_dir),
         config_name=config_name,
-        return_hydra_section=False,
         config_overrides=os.getenv("CONFIG_OVERRIDES", None),
     )
-    config = Config(**config_hydra)
     await setup_logging(config.logs)
 
     logo_print()
 
-    await run_account(config)
+    await setup_metrics(config.metrics)
+    setup_dns(config.dns)
+    setup_http_transport(config.http)
+
+    try:
+        if config.distributed.mode == "coordinator":
+            await run_coordinator(config)
+        elif config.distributed.mode == "worker":
+            async with profile_run(config.profiling, "worker"):
+                await run_worker(config)
+        elif config.processes > 1:
+            await run_sharded(config)
+        else:
+            async with profile_run(config.profiling):
+                await run_account(config)
+    finally:
+        shutdown_metrics(config.metrics)
+        await shutdown_logging()
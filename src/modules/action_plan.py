@@ -0,0 +1,255 @@
+import os
+import random
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from src.config import PlanConfig
+from src.modules.data_file_iterator import DataFileIterator
+from src.utils import json_codec
+from src.utils.helper import wallet_id
+
+if TYPE_CHECKING:
+    from src.modules.balance_prefetcher import BalancePrefetcher
+    from src.modules.step_executor import StepExecutor
+
+PLAN_VERSION = 3
+
+STATUS_PENDING = 0
+STATUS_SUCCESS = 1
+STATUS_FAILURE = 2
+STATUS_NAMES = {STATUS_PENDING: "pending", STATUS_SUCCESS: "success", STATUS_FAILURE: "failure"}
+
+NO_TOKEN = 0xFFFF
+
+# Колонки плана: имя -> typecode массива
+WALLET_COLUMNS = {"wallet_start": "I", "wallet_delay_sec": "I"}
+ACTION_COLUMNS = {
+    "chain_idx": "B",
+    "template_idx": "H",
+    "delay_sec": "H",
+    "swap_eth_amount": "d",
+    "swap_eth_percent": "B",
+    "bridge_eth_percent": "B",
+    "wrap_eth_percent": "B",
+    "deposit_dollars_of_eth": "H",
+    "virtual_token_idx": "H",
+}
+VALUE_COLUMNS = ("swap_eth_amount", "swap_eth_percent", "bridge_eth_percent", "wrap_eth_percent", "deposit_dollars_of_eth")
+
+
+class PlannedAction:
+    __slots__ = ("row", "chain", "text", "delay_sec")
+
+    def __init__(self, row: int, chain: str, text: str, delay_sec: int):
+        self.row = row
+        self.chain = chain
+        self.text = text
+        self.delay_sec = delay_sec
+
+
+class ActionPlan:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.meta: dict = {"version": PLAN_VERSION, "chains": [], "templates": [], "virtual_tokens": []}
+        self.columns: Dict[str, array] = {
+            name: array(typecode) for name, typecode in {**WALLET_COLUMNS, **ACTION_COLUMNS}.items()
+        }
+        self.columns["wallet_start"].append(0)
+        self.wallet_ids = bytearray()
+        self.status = bytearray()
+        self._wallet_index: Optional[Dict[bytes, int]] = None
+        self._status_file = None
+        self._chain_ids: Dict[str, int] = {}
+        self._template_ids: Dict[str, int] = {}
+        self._token_ids: Dict[str, int] = {}
+
+    @property
+    def wallets_count(self) -> int:
+        return len(self.columns["wallet_start"]) - 1
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    @staticmethod
+    def _intern(table: List[str], ids: Dict[str, int], value: str) -> int:
+        idx = ids.get(value)
+        if idx is None:
+            idx = ids[value] = len(table)
+            table.append(value)
+        return idx
+
+    def add_wallet(self, private_key: str, actions: List[Tuple[str, str, dict, int]], delay_sec: int) -> None:
+        for chain, template, values, action_delay_sec in actions:
+            self.columns["chain_idx"].append(self._intern(self.meta["chains"], self._chain_ids, chain))
+            self.columns["template_idx"].append(self._intern(self.meta["templates"], self._template_ids, template))
+            self.columns["delay_sec"].append(action_delay_sec)
+            for name in VALUE_COLUMNS:
+                self.columns[name].append(values[name])
+
+            token = values.get("random_virtual_token")
+            self.columns["virtual_token_idx"].append(
+                self._intern(self.meta["virtual_tokens"], self._token_ids, token) if token else NO_TOKEN
+            )
+            self.status.append(STATUS_PENDING)
+
+        self.wallet_ids += bytes.fromhex(wallet_id(private_key))
+        self.columns["wallet_start"].append(len(self.status))
+        self.columns["wallet_delay_sec"].append(delay_sec)
+
+    def wallet_index(self, private_key: str) -> Optional[int]:
+        if self._wallet_index is None:
+            self._wallet_index = {
+                bytes(self.wallet_ids[idx * 8:(idx + 1) * 8]): idx for idx in range(self.wallets_count)
+            }
+        return self._wallet_index.get(bytes.fromhex(wallet_id(private_key)))
+
+    def wallet_rows(self, wallet_idx: int) -> range:
+        return range(self.columns["wallet_start"][wallet_idx], self.columns["wallet_start"][wallet_idx + 1])
+
+    def wallet_delay_sec(self, wallet_idx: int) -> int:
+        return self.columns["wallet_delay_sec"][wallet_idx]
+
+    def is_wallet_done(self, wallet_idx: int) -> bool:
+        return all(self.status[row] != STATUS_PENDING for row in self.wallet_rows(wallet_idx))
+
+    def render(self, row: int, render_prompt) -> PlannedAction:
+        chain = self.meta["chains"][self.columns["chain_idx"][row]]
+        template = self.meta["templates"][self.columns["template_idx"][row]]
+
+        values = {name: self.columns[name][row] for name in VALUE_COLUMNS}
+        values["swap_eth_amount"] = round(values["swap_eth_amount"], 6)
+        token_idx = self.columns["virtual_token_idx"][row]
+        values["random_virtual_token"] = self.meta["virtual_tokens"][token_idx] if token_idx != NO_TOKEN else ""
+
+        return PlannedAction(row, chain, render_prompt(template, chain, values), self.columns["delay_sec"][row])
+
+    def pending_actions(self, wallet_idx: int, render_prompt) -> Iterator[PlannedAction]:
+        for row in self.wallet_rows(wallet_idx):
+            if self.status[row] == STATUS_PENDING:
+                yield self.render(row, render_prompt)
+
+    def mark(self, row: int, status: int) -> None:
+        self.status[row] = status
+
+        if self._status_file is None:
+            self._status_file = open(self.path / "status.bin", "r+b")
+        self._status_file.seek(row)
+        self._status_file.write(bytes((status,)))
+        self._status_file.flush()
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        per_chain: Dict[str, Counter] = {}
+        chain_column = self.columns["chain_idx"]
+        for row, status in enumerate(self.status):
+            chain = self.meta["chains"][chain_column[row]]
+            per_chain.setdefault(chain, Counter())[STATUS_NAMES[status]] += 1
+        return {chain: dict(counter) for chain, counter in per_chain.items()}
+
+    def log_summary(self) -> None:
+        done_wallets = sum(1 for idx in range(self.wallets_count) if self.is_wallet_done(idx))
+        logger.info(f"План: кошельков {done_wallets}/{self.wallets_count} отработано, действий {len(self)}")
+        for chain, counts in self.summary().items():
+            logger.info(f"План, сеть {chain}: " + ", ".join(f"{name}: {count}" for name, count in counts.items()))
+
+    def save(self, keys_digest: str) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta.update({"created_at": time.time(), "keys_digest": keys_digest, "actions": len(self)})
+
+        for name, column in self.columns.items():
+            with open(self.path / f"{name}.bin", "wb") as f:
+                column.tofile(f)
+        (self.path / "wallet_ids.bin").write_bytes(self.wallet_ids)
+        (self.path / "status.bin").write_bytes(self.status)
+        json_codec.dump_file(self.path / "meta.json", self.meta)
+
+    @classmethod
+    def load(cls, path: str) -> "ActionPlan":
+        plan = cls(path)
+        plan.meta = json_codec.load_file(plan.path / "meta.json")
+        if plan.meta.get("version") != PLAN_VERSION:
+            raise ValueError(f"Неподдерживаемая версия плана {plan.meta.get('version')}")
+
+        for name, typecode in {**WALLET_COLUMNS, **ACTION_COLUMNS}.items():
+            column_path = plan.path / f"{name}.bin"
+            column = array(typecode)
+            with open(column_path, "rb") as f:
+                column.fromfile(f, os.path.getsize(column_path) // column.itemsize)
+            plan.columns[name] = column
+
+        plan.wallet_ids = bytearray((plan.path / "wallet_ids.bin").read_bytes())
+        plan.status = bytearray((plan.path / "status.bin").read_bytes())
+        return plan
+
+    def close(self) -> None:
+        if self._status_file is not None:
+            self._status_file.close()
+            self._status_file = None
+
+
+def keys_digest(keys_file_iterator: DataFileIterator) -> str:
+    import hashlib
+
+    digest = hashlib.sha256()
+    for private_key in sorted(row[0] for row in keys_file_iterator.data_infos):
+        digest.update(private_key.encode())
+    return digest.hexdigest()
+
+
+async def build_plan(
+        config: PlanConfig,
+        keys_file_iterator: DataFileIterator,
+        step_executor: "StepExecutor",
+        balance_prefetcher: Optional["BalancePrefetcher"] = None,
+) -> ActionPlan:
+    from eth_account import Account
+
+    step_config = step_executor.config
+    chains = step_executor.chain_registry.chains
+
+    virtual_tokens = {}
+    for chain in chains:
+        logger.info(f"План: загружаем Virtuals tokens для сети {chain}...")
+        virtual_tokens[chain] = await step_executor.get_virtual_tokens(chain)
+
+    plan = ActionPlan(config.path)
+
+    for private_key, *_ in keys_file_iterator:
+        address = Account.from_key(private_key).address if balance_prefetcher is not None else None
+
+        wallet_chains = random.sample(chains, k=min(step_config.chains_per_wallet, len(chains)))
+        actions = []
+        for chain in wallet_chains:
+            balances = balance_prefetcher.get(chain, address) if balance_prefetcher is not None else None
+            for template, values in step_executor.plan_actions(chain, virtual_tokens[chain], balances, verbose=False):
+                actions.append((chain, template, values, random.randint(*step_config.wait_before_action_sec)))
+
+        plan.add_wallet(private_key, actions, random.randint(*step_config.timeout_between_wallets_src))
+
+    plan.save(keys_digest(keys_file_iterator))
+    logger.info(f"План построен: кошельков {plan.wallets_count}, действий {len(plan)}, сохранен в {config.path}")
+    return plan
+
+
+async def load_or_build_plan(
+        config: PlanConfig,
+        keys_file_iterator: DataFileIterator,
+        step_executor: "StepExecutor",
+        balance_prefetcher: Optional["BalancePrefetcher"] = None,
+) -> ActionPlan:
+    if not config.rebuild and (Path(config.path) / "meta.json").exists():
+        try:
+            plan = ActionPlan.load(config.path)
+        except ValueError as e:
+            logger.warning(f"Сохраненный план не подходит ({e}), строим новый план")
+        else:
+            if plan.meta.get("keys_digest") == keys_digest(keys_file_iterator):
+                logger.info(f"Продолжаем по сохраненному плану {config.path}")
+                return plan
+            logger.warning("Файл ключей изменился с момента построения плана, строим новый план")
+
+    return await build_plan(config, keys_file_iterator, step_executor, balance_prefetcher)
@@ -0,0 +1,129 @@
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.modules.exceptions import NotTimeForActivityError
+from src.utils import json_codec
+from src.utils.helper import wallet_id
+
+
+class ActivityIndexConfig(BaseModel):
+    enabled: bool = False
+    path: str = "logs/activity_index.jsonl"
+    once_per_day: bool = True
+    min_hours_between_runs: float = 0
+    max_runs: Optional[int] = None
+    min_actions_per_run: int = 1
+
+
+class WalletActivity:
+    __slots__ = ("last_run_at", "runs", "actions_done", "points_claimed")
+
+    def __init__(self, last_run_at: float = 0, runs: int = 0, actions_done: int = 0, points_claimed: int = 0):
+        self.last_run_at = last_run_at
+        self.runs = runs
+        self.actions_done = actions_done
+        self.points_claimed = points_claimed
+
+    def to_dict(self) -> dict:
+        return {
+            "last_run_at": self.last_run_at,
+            "runs": self.runs,
+            "actions_done": self.actions_done,
+            "points_claimed": self.points_claimed,
+        }
+
+
+class ActivityIndex:
+    def __init__(self, config: ActivityIndexConfig, compact: bool = True):
+        self.config = config
+        self.path = Path(config.path)
+        self.wallets: Dict[str, WalletActivity] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.load(compact)
+
+    def load(self, compact: bool = True) -> None:
+        if not self.path.exists():
+            return
+
+        records = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json_codec.loads(line)
+                except ValueError:
+                    continue
+                # Каждая строка — полное состояние кошелька, последняя побеждает
+                wallet = record.pop("wallet_id")
+                self.wallets[wallet] = WalletActivity(**record)
+                records += 1
+
+        # Шарды дописывают в тот же файл, поэтому сжимает его только родительский процесс до их запуска
+        if compact and records > 2 * len(self.wallets):
+            self.compact()
+
+    def compact(self) -> None:
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            for wallet, activity in self.wallets.items():
+                f.write(json_codec.dumps({"wallet_id": wallet, **activity.to_dict()}) + b"\n")
+        tmp_path.replace(self.path)
+
+    def get(self, private_key: str) -> Optional[WalletActivity]:
+        return self.wallets.get(wallet_id(private_key))
+
+    def not_eligible_reason(self, private_key: str, now: Optional[float] = None) -> Optional[str]:
+        activity = self.get(private_key)
+        if activity is None or activity.runs == 0:
+            return None
+
+        now = time.time() if now is None else now
+
+        if self.config.max_runs is not None and activity.runs >= self.config.max_runs:
+            return f"уже отработан {activity.runs} раз"
+
+        if self.config.once_per_day and datetime.fromtimestamp(activity.last_run_at).date() == datetime.fromtimestamp(now).date():
+            return "уже отработан сегодня"
+
+        hours_since_run = (now - activity.last_run_at) / 3600
+        if hours_since_run < self.config.min_hours_between_runs:
+            return f"с прошлого запуска прошло {hours_since_run:.1f} ч из {self.config.min_hours_between_runs}"
+
+        return None
+
+    def is_eligible(self, private_key: str) -> bool:
+        return self.not_eligible_reason(private_key) is None
+
+    def check(self, private_key: str) -> None:
+        reason = self.not_eligible_reason(private_key)
+        if reason is not None:
+            raise NotTimeForActivityError(reason)
+
+    def record_run(self, private_key: str, actions_done: int, points_claimed: int) -> None:
+        wallet = wallet_id(private_key)
+        activity = self.wallets.get(wallet) or WalletActivity()
+
+        activity.actions_done += actions_done
+        activity.points_claimed += points_claimed
+        # Прогон без успешных действий не считается, кошелек возьмем снова
+        if actions_done >= self.config.min_actions_per_run:
+            activity.runs += 1
+            activity.last_run_at = time.time()
+
+        self.wallets[wallet] = activity
+        with open(self.path, "ab") as f:
+            f.write(json_codec.dumps({"wallet_id": wallet, **activity.to_dict()}) + b"\n")
+
+    def log_eligibility(self, private_keys) -> None:
+        total = 0
+        eligible = 0
+        for private_key in private_keys:
+            total += 1
+            eligible += self.is_eligible(private_key)
+        logger.info(f"Индекс активности: к отработке {eligible} из {total} кошельков")
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from eth_abi import decode, encode
+from loguru import logger
+from web3 import Web3
+
+from src.config import BalancesConfig
+from src.modules.chain_registry import ChainRegistry
+from src.utils.metrics import metrics
+
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+GET_ETH_BALANCE_SELECTOR = bytes.fromhex("4d2301cc")
+BALANCE_OF_SELECTOR = bytes.fromhex("70a08231")
+LATEST_ROUND_DATA_SELECTOR = bytes.fromhex("feaf968c")
+DECIMALS_SELECTOR = bytes.fromhex("313ce567")
+
+
+class WalletBalances:
+    __slots__ = ("eth", "tokens", "updated_at")
+
+    def __init__(self, eth: int, tokens: Dict[str, int], updated_at: float):
+        self.eth = eth
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+    def token(self, symbol: str) -> int:
+        return self.tokens.get(symbol.upper(), 0)
+
+
+class BalancePrefetcher:
+    def __init__(self, config: BalancesConfig, chain_registry: ChainRegistry):
+        self.config = config
+        self.chain_registry = chain_registry
+        self.w3s = {chain: chain_registry.make_w3(chain) for chain in chain_registry.chains}
+        self.book: Dict[Tuple[str, str], WalletBalances] = {}
+        self.eth_usd_price: Optional[Decimal] = config.eth_usd_price
+
+    def tokens(self, chain: str) -> Dict[str, str]:
+        return {
+            symbol.upper(): Web3.to_checksum_address(address)
+            for symbol, address in self.config.tokens.get(chain, {}).items()
+        }
+
+    def get(self, chain: str, address: str) -> Optional[WalletBalances]:
+        return self.book.get((chain, address))
+
+    def is_stale(self, balances: WalletBalances) -> bool:
+        return time.time() - balances.updated_at > self.config.refresh_interval_sec
+
+    def is_funded(self, address: str) -> bool:
+        min_eth_wei = Web3.to_wei(self.config.min_eth_balance, "ether")
+        known = [self.book.get((chain, address)) for chain in self.chain_registry.chains]
+        known = [balances for balances in known if balances is not None]
+
+        # Если баланс неизвестен, не отсеиваем кошелек
+        if len(known) < len(self.chain_registry.chains):
+            return True
+
+        return any(balances.eth >= min_eth_wei for balances in known)
+
+    def _encode_calls(self, addresses: List[str], tokens: Dict[str, str]) -> bytes:
+        calls = []
+        for address in addresses:
+            encoded_address = encode(["address"], [address])
+            calls.append((MULTICALL3_ADDRESS, True, GET_ETH_BALANCE_SELECTOR + encoded_address))
+            for token_address in tokens.values():
+                calls.append((token_address, True, BALANCE_OF_SELECTOR + encoded_address))
+
+        return AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls])
+
+    async def _fetch_batch(self, chain: str, addresses: List[str]) -> None:
+        tokens = self.tokens(chain)
+        data = self._encode_calls(addresses, tokens)
+
+        raw = await self.w3s[chain].eth.call({"to": MULTICALL3_ADDRESS, "data": data})
+        metrics.inc("multicall_requests_total", chain=chain)
+
+        (results,) = decode(["(bool,bytes)[]"], raw)
+        now = time.time()
+        calls_per_wallet = 1 + len(tokens)
+
+        for idx, address in enumerate(addresses):
+            wallet_results = results[idx * calls_per_wallet:(idx + 1) * calls_per_wallet]
+            values = [
+                int.from_bytes(return_data[:32], "big") if success and len(return_data) >= 32 else 0
+                for success, return_data in wallet_results
+            ]
+            self.book[(chain, address)] = WalletBalances(
+                eth=values[0], tokens=dict(zip(tokens.keys(), values[1:])), updated_at=now
+            )
+
+    async def fetch(self, chain: str, addresses: Iterable[str]) -> None:
+        addresses = list(addresses)
+        batch_size = max(1, self.config.batch_size // (1 + len(self.tokens(chain))))
+
+        for start in range(0, len(addresses), batch_size):
+            batch = addresses[start:start + batch_size]
+            try:
+                await self._fetch_batch(chain, batch)
+            except Exception as e:
+                logger.error(f"Не удалось получить балансы через Multicall3 в сети {chain}: {e}")
+
+    async def fetch_eth_usd_price(self) -> None:
+        chain = self.config.eth_usd_feed_chain
+        if chain not in self.chain_registry.networks:
+            logger.warning(f"Для фида ETH/USD нет настроек сети {chain}, действия в долларах не проверяются по балансу")
+            return
+
+        w3 = self.w3s.get(chain) or self.chain_registry.make_w3(chain)
+        feed = Web3.to_checksum_address(self.config.eth_usd_feed_address)
+        try:
+            (decimals,) = decode(["uint8"], await w3.eth.call({"to": feed, "data": DECIMALS_SELECTOR}))
+            raw = await w3.eth.call({"to": feed, "data": LATEST_ROUND_DATA_SELECTOR})
+            _, answer, _, _, _ = decode(["uint80", "int256", "uint256", "uint256", "uint80"], raw)
+        except Exception as e:
+            logger.warning(f"Не удалось получить курс ETH/USD: {e}, действия в долларах не проверяются по балансу")
+            return
+
+        self.eth_usd_price = Decimal(answer) / Decimal(10) ** decimals
+        logger.info(f"Курс ETH/USD: {self.eth_usd_price:.2f}")
+
+    def usd_to_wei(self, dollars: float) -> Optional[int]:
+        if not self.eth_usd_price:
+            return None
+        return Web3.to_wei(Decimal(dollars) / self.eth_usd_price, "ether")
+
+    async def prefetch(self, addresses: List[str]) -> None:
+        logger.info(f"Загружаем балансы {len(addresses)} кошельков через Multicall3...")
+
+        # Курс нужен планировщику для действий в долларах, берем один раз за запуск
+        tasks = [self.fetch(chain, addresses) for chain in self.chain_registry.chains]
+        if self.eth_usd_price is None:
+            tasks.append(self.fetch_eth_usd_price())
+        await asyncio.gather(*tasks)
+
+        empty = sum(1 for address in addresses if not self.is_funded(address))
+        logger.info(f"Балансы загружены, кошельков с балансом ниже {self.config.min_eth_balance} eth: {empty}")
+
+    async def refresh(self, chain: str, address: str) -> Optional[WalletBalances]:
+        await self.fetch(chain, [address])
+        return self.get(chain, address)
+
+    async def get_fresh(self, chain: str, address: str) -> Optional[WalletBalances]:
+        balances = self.get(chain, address)
+        if balances is None or self.is_stale(balances):
+            balances = await self.refresh(chain, address)
+        return balances
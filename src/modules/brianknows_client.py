@@ -1,5 +1,7 @@
 import random
-import json
+from collections import Counter
+
+from typing import List, Optional
 
 from loguru import logger
 from eth_account import Account
@@ -9,33 +11,84 @@ from decimal import Decimal
 from web3 import Web3
 from eth_utils import to_hex
 
+from src.utils import json_codec
+from src.utils.deadline import check_deadline
+from src.utils.metrics import metrics
 from src.utils.progress_bar import wait
-from src.modules.exceptions import InsufficientFunds
+from src.modules.exceptions import DeadlineExceeded, InsufficientFunds
+
+
+class BuildStep:
+    __slots__ = ("to", "value", "data")
+
+    def __init__(self, to: str, value: int, data: str):
+        self.to = to
+        self.value = value
+        self.data = data
+
+    @classmethod
+    def from_dict(cls, step: dict) -> "BuildStep":
+        value = step["value"]
+        return cls(
+            to=step["to"],
+            value=int(value, 16) if value[:2] == "0x" else int(value),
+            data=step["data"],
+        )
+
+
+class BuildResult:
+    __slots__ = ("action", "description", "steps")
+
+    def __init__(self, action: str, description: str, steps: List[BuildStep]):
+        self.action = action
+        self.description = description
+        self.steps = steps
+
+    @classmethod
+    def from_dict(cls, result: dict) -> "BuildResult":
+        data = result["data"]
+        return cls(
+            action=result["action"],
+            description=data["description"],
+            steps=[BuildStep.from_dict(step) for step in data["steps"]],
+        )
+
+
+def parse_builds(data: dict) -> List[BuildResult]:
+    # Из ответа /api/builds нужны только действие, описание и шаги, остальное не храним
+    return [BuildResult.from_dict(result) for result in data["result"]]
+
+
+# Заголовки общие для всех кошельков, User-Agent подставляет BrowserClient
+HEADERS = {
+    'Accept': 'application/json',
+    'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
+    'Accept-Encoding': 'gzip, deflate, zstd',
+    'Origin': 'https://www.brianknows.org',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-origin',
+    'Priority': 'u=0',
+    'Content-Type': 'application/json',
+}
 
 
 class BrianknowsClient:
+    __slots__ = ("browser_client", "transaction_executors", "address", "proxy", "points_claimed", "chain_points")
+
+    headers = HEADERS
+    wait_before_send_transaction = (3, 11)
+    max_retry = 3
+
     def __init__(self, browser_client, transaction_executors, address, proxy):
         self.browser_client = browser_client
         self.transaction_executors = transaction_executors
         self.address = address
         self.proxy = proxy
-        self.useragent = browser_client.user_agent
-
-        self.headers = {
-            'User-Agent': self.useragent,
-            'Accept': '*/*',
-            'Accept-Language': 'ru-RU,ru;q=0.8,en-US;q=0.5,en;q=0.3',
-            'Accept-Encoding': 'gzip, deflate, zstd',
-            'Origin': 'https://www.brianknows.org',
-            'Connection': 'keep-alive',
-            'Sec-Fetch-Dest': 'empty',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Site': 'same-origin',
-            'Priority': 'u=0'
-        }
-
-        self.wait_before_send_transaction = [3, 11]
-        self.max_retry = 3
+        self.points_claimed = 0
+        # Сети отрабатываются параллельно, поэтому поинты за действие считаем по сети
+        self.chain_points = Counter()
 
     async def get_nonce(self):
         response_data = await self.browser_client.request(
@@ -58,8 +111,9 @@ class BrianknowsClient:
         message = bytes.fromhex(prefixed_message[2:])
         message_encoded = encode_defunct(message)
 
-        signature = Account.sign_message(message_encoded,
-                                         private_key=self.transaction_executors['base'].account.key.hex())
+        # Подпись не зависит от сети, берем аккаунт любого исполнителя
+        account = next(iter(self.transaction_executors.values())).account
+        signature = Account.sign_message(message_encoded, private_key=account.key.hex())
         signature_hex = signature.signature.hex()
 
         if signature_hex[:2] != "0x":
@@ -91,9 +145,6 @@ class BrianknowsClient:
             "signature": signature
         }
 
-        headers = self.headers
-        headers['Content-Type'] = 'application/json'
-
         response_data = await self.browser_client.request(
             url="https://www.brianknows.org/api/auth/verify",
             method="POST",
@@ -120,28 +171,21 @@ class BrianknowsClient:
             logger.error(f"Authorized error: {e}")
 
     async def me(self):
-        headers = self.headers
-        headers['Content-Type'] = 'application/json'
-        headers['Accept'] = 'application/json'
-
         response_data = await self.browser_client.request(
             url="https://www.brianknows.org/api/auth/me",
             method="GET",
-            headers=headers,
+            headers=self.headers,
             proxy=self.proxy,
         )
 
         if response_data['response'].status == 200:
             data = response_data['data']
+            # BrowserClient декодирует только application/json, профиль иногда приходит с другим content-type
             if isinstance(data, str):
-                data = json.loads(data)
+                data = json_codec.loads(data)
             return data
 
     async def send_points(self, tx_hash, action, chain_id):
-        headers = self.headers
-        headers['Content-Type'] = 'application/json'
-        headers['Accept'] = 'application/json'
-
         payload = {
             "txHash": tx_hash,
             "action": action,
@@ -151,7 +195,7 @@ class BrianknowsClient:
         response_data = await self.browser_client.request(
             url="https://www.brianknows.org/api/points",
             method="POST",
-            headers=headers,
+            headers=self.headers,
             proxy=self.proxy,
             json=payload,
         )
@@ -159,14 +203,20 @@ class BrianknowsClient:
         if response_data['response'].status == 200:
             return True
 
-    async def build_and_run_promt(self, chain, query):
+    @metrics.timed("build_and_run_promt")
+    async def build_and_run_promt(self, chain, query, results: Optional[List[BuildResult]] = None):
+        if results is None:
+            results = await self.build(chain, query)
+
+        if not results:
+            return False
+
+        return await self.run_build(chain, results)
 
+    async def build(self, chain, query) -> List[BuildResult]:
         transaction_executor = self.transaction_executors[chain]
         chain_id = await transaction_executor.get_chain_id()
 
-        headers = self.headers
-        headers['Content-Type'] = 'application/json'
-
         payload = {
             "chain": chain_id,
             "query": query
@@ -175,17 +225,21 @@ class BrianknowsClient:
         results = []
 
         for retry in range(self.max_retry):
+            if retry > 0:
+                check_deadline()
+                metrics.inc("brian_build_retries_total")
+
             try:
                 response_data = await self.browser_client.request(
                     url="https://www.brianknows.org/api/builds",
                     method="POST",
-                    headers=headers,
+                    headers=self.headers,
                     proxy=self.proxy,
                     json=payload
                 )
 
                 if response_data['response'].status == 200:
-                    results = response_data['data']['result']
+                    results = parse_builds(response_data['data'])
                     break
 
                 if response_data['response'].status == 500:
@@ -193,7 +247,7 @@ class BrianknowsClient:
                     if "error" in response_data['data']:
                         message = response_data['data']['error']
                     logger.warning(f"Данное действие невозможно выполнить: {message}")
-                    return False
+                    return []
 
             except Exception as e:
                 logger.error("Ошибка" + str(e))
@@ -202,39 +256,44 @@ class BrianknowsClient:
 
         if len(results) == 0:
             logger.error("Ошибка при сборке запроса...")
-            return
+
+        return results
+
+    async def run_build(self, chain, results: List[BuildResult]):
+        transaction_executor = self.transaction_executors[chain]
+        chain_id = await transaction_executor.get_chain_id()
 
         await wait(random.randint(*self.wait_before_send_transaction))
 
         for result in results:
-            action = result['action']
-            data = result['data']
-            data_description = data['description']
-            data_steps = data['steps']
+            action = result.action
             success = False
             tx_hash = None
 
-            for step in data_steps:
-                logger.info("Описания действия от Brianknows: " + data_description)
+            for step in result.steps:
+                logger.info("Описания действия от Brianknows: " + result.description)
 
                 for retry in range(self.max_retry):
+                    if retry > 0:
+                        check_deadline()
+                        metrics.inc("brian_step_retries_total", chain=chain)
+
                     logger.info(f"Выполняем действие: {action} по {self.address}... ({retry}/{self.max_retry})")
 
                     try:
-                        if step["value"][:2] == "0x":
-                            amount_eth = Web3.from_wei(int(step["value"], 16), "ether")
-                        else:
-                            amount_eth = Web3.from_wei(int(step["value"]), "ether")
+                        amount_eth = Web3.from_wei(step.value, "ether")
 
                         status, tx_hash = await transaction_executor.send_contract_transaction(
-                            tx_data=step["data"],
-                            to_addr=Web3.to_checksum_address(step["to"]),
+                            tx_data=step.data,
+                            to_addr=Web3.to_checksum_address(step.to),
                             amount_eth=Decimal(amount_eth),
                         )
                         success = True
                         break
                     except InsufficientFunds:
                         logger.warning("Недостаточно баланса для выполнения данного действия...")
+                    except DeadlineExceeded:
+                        raise
                     except Exception as e:
                         logger.error("Ошибка при выполнении действия...")
                         logger.exception(e)
@@ -245,5 +304,7 @@ class BrianknowsClient:
 
             if success and await self.send_points(to_hex(tx_hash), action, chain_id):
                 logger.info("Транзакция на поинты успешно отправлена!")
+                self.points_claimed += 1
+                self.chain_points[chain] += 1
 
             return success
@@ -1,49 +1,152 @@
-import aiohttp
-import json
+import time
+from email.utils import parsedate_to_datetime
+from http.cookies import Morsel, SimpleCookie
+from typing import Dict, Optional, Tuple
+
 from pathlib import Path
-from fake_useragent import UserAgent
 from yarl import URL
 
+from src.modules.http_transport import get_transport
+from src.utils import json_codec
+from src.utils.metrics import metrics
+
+# (домен, путь, имя) -> (значение, истекает в unix time или None для сессионной, только https, только этот хост)
+CookieKey = Tuple[str, str, str]
+CookieValue = Tuple[str, Optional[float], bool, bool]
+
+
+def _domain_matches(host: str, domain: str) -> bool:
+    domain = domain.lstrip(".")
+    return host == domain or host.endswith("." + domain)
+
+
+def _path_matches(request_path: str, cookie_path: str) -> bool:
+    if request_path == cookie_path or cookie_path == "/":
+        return True
+    return request_path.startswith(cookie_path) and (
+        cookie_path.endswith("/") or request_path[len(cookie_path)] == "/"
+    )
+
+
+def _default_path(request_path: str) -> str:
+    if not request_path.startswith("/") or request_path.count("/") == 1:
+        return "/"
+    return request_path[:request_path.rfind("/")]
+
+
+def _parse_expires(value) -> Optional[float]:
+    if value in (None, ""):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _morsel_expires(morsel: Morsel, now: float) -> Optional[float]:
+    # Max-Age важнее Expires
+    if morsel["max-age"]:
+        try:
+            return now + int(morsel["max-age"])
+        except ValueError:
+            pass
+    return _parse_expires(morsel["expires"])
+
 
 class BrowserClient:
+    __slots__ = ("username", "proxy", "cookies_path", "ua_path", "meta_path", "cookies", "user_agent", "meta")
+
     def __init__(self, username: str, proxy: str = None, storage_dir="sessions"):
         self.username = username
         self.proxy = proxy
-        self.storage_path = Path(storage_dir)
-        self.cookies_path = self.storage_path / f"{username}_cookies.pkl"
-        self.ua_path = self.storage_path / f"{username}_ua.txt"
-        self.meta_path = self.storage_path / f"{username}_meta.json"
+        storage_path = Path(storage_dir)
+        self.cookies_path = storage_path / f"{username}_cookies.pkl"
+        self.ua_path = storage_path / f"{username}_ua.txt"
+        self.meta_path = storage_path / f"{username}_meta.json"
 
-        self.storage_path.mkdir(parents=True, exist_ok=True)
+        storage_path.mkdir(parents=True, exist_ok=True)
 
-        self.cookie_jar = aiohttp.CookieJar()
+        self.cookies: Dict[CookieKey, CookieValue] = {}
         self._load_cookies()
         self.user_agent = self._load_or_generate_user_agent()
         self.meta = self._load_meta()
 
-        connector = aiohttp.TCPConnector(ssl=False)
-
-        self.session = aiohttp.ClientSession(
-            cookie_jar=self.cookie_jar,
-            headers={"User-Agent": self.user_agent},
-            connector=connector
-        )
+    def _cookie_header(self, url: URL) -> Optional[str]:
+        now = time.time()
+        matched = []
+        for key, (value, expires_at, secure, host_only) in list(self.cookies.items()):
+            domain, path, name = key
+            if expires_at is not None and expires_at <= now:
+                del self.cookies[key]
+                continue
+            if not (url.host == domain if host_only else _domain_matches(url.host, domain)):
+                continue
+            if not _path_matches(url.path or "/", path) or (secure and url.scheme != "https"):
+                continue
+            matched.append((len(path), name, value))
+
+        # Куки с более длинным путем идут первыми
+        matched.sort(key=lambda item: -item[0])
+        return "; ".join(f"{name}={value}" for _, name, value in matched) or None
+
+    def _update_cookies(self, url: URL, response_cookies: SimpleCookie) -> None:
+        now = time.time()
+        for name, morsel in response_cookies.items():
+            domain = morsel["domain"].lstrip(".").lower()
+            host_only = not domain
+            if host_only:
+                domain = url.host
+            elif not _domain_matches(url.host, domain):
+                # Сервер не может ставить куки чужому домену
+                continue
+
+            key = (domain, morsel["path"] or _default_path(url.path), name)
+            expires_at = _morsel_expires(morsel, now)
+            if expires_at is not None and expires_at <= now:
+                self.cookies.pop(key, None)
+                continue
+            self.cookies[key] = (morsel.coded_value, expires_at, bool(morsel["secure"]), host_only)
 
     async def request(self, url: str, method: str = "GET", **kwargs) -> any:
         if self.proxy:
             kwargs["proxy"] = self.proxy
 
-        if "timeout" not in kwargs:
-            kwargs["timeout"] = aiohttp.ClientTimeout(total=60)
+        request_url = URL(url)
+
+        headers = {"User-Agent": self.user_agent, **(kwargs.pop("headers", None) or {})}
+        cookie_header = self._cookie_header(request_url)
+        if cookie_header:
+            headers["Cookie"] = cookie_header
+
+        start = time.perf_counter()
+        status = "error"
+        transport = get_transport()
 
-        async with self.session.request(method=method, url=url, **kwargs) as response:
-            #response.raise_for_status()
+        try:
+            response = await transport.request(method, url, headers, **kwargs)
+            status = response.status
+            self._update_cookies(request_url, response.cookies)
             result = {'response': response}
             if response.content_type == "application/json":
-                result['data'] = await response.json()
+                result['data'] = json_codec.loads(response.body)
             else:
-                result['data'] = await response.text()
+                result['data'] = response.body.decode(response.encoding, errors="replace")
             return result
+        except Exception as e:
+            metrics.inc("http_request_errors_total", host=request_url.host, path=request_url.path, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - start,
+                host=request_url.host,
+                path=request_url.path,
+                status=status,
+                proxy=bool(self.proxy),
+                transport=transport.name,
+            )
 
     def save(self):
         self._save_cookies()
@@ -52,12 +155,13 @@ class BrowserClient:
     async def close(self):
         self._save_cookies()
         self._save_meta()
-        await self.session.close()
 
     def _load_or_generate_user_agent(self) -> str:
         if self.ua_path.exists():
             return self.ua_path.read_text().strip()
         else:
+            from fake_useragent import UserAgent
+
             ua = UserAgent().random
             self.ua_path.write_text(ua)
             return ua
@@ -67,42 +171,42 @@ class BrowserClient:
             return
 
         try:
-            with open(self.cookies_path, "r", encoding="utf-8") as f:
-                cookies = json.load(f)
-                for c in cookies:
-                    self.cookie_jar.update_cookies(
-                        {c["key"]: c["value"]},
-                        response_url=URL(f"https://{c['domain']}")
-                    )
+            cookies = json_codec.load_file(self.cookies_path)
+            now = time.time()
+            for c in cookies:
+                # В старых файлах expires - строка HTTP-даты, а host_only нет
+                expires_at = _parse_expires(c.get("expires"))
+                if expires_at is not None and expires_at <= now:
+                    continue
+                key = (c["domain"].lstrip(".").lower(), c.get("path") or "/", c["key"])
+                self.cookies[key] = (c["value"], expires_at, bool(c.get("secure")), c.get("host_only", False))
         except Exception:
             pass
 
     def _save_cookies(self):
         cookies = []
-        for cookie in self.cookie_jar:
+        for (domain, path, name), (value, expires_at, secure, host_only) in self.cookies.items():
             cookies.append({
-                "key": cookie.key,
-                "value": cookie.value,
-                "domain": cookie["domain"],
-                "path": cookie["path"],
-                "secure": cookie["secure"],
-                "expires": cookie["expires"],
+                "key": name,
+                "value": value,
+                "domain": domain,
+                "path": path,
+                "secure": secure,
+                "expires": expires_at,
+                "host_only": host_only,
             })
-        with open(self.cookies_path, "w", encoding="utf-8") as f:
-            json.dump(cookies, f, indent=2)
+        json_codec.dump_file(self.cookies_path, cookies)
 
     def _load_meta(self):
         if self.meta_path.exists():
             try:
-                with open(self.meta_path, "r", encoding="utf-8") as f:
-                    return json.load(f)
+                return json_codec.load_file(self.meta_path)
             except Exception:
                 return {}
         return {}
 
     def _save_meta(self):
-        with open(self.meta_path, "w", encoding="utf-8") as f:
-            json.dump(self.meta, f, indent=2)
+        json_codec.dump_file(self.meta_path, self.meta)
 
     def set_param(self, key, value):
         self.meta[key] = value
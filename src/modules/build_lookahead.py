@@ -0,0 +1,80 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from loguru import logger
+
+from src.config import BuildLookaheadConfig
+from src.modules.brianknows_client import BrianknowsClient, BuildResult
+from src.modules.web3_transaction_exectutor import Web3TransactionExecutor
+from src.utils.metrics import metrics
+
+
+class BuildLookahead:
+    __slots__ = ("config", "brianknows_client", "transaction_executor", "chain", "query", "task", "started_at", "balance_wei")
+
+    def __init__(
+            self,
+            config: BuildLookaheadConfig,
+            brianknows_client: BrianknowsClient,
+            transaction_executor: Web3TransactionExecutor,
+            chain: str,
+    ):
+        self.config = config
+        self.brianknows_client = brianknows_client
+        self.transaction_executor = transaction_executor
+        self.chain = chain
+        self.query: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+        self.started_at = 0.0
+        self.balance_wei = 0
+
+    def start(self, query: str) -> None:
+        self.cancel()
+        self.query = query
+        self.started_at = time.monotonic()
+        self.task = asyncio.create_task(self._build(query))
+
+    async def _build(self, query: str) -> List[BuildResult]:
+        # Баланс на момент сборки: Brian считает суммы от него
+        self.balance_wei = await self.transaction_executor.get_balance()
+        return await self.brianknows_client.build(self.chain, query)
+
+    async def take(self, query: str) -> Optional[List[BuildResult]]:
+        if self.task is None or self.query != query:
+            return None
+
+        task, self.task, self.query = self.task, None, None
+
+        if time.monotonic() - self.started_at > self.config.build_ttl_sec:
+            task.cancel()
+            return self._discard("stale")
+
+        try:
+            results = await task
+        except Exception as e:
+            logger.warning(f"Заранее собранное действие '{query}' не получено: {e}")
+            return self._discard("error")
+
+        if not results:
+            return self._discard("empty")
+
+        balance_wei = await self.transaction_executor.get_balance()
+        changed_percent = abs(balance_wei - self.balance_wei) * 100 / max(self.balance_wei, 1)
+        required_wei = sum(step.value for result in results for step in result.steps)
+        if changed_percent > self.config.balance_tolerance_percent or balance_wei < required_wei:
+            logger.info(f"Баланс изменился на {changed_percent:.1f}% после сборки '{query}', собираем заново")
+            return self._discard("balance")
+
+        metrics.inc("brian_lookahead_total", chain=self.chain, result="used")
+        return results
+
+    def _discard(self, reason: str) -> None:
+        metrics.inc("brian_lookahead_total", chain=self.chain, result=reason)
+        return None
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+            self.query = None
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from loguru import logger
+from web3 import Web3
+from web3.eth import AsyncEth
+from web3.providers.async_base import AsyncBaseProvider
+from web3._utils.request import DEFAULT_TIMEOUT
+from web3.providers.async_rpc import AsyncHTTPProvider
+from web3.types import RPCResponse
+
+from src.config import (
+    FeeStrategyConfig,
+    GasEstimateCacheConfig,
+    GasSchedulerConfig,
+    NetworkConfig,
+    Web3TransactionExecutorConfig,
+)
+from src.modules.fee_strategy import FeeStrategy
+from src.modules.gas_estimate_cache import GasEstimateCache
+from src.modules.gas_scheduler import GasScheduler
+from src.modules.web3_transaction_exectutor import Web3TransactionExecutor
+from src.utils import json_codec
+from src.utils.dns_resolver import make_connector
+
+# Своя сессия для RPC вместо кеша сессий web3: коннектор с общим DNS-кешем и проверкой SSL
+_rpc_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_rpc_session() -> aiohttp.ClientSession:
+    global _rpc_session
+
+    if _rpc_session is None or _rpc_session.closed:
+        _rpc_session = aiohttp.ClientSession(
+            connector=make_connector(limit=0),
+            timeout=aiohttp.ClientTimeout(DEFAULT_TIMEOUT),
+        )
+    return _rpc_session
+
+
+async def close_rpc_session() -> None:
+    global _rpc_session
+
+    if _rpc_session is not None:
+        await _rpc_session.close()
+        _rpc_session = None
+
+
+def make_w3(provider) -> Web3:
+    return Web3(
+        provider,
+        modules={"eth": (AsyncEth,)},
+        middlewares=[],
+    )
+
+
+class FastJsonHTTPProvider(AsyncHTTPProvider):
+    async def make_request(self, method, params) -> RPCResponse:
+        request_data = self.encode_rpc_request(method, params)
+        async with get_rpc_session().post(self.endpoint_uri, data=request_data, **self.get_request_kwargs()) as response:
+            response.raise_for_status()
+            return self.decode_rpc_response(await response.read())
+
+    def decode_rpc_response(self, raw_response: bytes) -> RPCResponse:
+        return json_codec.loads(raw_response)
+
+
+def make_http_provider(rpc: str, proxy: Optional[str] = None):
+    return FastJsonHTTPProvider(rpc, request_kwargs={"proxy": proxy})
+
+
+class RpcPoolProvider(AsyncBaseProvider):
+    def __init__(self, providers: List[AsyncBaseProvider], name: str = ""):
+        super().__init__()
+        self.providers = providers
+        self.name = name
+        self._current = 0
+
+    async def is_connected(self, show_traceback: bool = False) -> bool:
+        return await self.providers[self._current].is_connected(show_traceback)
+
+    async def make_request(self, method, params):
+        last_exc = None
+
+        for _ in range(len(self.providers)):
+            provider = self.providers[self._current]
+            try:
+                return await provider.make_request(method, params)
+            except Exception as e:
+                last_exc = e
+                if len(self.providers) > 1:
+                    logger.warning(f"RPC {provider} сети {self.name} недоступен ({e}), переключаемся на следующий")
+                self._current = (self._current + 1) % len(self.providers)
+
+        raise last_exc
+
+
+class ChainRegistry:
+    def __init__(
+            self,
+            networks: Dict[str, NetworkConfig],
+            chains: List[str],
+            transaction_executor_config: Web3TransactionExecutorConfig,
+            gas_scheduler_config: Optional[GasSchedulerConfig] = None,
+            gas_estimate_cache_config: Optional[GasEstimateCacheConfig] = None,
+            fee_strategy_config: Optional[FeeStrategyConfig] = None,
+            w3_cache_size: int = 256,
+    ) -> None:
+        unknown = [chain for chain in chains if chain not in networks]
+        if unknown:
+            raise ValueError(f"Для сетей {unknown} нет настроек в networks")
+
+        self.networks = networks
+        self.chains = list(chains)
+        self.executor_configs = {
+            chain: self._make_executor_config(transaction_executor_config, networks[chain])
+            for chain in self.chains
+        }
+
+        # Кеш общий для всех сетей и кошельков, chain id входит в ключ
+        self.gas_estimate_cache: Optional[GasEstimateCache] = None
+        if gas_estimate_cache_config is not None and gas_estimate_cache_config.enabled:
+            self.gas_estimate_cache = GasEstimateCache(gas_estimate_cache_config)
+
+        # Web3 без состояния кошелька, поэтому один экземпляр на (сеть, прокси) для всех кошельков.
+        # С прокси на кошелек ключей столько же, сколько кошельков, поэтому держим только последние
+        self.w3_cache_size = w3_cache_size
+        self._w3s: "OrderedDict[Tuple[str, Optional[str]], Web3]" = OrderedDict()
+
+        self.fee_strategies: Dict[str, FeeStrategy] = {}
+        if fee_strategy_config is not None and fee_strategy_config.enabled:
+            for chain in self.chains:
+                self.fee_strategies[chain] = FeeStrategy(
+                    fee_strategy_config,
+                    Web3TransactionExecutor(
+                        w3=self.make_w3(chain),
+                        account=None,
+                        config=self.executor_configs[chain],
+                    ),
+                    name=chain,
+                    block_time_sec=networks[chain].block_time_sec,
+                )
+
+        self.gas_schedulers: Dict[str, GasScheduler] = {}
+        if gas_scheduler_config is not None and gas_scheduler_config.enabled:
+            for chain in self.chains:
+                self.gas_schedulers[chain] = GasScheduler(
+                    gas_scheduler_config,
+                    Web3TransactionExecutor(
+                        w3=self.make_w3(chain),
+                        account=None,
+                        config=self.executor_configs[chain],
+                    ),
+                    name=chain,
+                )
+
+    @staticmethod
+    def _make_executor_config(
+            base_config: Web3TransactionExecutorConfig, network: NetworkConfig
+    ) -> Web3TransactionExecutorConfig:
+        update = {"explorer_url": network.explorer_url}
+        for field in (
+                "gas_price_multiplier",
+                "max_gas_price_eth_gwei_bridge_action",
+                "max_gas_price_eth_gwei_usual_actions",
+        ):
+            value = getattr(network, field)
+            if value is not None:
+                update[field] = value
+
+        return base_config.model_copy(update=update)
+
+    def make_w3(
+            self,
+            chain: str,
+            proxy: Optional[str] = None,
+            provider_factory: Callable[[str, Optional[str]], AsyncBaseProvider] = make_http_provider,
+    ) -> Web3:
+        providers = [provider_factory(rpc, proxy) for rpc in self.networks[chain].rpcs]
+        if len(providers) == 1:
+            return make_w3(providers[0])
+        return make_w3(RpcPoolProvider(providers, name=chain))
+
+    def get_w3(
+            self,
+            chain: str,
+            proxy: Optional[str] = None,
+            provider_factory: Callable[[str, Optional[str]], AsyncBaseProvider] = make_http_provider,
+    ) -> Web3:
+        key = (chain, proxy)
+        w3 = self._w3s.get(key)
+        if w3 is not None:
+            self._w3s.move_to_end(key)
+            return w3
+
+        w3 = self._w3s[key] = self.make_w3(chain, proxy, provider_factory)
+        # Закрывать нечего: провайдеры ходят через общую RPC-сессию, кошелек с вытесненным w3 доработает на нем
+        while len(self._w3s) > self.w3_cache_size:
+            self._w3s.popitem(last=False)
+        return w3
+
+    def make_executors(self, w3s: Dict[str, Web3], account) -> Dict[str, Web3TransactionExecutor]:
+        return {
+            chain: Web3TransactionExecutor(
+                w3=w3,
+                config=self.executor_configs[chain],
+                account=account,
+                gas_scheduler=self.gas_schedulers.get(chain),
+                gas_estimate_cache=self.gas_estimate_cache,
+                fee_strategy=self.fee_strategies.get(chain),
+            )
+            for chain, w3 in w3s.items()
+        }
+
+    def close(self) -> None:
+        for gas_scheduler in self.gas_schedulers.values():
+            gas_scheduler.close()
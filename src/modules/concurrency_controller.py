@@ -0,0 +1,171 @@
+import asyncio
+import math
+from contextlib import asynccontextmanager, nullcontext
+from typing import List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.utils.metrics import Histogram, metrics
+
+OVERLOAD_STATUSES = ("error", "502", "503", "504")
+
+
+class AdaptiveConcurrencyConfig(BaseModel):
+    enabled: bool = False
+    min_concurrency: int = 1
+    max_concurrency: int = 32
+    interval_sec: float = 30
+    increase_step: int = 1
+    decrease_factor: float = 0.7
+    min_samples: int = 20  # меньше запросов в окне - по ошибкам и задержкам не судим
+    max_error_rate: float = 0.05
+    max_http_p95_sec: float = 5
+    max_rpc_p95_sec: float = 2.5
+    max_loop_lag_sec: float = 0.2
+    loop_lag_sample_sec: float = 0.25
+
+
+class MetricsWindow:
+    # Счетчики на начало окна, чтобы считать только то, что произошло за интервал
+    def __init__(self):
+        self.http = metrics.merged_histogram("http_request_duration_seconds")
+        self.http_throttled = self._http_throttled()
+        self.http_errors = self._http_errors()
+        self.rpc = metrics.merged_histogram("rpc_call_duration_seconds")
+        self.rpc_errors = self._rpc_errors()
+
+    @staticmethod
+    def _http_throttled() -> int:
+        return metrics.merged_histogram(
+            "http_request_duration_seconds", lambda labels: labels.get("status") == "429"
+        ).count
+
+    @staticmethod
+    def _http_errors() -> int:
+        # Только сбои транспорта и перегрузки шлюзов: /api/builds отвечает 500 на невыполнимый промпт
+        return metrics.merged_histogram(
+            "http_request_duration_seconds", lambda labels: labels.get("status") in OVERLOAD_STATUSES
+        ).count
+
+    @staticmethod
+    def _rpc_errors() -> float:
+        # Реверты и нехватка баланса говорят о кошельке, а не о перегрузке ноды
+        return metrics.counter_total("rpc_errors_total", lambda labels: labels.get("kind") == "overload")
+
+
+class ConcurrencyController:
+    def __init__(self, config: AdaptiveConcurrencyConfig, initial: int):
+        self.config = config
+        self.limit = min(max(initial, config.min_concurrency), config.max_concurrency)
+        self.active = 0
+        self.saturated = False
+        self.condition = asyncio.Condition()
+        self.loop_lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def slot(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+            if self.active >= self.limit:
+                self.saturated = True
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def start(self) -> None:
+        logger.info(
+            f"Адаптивная параллельность: старт с {self.limit}, "
+            f"пределы {self.config.min_concurrency}-{self.config.max_concurrency}"
+        )
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        window = MetricsWindow()
+        window_end = loop.time() + self.config.interval_sec
+
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.config.loop_lag_sample_sec)
+            self.loop_lags.append(max(0.0, loop.time() - start - self.config.loop_lag_sample_sec))
+
+            if loop.time() < window_end:
+                continue
+
+            try:
+                await self._adjust(window)
+            except Exception as e:
+                logger.error(f"Ошибка регулятора параллельности: {e}")
+            window = MetricsWindow()
+            window_end = loop.time() + self.config.interval_sec
+            self.loop_lags.clear()
+            self.saturated = self.active >= self.limit
+
+    def _overload_reason(self, window: MetricsWindow) -> Optional[str]:
+        config = self.config
+        now = MetricsWindow()
+
+        throttled = now.http_throttled - window.http_throttled
+        if throttled > 0:
+            return f"ответов 429: {throttled}"
+
+        http: Histogram = now.http.delta(window.http)
+        rpc: Histogram = now.rpc.delta(window.rpc)
+        requests = http.count + rpc.count
+        if requests >= config.min_samples:
+            errors = (now.http_errors - window.http_errors) + (now.rpc_errors - window.rpc_errors)
+            if errors / requests > config.max_error_rate:
+                return f"доля ошибок {errors / requests:.0%} ({errors} из {requests})"
+
+        if http.count >= config.min_samples and http.quantile(0.95) > config.max_http_p95_sec:
+            return f"p95 HTTP {http.quantile(0.95)} сек"
+        if rpc.count >= config.min_samples and rpc.quantile(0.95) > config.max_rpc_p95_sec:
+            return f"p95 RPC {rpc.quantile(0.95)} сек"
+
+        if self.loop_lags:
+            lags = sorted(self.loop_lags)
+            lag_p95 = lags[min(len(lags) - 1, int(len(lags) * 0.95))]
+            if lag_p95 > config.max_loop_lag_sec:
+                return f"лаг event loop {lag_p95 * 1000:.0f} мс"
+
+        return None
+
+    async def _adjust(self, window: MetricsWindow) -> None:
+        config = self.config
+        reason = self._overload_reason(window)
+
+        if reason is not None:
+            new_limit = max(config.min_concurrency, math.floor(self.limit * config.decrease_factor))
+            if new_limit < self.limit:
+                logger.warning(f"Параллельность {self.limit} -> {new_limit}: {reason}")
+                metrics.inc("concurrency_adjustments_total", direction="down")
+            self.limit = new_limit
+            return
+
+        # Увеличиваем, только если все слоты были заняты, иначе прибавка ничего не даст
+        if self.saturated and self.limit < config.max_concurrency:
+            new_limit = min(config.max_concurrency, self.limit + config.increase_step)
+            logger.info(f"Параллельность {self.limit} -> {new_limit}")
+            metrics.inc("concurrency_adjustments_total", direction="up")
+            async with self.condition:
+                self.limit = new_limit
+                self.condition.notify(config.increase_step)
+
+
+def worker_slot(controller: Optional[ConcurrencyController]):
+    return controller.slot() if controller is not None else nullcontext()
+
+
+def workers_count(concurrency: int, controller: Optional[ConcurrencyController]) -> int:
+    # При адаптивной параллельности воркеров заводим по максимуму, лишние ждут слота
+    return controller.config.max_concurrency if controller is not None else max(1, concurrency)
@@ -12,6 +12,14 @@ class DataFileIterator:
         if shuffle:
             random.shuffle(self.data_infos)
 
+    @classmethod
+    def from_rows(cls, rows: list) -> "DataFileIterator":
+        iterator = cls.__new__(cls)
+        iterator.path = None
+        iterator.data_infos = list(rows)
+        iterator._index = 0
+        return iterator
+
     def parse(self) -> None:
         with open(self.path, "r") as f:
             for line in f:
@@ -0,0 +1,391 @@
+import asyncio
+import ipaddress
+import socket
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Deque, Dict, List, Literal, Optional, Set
+from urllib.parse import urlparse
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.modules.data_file_iterator import DataFileIterator
+from src.utils import json_codec
+from src.utils.helper import wallet_id
+
+if TYPE_CHECKING:
+    from src.config import Config
+
+
+class DistributedConfig(BaseModel):
+    mode: Literal["local", "coordinator", "worker"] = "local"
+    host: str = "127.0.0.1"
+    port: int = 8765
+    coordinator_url: str = "http://127.0.0.1:8765"
+    auth_token: str = ""
+    lease_ttl_sec: int = 300
+    heartbeat_interval_sec: int = 60
+    journal_path: str = "logs/journal.jsonl"
+    poll_interval_sec: int = 10
+    max_unreachable_sec: int = 600  # столько координатор может не отвечать, прежде чем воркер завершится
+    finished_grace_sec: int = 60  # после завершения координатор еще отвечает воркерам 410, чтобы они вышли
+    worker_id: Optional[str] = None
+
+
+class Lease:
+    __slots__ = ("lease_id", "wallet_idx", "worker_id", "expires_at")
+
+    def __init__(self, lease_id: str, wallet_idx: int, worker_id: str, expires_at: float):
+        self.lease_id = lease_id
+        self.wallet_idx = wallet_idx
+        self.worker_id = worker_id
+        self.expires_at = expires_at
+
+
+class RunJournal:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def load_finished(self) -> Set[str]:
+        finished = set()
+        if not self.path.exists():
+            return finished
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json_codec.loads(line)
+                except ValueError:
+                    continue
+                # Упавшие кошельки при повторном запуске координатора берем в работу снова
+                if event.get("event") == "done":
+                    finished.add(event["wallet_id"])
+
+        return finished
+
+    def write(self, event: str, wallet: str, **fields) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json_codec.dumps_str({"time": time.time(), "event": event, "wallet_id": wallet, **fields}) + "\n")
+
+
+class Coordinator:
+    def __init__(self, config: DistributedConfig, rows: List[list]):
+        self.config = config
+        self.rows = rows
+        self.journal = RunJournal(config.journal_path)
+
+        finished = self.journal.load_finished()
+        self.wallet_ids = [wallet_id(row[0]) for row in rows]
+        self.pending: Deque[int] = deque(
+            idx for idx, wallet in enumerate(self.wallet_ids) if wallet not in finished
+        )
+        self.leases: Dict[str, Lease] = {}
+        self.finished_count = len(rows) - len(self.pending)
+        self.all_done = asyncio.Event()
+
+        if not self.pending:
+            self.all_done.set()
+
+    def lease(self, worker_id: str) -> Optional[Lease]:
+        if not self.pending:
+            return None
+
+        wallet_idx = self.pending.popleft()
+        lease = Lease(uuid.uuid4().hex, wallet_idx, worker_id, time.time() + self.config.lease_ttl_sec)
+        self.leases[lease.lease_id] = lease
+        self.journal.write("leased", self.wallet_ids[wallet_idx], worker_id=worker_id)
+        return lease
+
+    def heartbeat(self, lease_id: str) -> bool:
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return False
+
+        lease.expires_at = time.time() + self.config.lease_ttl_sec
+        return True
+
+    def complete(self, lease_id: str, success: bool, error: Optional[str] = None) -> bool:
+        lease = self.leases.pop(lease_id, None)
+        if lease is None:
+            return False
+
+        self.journal.write(
+            "done" if success else "failed", self.wallet_ids[lease.wallet_idx], worker_id=lease.worker_id, error=error
+        )
+        self.finished_count += 1
+
+        if not self.pending and not self.leases:
+            self.all_done.set()
+        return True
+
+    def expire_leases(self) -> None:
+        now = time.time()
+        for lease in [lease for lease in self.leases.values() if lease.expires_at < now]:
+            del self.leases[lease.lease_id]
+            self.pending.appendleft(lease.wallet_idx)
+            self.journal.write("expired", self.wallet_ids[lease.wallet_idx], worker_id=lease.worker_id)
+            logger.warning(f"Аренда кошелька #{lease.wallet_idx + 1} воркером {lease.worker_id} истекла, переназначаем")
+
+    def status(self) -> dict:
+        return {
+            "total": len(self.rows),
+            "finished": self.finished_count,
+            "pending": len(self.pending),
+            "leased": len(self.leases),
+        }
+
+
+def is_loopback_host(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_coordinator_app(coordinator: Coordinator, auth_token: str):
+    from aiohttp import web
+
+    @web.middleware
+    async def auth_middleware(request, handler):
+        if auth_token and request.headers.get("Authorization") != f"Bearer {auth_token}":
+            return web.json_response({"error": "unauthorized"}, status=401)
+        return await handler(request)
+
+    async def handle_lease(request):
+        payload = await request.json(loads=json_codec.loads)
+        lease = coordinator.lease(payload["worker_id"])
+
+        if lease is None:
+            if coordinator.all_done.is_set():
+                return web.json_response({"status": "finished"}, status=410)
+            return web.Response(status=204)
+
+        return web.json_response({
+            "lease_id": lease.lease_id,
+            "wallet_idx": lease.wallet_idx,
+            "total": len(coordinator.rows),
+            "row": coordinator.rows[lease.wallet_idx],
+            "lease_ttl_sec": coordinator.config.lease_ttl_sec,
+        })
+
+    async def handle_heartbeat(request):
+        payload = await request.json(loads=json_codec.loads)
+        if coordinator.heartbeat(payload["lease_id"]):
+            return web.json_response({"ok": True})
+        return web.json_response({"ok": False}, status=404)
+
+    async def handle_complete(request):
+        payload = await request.json(loads=json_codec.loads)
+        if coordinator.complete(payload["lease_id"], payload.get("success", False), payload.get("error")):
+            return web.json_response({"ok": True})
+        return web.json_response({"ok": False}, status=404)
+
+    async def handle_status(request):
+        return web.json_response(coordinator.status())
+
+    app = web.Application(middlewares=[auth_middleware])
+    app.router.add_post("/lease", handle_lease)
+    app.router.add_post("/heartbeat", handle_heartbeat)
+    app.router.add_post("/complete", handle_complete)
+    app.router.add_get("/status", handle_status)
+    return app
+
+
+async def run_coordinator(config: "Config") -> None:
+    from aiohttp import web
+
+    distributed_config = config.distributed
+    if not distributed_config.auth_token and not is_loopback_host(distributed_config.host):
+        # /lease отдает строку файла ключей вместе с приватным ключом
+        raise ValueError(
+            f"Координатор на {distributed_config.host} без auth_token раздаст приватные ключи всей сети: "
+            f"задайте distributed.auth_token или слушайте 127.0.0.1"
+        )
+
+    keys_file_iterator = DataFileIterator(path=config.keys_file_path, shuffle=config.shuffle_keys)
+    coordinator = Coordinator(distributed_config, keys_file_iterator.data_infos)
+
+    logger.info(
+        f"Координатор: всего кошельков {len(coordinator.rows)}, "
+        f"уже отработано по журналу {coordinator.finished_count}"
+    )
+
+    runner = web.AppRunner(make_coordinator_app(coordinator, distributed_config.auth_token))
+    await runner.setup()
+    await web.TCPSite(runner, distributed_config.host, distributed_config.port).start()
+
+    logger.info(f"Координатор слушает {distributed_config.host}:{distributed_config.port}")
+
+    try:
+        while not coordinator.all_done.is_set():
+            coordinator.expire_leases()
+            try:
+                await asyncio.wait_for(coordinator.all_done.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+        logger.success("Координатор: все кошельки отработаны")
+        # Воркеры узнают о завершении только из ответа 410 на /lease, без него они бесконечно ждут координатора
+        await asyncio.sleep(distributed_config.finished_grace_sec)
+    finally:
+        await runner.cleanup()
+
+
+class CoordinatorClient:
+    def __init__(self, config: DistributedConfig, worker_id: str):
+        import aiohttp
+
+        from src.utils.dns_resolver import make_connector
+
+        self.config = config
+        self.worker_id = worker_id
+        self.base_url = config.coordinator_url.rstrip("/")
+
+        headers = {}
+        if config.auth_token:
+            headers["Authorization"] = f"Bearer {config.auth_token}"
+        self.session = aiohttp.ClientSession(
+            headers=headers,
+            connector=make_connector(),
+            timeout=aiohttp.ClientTimeout(total=30),
+            json_serialize=json_codec.dumps_str,
+        )
+
+    async def post(self, path: str, payload: dict):
+        async with self.session.post(self.base_url + path, json=payload) as response:
+            data = await response.json(loads=json_codec.loads) if response.status not in (204,) else None
+            return response.status, data
+
+    async def lease(self):
+        return await self.post("/lease", {"worker_id": self.worker_id})
+
+    async def heartbeat(self, lease_id: str) -> bool:
+        status, _ = await self.post("/heartbeat", {"lease_id": lease_id})
+        return status == 200
+
+    async def complete(self, lease_id: str, success: bool, error: Optional[str] = None) -> None:
+        await self.post("/complete", {"lease_id": lease_id, "success": success, "error": error})
+
+    async def close(self):
+        await self.session.close()
+
+
+async def heartbeat_loop(client: CoordinatorClient, lease_id: str, interval_sec: int) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            if not await client.heartbeat(lease_id):
+                logger.warning("Координатор не узнал аренду, кошелек может быть переназначен")
+        except Exception as e:
+            logger.error(f"Не удалось отправить heartbeat координатору: {e}")
+
+
+async def run_worker(config: "Config") -> None:
+    from src.main import create_activity_index, create_chain_registry, create_concurrency_controller, process_account
+    from src.modules.http_transport import close_transport
+    from src.modules.chain_registry import close_rpc_session
+    from src.modules.concurrency_controller import worker_slot, workers_count
+    from src.modules.step_executor import StepExecutor
+
+    distributed_config = config.distributed
+    coordinator_host = urlparse(distributed_config.coordinator_url).hostname or ""
+    if not is_loopback_host(coordinator_host):
+        if not distributed_config.auth_token:
+            raise ValueError(
+                f"Воркер без auth_token не подключится к координатору {coordinator_host}: "
+                f"задайте distributed.auth_token"
+            )
+        if urlparse(distributed_config.coordinator_url).scheme != "https":
+            logger.warning(
+                f"Координатор {distributed_config.coordinator_url} без https: приватные ключи и auth_token "
+                f"передаются открытым текстом, поставьте перед ним TLS-прокси"
+            )
+
+    worker_id = distributed_config.worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:6]}"
+    client = CoordinatorClient(distributed_config, worker_id)
+    chain_registry = create_chain_registry(config)
+    activity_index = create_activity_index(config)
+    concurrency_controller = create_concurrency_controller(config)
+
+    logger.info(f"Воркер {worker_id} подключается к координатору {distributed_config.coordinator_url}")
+    unreachable_since = None
+
+    async def lease_and_process(step_executor: StepExecutor) -> bool:
+        nonlocal unreachable_since
+
+        try:
+            status, data = await client.lease()
+        except Exception as e:
+            now = time.monotonic()
+            unreachable_since = unreachable_since or now
+            if now - unreachable_since >= distributed_config.max_unreachable_sec:
+                logger.error(
+                    f"Координатор недоступен дольше {distributed_config.max_unreachable_sec} сек, завершаем воркер: {e}"
+                )
+                return False
+            logger.error(f"Координатор недоступен: {e}")
+            await asyncio.sleep(distributed_config.poll_interval_sec)
+            return True
+
+        unreachable_since = None
+
+        if status == 410:
+            return False
+        if status != 200:
+            await asyncio.sleep(distributed_config.poll_interval_sec)
+            return True
+
+        private_key, *other_data = data["row"]
+        heartbeat = asyncio.create_task(
+            heartbeat_loop(client, data["lease_id"], distributed_config.heartbeat_interval_sec)
+        )
+
+        success, error = False, None
+        try:
+            failure = await process_account(
+                config, step_executor, data["wallet_idx"], data["total"], private_key, other_data
+            )
+            success, error = failure is None, str(failure) if failure is not None else None
+        except Exception as e:
+            error = str(e)
+        finally:
+            heartbeat.cancel()
+
+        try:
+            await client.complete(data["lease_id"], success, error)
+        except Exception as e:
+            logger.error(f"Не удалось отчитаться координатору: {e}")
+        return True
+
+    async def lease_loop():
+        step_executor = StepExecutor(
+            config.step_executor,
+            config.base_web3_transaction_executor,
+            chain_registry=chain_registry,
+            activity_index=activity_index,
+        )
+
+        # Слот берем до аренды, чтобы не держать у себя кошелек, который ждет очереди
+        while True:
+            async with worker_slot(concurrency_controller):
+                if not await lease_and_process(step_executor):
+                    return
+
+    if concurrency_controller is not None:
+        concurrency_controller.start()
+
+    try:
+        await asyncio.gather(*[lease_loop() for _ in range(workers_count(config.concurrency, concurrency_controller))])
+        if unreachable_since is None:
+            logger.success(f"Воркер {worker_id}: координатор сообщил, что работа закончена")
+    finally:
+        if concurrency_controller is not None:
+            concurrency_controller.stop()
+        chain_registry.close()
+        await client.close()
+        await close_transport()
+        await close_rpc_session()
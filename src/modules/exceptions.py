@@ -20,4 +20,11 @@ class OkxApiException(Exception):
 
 
 class OkxTemporaryUnavailableException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class ProxyUnavailable(Exception):
+    pass
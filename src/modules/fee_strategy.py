@@ -0,0 +1,111 @@
+import asyncio
+import statistics
+import time
+from typing import Dict, Literal, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.utils.metrics import metrics
+
+FeeProfileName = Literal["economy", "normal", "fast"]
+
+
+class FeeProfileConfig(BaseModel):
+    reward_percentile: float
+    base_fee_multiplier: float
+    expected_blocks: int
+
+
+class FeeStrategyConfig(BaseModel):
+    enabled: bool = False
+    profile: FeeProfileName = "normal"
+    history_blocks: int = 20
+    cache_ttl_sec: float = 6
+    min_priority_fee_wei: int = 1000
+    profiles: Dict[str, FeeProfileConfig] = {
+        "economy": FeeProfileConfig(reward_percentile=10, base_fee_multiplier=1.125, expected_blocks=6),
+        "normal": FeeProfileConfig(reward_percentile=50, base_fee_multiplier=1.25, expected_blocks=3),
+        "fast": FeeProfileConfig(reward_percentile=90, base_fee_multiplier=2, expected_blocks=1),
+    }
+
+
+class Fees:
+    __slots__ = ("profile", "base_fee_per_gas", "max_priority_fee_per_gas", "max_fee_per_gas", "expected_inclusion_sec")
+
+    def __init__(
+            self,
+            profile: str,
+            base_fee_per_gas: int,
+            max_priority_fee_per_gas: int,
+            max_fee_per_gas: int,
+            expected_inclusion_sec: float,
+    ):
+        self.profile = profile
+        self.base_fee_per_gas = base_fee_per_gas
+        self.max_priority_fee_per_gas = max_priority_fee_per_gas
+        self.max_fee_per_gas = max_fee_per_gas
+        self.expected_inclusion_sec = expected_inclusion_sec
+
+
+class FeeStrategy:
+    def __init__(self, config: FeeStrategyConfig, transaction_executor, name: str = "base", block_time_sec: float = 2):
+        self.config = config
+        self.transaction_executor = transaction_executor
+        self.name = name
+        self.block_time_sec = block_time_sec
+
+        self._fees: Dict[str, Fees] = {}
+        self._updated_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get_fees(self, profile: Optional[str] = None) -> Optional[Fees]:
+        profile = profile or self.config.profile
+
+        # Историю комиссий запрашиваем одну на сеть, все кошельки используют кеш
+        async with self._lock:
+            if time.monotonic() - self._updated_at > self.config.cache_ttl_sec:
+                await self._refresh()
+
+        return self._fees.get(profile)
+
+    async def _refresh(self) -> None:
+        # eth_feeHistory требует перцентили по возрастанию, профили могут идти в любом порядке
+        percentiles = sorted({profile.reward_percentile for profile in self.config.profiles.values()})
+
+        try:
+            fee_history = await self.transaction_executor.get_fee_history(
+                self.config.history_blocks, "latest", percentiles
+            )
+            # rpc_error_handler_decorator возвращает None, когда исчерпал попытки
+            if fee_history is None:
+                raise RuntimeError("RPC не вернул историю комиссий")
+        except Exception as e:
+            # Без eth_feeHistory исполнитель откатывается на eth_gasPrice
+            logger.warning(f"Не удалось получить eth_feeHistory в сети {self.name}: {e}")
+            metrics.inc("fee_history_errors_total", chain=self.name)
+            self._fees = {}
+            self._updated_at = time.monotonic()
+            return
+
+        # Последний элемент baseFeePerGas — базовая комиссия следующего блока
+        base_fee = int(fee_history["baseFeePerGas"][-1])
+        rewards = fee_history.get("reward") or []
+
+        fees = {}
+        for name, profile in self.config.profiles.items():
+            idx = percentiles.index(profile.reward_percentile)
+            block_rewards = [int(block_reward[idx]) for block_reward in rewards if len(block_reward) > idx]
+            tip = int(statistics.median(block_rewards)) if block_rewards else 0
+            tip = max(tip, self.config.min_priority_fee_wei)
+
+            fees[name] = Fees(
+                profile=name,
+                base_fee_per_gas=base_fee,
+                max_priority_fee_per_gas=tip,
+                max_fee_per_gas=int(base_fee * profile.base_fee_multiplier) + tip,
+                expected_inclusion_sec=profile.expected_blocks * self.block_time_sec,
+            )
+
+        self._fees = fees
+        self._updated_at = time.monotonic()
@@ -0,0 +1,86 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from pydantic import BaseModel
+
+from src.utils.metrics import metrics
+
+CacheKey = Tuple[int, str, str, bool]
+
+
+class GasEstimateCacheConfig(BaseModel):
+    enabled: bool = False
+    ttl_sec: int = 1800
+    revalidate_every: int = 20
+    initial_margin: float = 1.25
+    min_margin: float = 1.1
+    max_margin: float = 2.0
+
+
+class GasEstimateEntry:
+    __slots__ = ("estimate", "margin", "created_at", "hits")
+
+    def __init__(self, estimate: int, margin: float):
+        self.estimate = estimate
+        self.margin = margin
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class GasEstimateCache:
+    def __init__(self, config: GasEstimateCacheConfig):
+        self.config = config
+        self.entries: Dict[CacheKey, GasEstimateEntry] = {}
+
+    @staticmethod
+    def make_key(chain_id: int, tx: dict) -> CacheKey:
+        data = tx.get("data") or "0x"
+        if isinstance(data, bytes):
+            data = "0x" + data.hex()
+        return chain_id, str(tx.get("to", "")).lower(), data[:10].lower(), bool(tx.get("value"))
+
+    def is_stale(self, entry: GasEstimateEntry) -> bool:
+        return time.time() - entry.created_at > self.config.ttl_sec or entry.hits >= self.config.revalidate_every
+
+    def get(self, key: CacheKey) -> Optional[int]:
+        entry = self.entries.get(key)
+        if entry is None:
+            metrics.inc("gas_estimate_cache_total", result="miss")
+            return None
+
+        if self.is_stale(entry):
+            metrics.inc("gas_estimate_cache_total", result="revalidate")
+            return None
+
+        entry.hits += 1
+        metrics.inc("gas_estimate_cache_total", result="hit")
+        return int(entry.estimate * entry.margin)
+
+    def put(self, key: CacheKey, estimate: int) -> None:
+        entry = self.entries.get(key)
+        margin = entry.margin if entry is not None else self.config.initial_margin
+
+        # Запас держим от максимума, чтобы разные суммы на одном селекторе не уходили в out of gas;
+        # устаревшую запись заменяем живой оценкой. Запись пересоздается всегда, иначе TTL не сбросится
+        if entry is not None and not self.is_stale(entry):
+            estimate = max(estimate, entry.estimate)
+
+        self.entries[key] = GasEstimateEntry(estimate, margin)
+
+    def observe(self, key: CacheKey, gas_limit: int, gas_used: int) -> None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return
+
+        if gas_used >= gas_limit:
+            # Транзакция уперлась в лимит, увеличиваем запас и сбрасываем кеш до живой оценки
+            entry.margin = min(self.config.max_margin, entry.margin * 1.5)
+            entry.hits = self.config.revalidate_every
+            return
+
+        ratio = gas_used / entry.estimate if entry.estimate else 1
+        target = max(self.config.min_margin, ratio * self.config.min_margin)
+        entry.margin = min(self.config.max_margin, 0.8 * entry.margin + 0.2 * target)
+
+    def invalidate(self, key: CacheKey) -> None:
+        self.entries.pop(key, None)
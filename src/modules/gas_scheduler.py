@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.modules.exceptions import DeadlineExceeded
+from src.utils.deadline import wait_for
+from src.utils.metrics import metrics
+
+
+class GasSchedulerConfig(BaseModel):
+    enabled: bool = False
+    poll_interval_sec: float = 15
+    history_window_sec: int = 3600
+    low_fee_percentile: float = 30
+    min_history_size: int = 10
+    trend_alpha: float = 0.3
+    release_interval_sec: float = 5
+    releases_per_interval: int = 1
+    max_hold_sec: int = 1800
+
+
+class GasScheduler:
+    def __init__(self, config: GasSchedulerConfig, transaction_executor, name: str = "base"):
+        self.config = config
+        self.transaction_executor = transaction_executor
+        self.name = name
+
+        self.history: Deque[Tuple[float, int]] = deque()
+        self.waiters: Deque[Tuple[int, float, asyncio.Future]] = deque()
+        self.trend: Optional[float] = None
+        self.current_gas_price: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def acquire(self, max_gas_price: int) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((max_gas_price, time.monotonic(), future))
+        metrics.inc("gas_scheduler_enqueued_total", chain=self.name)
+
+        if self._task is None or self._task.done():
+            # Опросчик общий для всех кошельков: пустой контекст, чтобы он не унаследовал дедлайн первого из них
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+        try:
+            await wait_for(future)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            self._remove_waiter(future)
+            raise
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _remove_waiter(self, future: asyncio.Future) -> None:
+        for item in self.waiters:
+            if item[2] is future:
+                self.waiters.remove(item)
+                return
+
+    def low_fee_threshold(self) -> Optional[int]:
+        if len(self.history) < self.config.min_history_size:
+            return None
+
+        ordered = sorted(gas_price for _, gas_price in self.history)
+        idx = int(len(ordered) * self.config.low_fee_percentile / 100)
+        return ordered[min(idx, len(ordered) - 1)]
+
+    def in_low_fee_window(self, gas_price: int) -> bool:
+        threshold = self.low_fee_threshold()
+        if threshold is None:
+            return True
+
+        if gas_price <= threshold:
+            return True
+
+        # Газ выше порога, но падает: EWMA отстает от цены, разница с ней дает прогноз на следующий опрос.
+        # Если прогноз уже ниже порога, окно открывается сейчас, пока транзакции дойдут до блока
+        if self.trend is None or gas_price >= self.trend:
+            return False
+        forecast = gas_price - (self.trend - gas_price)
+        return forecast <= threshold
+
+    async def _poll(self) -> None:
+        gas_price = await self.transaction_executor.get_gas_price()
+        # rpc_error_handler_decorator возвращает None, когда исчерпал попытки
+        if gas_price is None:
+            raise RuntimeError("RPC не вернул цену газа")
+        now = time.monotonic()
+
+        self.current_gas_price = gas_price
+        self.history.append((now, gas_price))
+        while self.history and now - self.history[0][0] > self.config.history_window_sec:
+            self.history.popleft()
+
+        alpha = self.config.trend_alpha
+        self.trend = gas_price if self.trend is None else alpha * gas_price + (1 - alpha) * self.trend
+
+    def _release(self, now: float) -> int:
+        gas_price = self.current_gas_price
+        low_fee_window = self.in_low_fee_window(gas_price)
+        released = 0
+
+        for item in list(self.waiters):
+            if released >= self.config.releases_per_interval:
+                break
+
+            max_gas_price, enqueued_at, future = item
+            if gas_price > max_gas_price:
+                continue
+
+            if not low_fee_window and now - enqueued_at < self.config.max_hold_sec:
+                continue
+
+            self.waiters.remove(item)
+            if not future.done():
+                future.set_result(gas_price)
+                released += 1
+                metrics.observe("gas_scheduler_wait_duration_seconds", now - enqueued_at, chain=self.name)
+
+        return released
+
+    async def _run(self) -> None:
+        last_poll = 0.0
+
+        while self.waiters:
+            now = time.monotonic()
+
+            if now - last_poll >= self.config.poll_interval_sec:
+                try:
+                    await self._poll()
+                    last_poll = now
+                except Exception as e:
+                    logger.error(f"Планировщик газа: не удалось получить цену газа: {e}")
+                    await asyncio.sleep(self.config.poll_interval_sec)
+                    continue
+
+            if self._release(now):
+                logger.info(
+                    f"Планировщик газа {self.name}: газ {self.current_gas_price} wei, "
+                    f"в очереди осталось {len(self.waiters)} действий"
+                )
+
+            await asyncio.sleep(self.config.release_interval_sec)
@@ -1,2 +1,3 @@
 
-CSV_COLUMNS = ["Wallet", "Time", "Chain", "Action", "Status"]
+# Duration, GasWei и Points добавлены позже: в старых строках их нет, читать нужно с restval
+CSV_COLUMNS = ["Wallet", "Time", "Chain", "Action", "Status", "Duration", "GasWei", "Points"]
@@ -0,0 +1,229 @@
+import asyncio
+import ipaddress
+from collections import Counter, OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from http.cookies import SimpleCookie
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+from src.config import HttpTransportConfig
+from src.utils import json_codec
+from src.utils.dns_resolver import get_resolver, local_address, make_connector
+from src.utils.metrics import metrics
+
+
+class HttpResponse:
+    __slots__ = ("status", "headers", "cookies", "content_type", "encoding", "body", "http_version")
+
+    def __init__(self, status, headers, cookies, content_type, encoding, body, http_version):
+        self.status = status
+        self.headers = headers
+        self.cookies = cookies
+        self.content_type = content_type
+        self.encoding = encoding
+        self.body = body
+        self.http_version = http_version
+
+
+class AiohttpTransport:
+    name = "aiohttp"
+
+    def __init__(self, config: HttpTransportConfig):
+        self.config = config
+        self.session: Optional[aiohttp.ClientSession] = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        # Одна сессия на процесс: соединения и TLS общие, куки каждый кошелек хранит у себя
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                cookie_jar=aiohttp.DummyCookieJar(),
+                connector=make_connector(ssl=False, limit=0),
+                json_serialize=json_codec.dumps_str,
+            )
+        return self.session
+
+    async def request(self, method: str, url: str, headers: dict, proxy: Optional[str] = None, **kwargs) -> HttpResponse:
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=self.config.timeout_sec))
+
+        async with self.get_session().request(method=method, url=url, headers=headers, proxy=proxy, **kwargs) as response:
+            body = await response.read()
+            return HttpResponse(
+                status=response.status,
+                headers=response.headers,
+                cookies=response.cookies,
+                content_type=response.content_type,
+                encoding=response.get_encoding(),
+                body=body,
+                http_version="HTTP/1.1",
+            )
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+# Методы, которые можно безопасно повторить по HTTP/1.1, даже если HTTP/2 запрос уже ушел на сервер
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class CachingNetworkBackend:
+    # Сетевой бэкенд httpcore с общим DNS-кешем: в connect_tcp хост заменяется адресом из кеша,
+    # SNI и проверка сертификата по-прежнему идут по имени хоста
+    def __init__(self):
+        import httpcore
+
+        self.backend = httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            host = (await get_resolver().resolve(host, port))[0]["host"]
+        return await self.backend.connect_tcp(host, port, timeout, local_address, socket_options)
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self.backend.sleep(seconds)
+
+
+class Http2Transport:
+    name = "http2"
+
+    def __init__(self, config: HttpTransportConfig):
+        self.config = config
+        # Клиент на каждый прокси, внутри него одно мультиплексированное соединение на хост
+        self.clients: "OrderedDict[Optional[str], httpx.AsyncClient]" = OrderedDict()
+        # Запросы в работе по клиенту: вытесненный клиент закрываем, когда его запросы закончатся
+        self.active: Counter = Counter()
+        self.retired = set()
+        self.fallback = AiohttpTransport(config)
+        self.network_backend = CachingNetworkBackend()
+
+    def _client(self, proxy: Optional[str]):
+        import httpx
+
+        client = self.clients.get(proxy)
+        if client is not None and not client.is_closed:
+            self.clients.move_to_end(proxy)
+            return client
+
+        transport = httpx.AsyncHTTPTransport(
+            http2=True,
+            proxy=proxy,
+            verify=False,
+            trust_env=False,
+            limits=httpx.Limits(max_connections=self.config.http2_max_connections),
+            local_address=local_address(),
+        )
+        # httpx не принимает network_backend, а пул httpcore (и прокси-пул) хранит его в этом атрибуте
+        transport._pool._network_backend = self.network_backend
+        client = self.clients[proxy] = httpx.AsyncClient(
+            transport=transport, trust_env=False, timeout=self.config.timeout_sec
+        )
+        # Клиент общий для всех кошельков, поэтому свои куки он не хранит, их передает BrowserClient
+        client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        while len(self.clients) > self.config.http2_max_clients:
+            _, evicted = self.clients.popitem(last=False)
+            self.retired.add(evicted)
+            self._close_if_idle(evicted)
+        return client
+
+    def _close_if_idle(self, client) -> None:
+        if client in self.retired and not self.active[client]:
+            self.retired.discard(client)
+            self.active.pop(client, None)
+            asyncio.create_task(client.aclose())
+
+    async def request(self, method: str, url: str, headers: dict, proxy: Optional[str] = None, **kwargs) -> HttpResponse:
+        import httpx
+
+        if "json" in kwargs:
+            kwargs["content"] = json_codec.dumps(kwargs.pop("json"))
+            headers = {"Content-Type": "application/json", **headers}
+        timeout = kwargs.pop("timeout", None)
+        if isinstance(timeout, aiohttp.ClientTimeout):
+            timeout = timeout.total
+
+        client = self._client(proxy)
+        self.active[client] += 1
+        try:
+            response = await client.request(
+                method, url, headers=headers, timeout=timeout or self.config.timeout_sec, **kwargs
+            )
+        except (httpx.RemoteProtocolError, httpx.LocalProtocolError) as e:
+            # POST мог уже дойти до сервера (/api/builds, /api/points), повтор его задублирует
+            if method.upper() not in IDEMPOTENT_METHODS:
+                raise
+            # Сервер или прокси не справился с HTTP/2, повторяем по HTTP/1.1
+            logger.debug(f"HTTP/2 запрос к {url} не удался ({e}), повторяю через HTTP/1.1")
+            metrics.inc("http2_fallbacks_total")
+            if "content" in kwargs:
+                kwargs["data"] = kwargs.pop("content")
+            return await self.fallback.request(method, url, headers, proxy, **kwargs)
+        finally:
+            self.active[client] -= 1
+            self._close_if_idle(client)
+
+        cookies = SimpleCookie()
+        for set_cookie in response.headers.get_list("set-cookie"):
+            cookies.load(set_cookie)
+
+        content_type = response.headers.get("content-type", "application/octet-stream").split(";")[0].strip().lower()
+        return HttpResponse(
+            status=response.status_code,
+            headers=response.headers,
+            cookies=cookies,
+            content_type=content_type,
+            encoding=response.encoding or "utf-8",
+            body=response.content,
+            http_version=response.http_version,
+        )
+
+    async def close(self) -> None:
+        for client in [*self.clients.values(), *self.retired]:
+            await client.aclose()
+        self.clients.clear()
+        self.retired.clear()
+        self.active.clear()
+        await self.fallback.close()
+
+
+_config = HttpTransportConfig()
+_transport = None
+
+
+def setup_http_transport(config: HttpTransportConfig) -> None:
+    global _config, _transport
+
+    _config = config
+    _transport = None
+
+
+def get_transport():
+    global _transport
+
+    if _transport is None:
+        _transport = AiohttpTransport(_config)
+        if _config.backend == "http2":
+            try:
+                import h2  # noqa: F401
+                import httpx  # noqa: F401
+
+                _transport = Http2Transport(_config)
+            except ImportError:
+                logger.warning('Для HTTP/2 нужен пакет "httpx[http2]", запросы пойдут по HTTP/1.1')
+    return _transport
+
+
+async def close_transport() -> None:
+    global _transport
+
+    if _transport is not None:
+        await _transport.close()
+        _transport = None
@@ -0,0 +1,189 @@
+import asyncio
+import heapq
+import random
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.modules.exceptions import (
+    DeadlineExceeded,
+    EmptyBalance,
+    InsufficientFunds,
+    NotEnoughtBalanceToSend,
+    ProxyUnavailable,
+)
+from src.utils import json_codec
+from src.utils.metrics import metrics
+
+FAILURE_FUNDS = "funds"
+FAILURE_PROXY = "proxy"
+FAILURE_DEADLINE = "deadline"
+FAILURE_NETWORK = "network"
+FAILURE_RPC = "rpc"
+FAILURE_REVERT = "revert"
+FAILURE_UNKNOWN = "unknown"
+
+
+class RequeueConfig(BaseModel):
+    enabled: bool = False
+    max_attempts: int = 3  # всего попыток на кошелек, включая первую
+    base_delay_sec: float = 120
+    max_delay_sec: float = 3600
+    backoff_multiplier: float = 2
+    jitter_percent: float = 20
+    # Классы ошибок, которые имеет смысл повторять; остальные сразу уходят в dead letter
+    retry_classes: List[str] = [FAILURE_PROXY, FAILURE_DEADLINE, FAILURE_NETWORK, FAILURE_RPC, FAILURE_UNKNOWN]
+    dead_letter_path: Optional[str] = None
+
+
+def classify_failure(error: BaseException) -> str:
+    import aiohttp
+    from web3.exceptions import ContractLogicError, Web3Exception
+
+    if isinstance(error, (InsufficientFunds, NotEnoughtBalanceToSend, EmptyBalance)):
+        return FAILURE_FUNDS
+    if isinstance(error, (ProxyUnavailable, aiohttp.ClientProxyConnectionError)):
+        return FAILURE_PROXY
+    if isinstance(error, DeadlineExceeded):
+        return FAILURE_DEADLINE
+    if isinstance(error, ContractLogicError) or "отменена EVM" in str(error):
+        return FAILURE_REVERT
+    if isinstance(error, Web3Exception):
+        return FAILURE_RPC
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError, OSError)):
+        return FAILURE_NETWORK
+    return FAILURE_UNKNOWN
+
+
+def describe_failure(error: BaseException) -> str:
+    return str(error) or type(error).__name__
+
+
+class RetryItem:
+    __slots__ = ("idx", "private_key", "other_data", "attempt")
+
+    def __init__(self, idx: int, private_key: str, other_data: list, attempt: int):
+        self.idx = idx
+        self.private_key = private_key
+        self.other_data = other_data
+        self.attempt = attempt
+
+
+class WalletRequeue:
+    def __init__(self, config: RequeueConfig):
+        self.config = config
+        self.pending: List[Tuple[float, int, RetryItem]] = []
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+        self.retried = 0
+        self.recovered = 0
+        self.dead_letters: Counter = Counter()
+
+    def backoff_sec(self, attempt: int) -> float:
+        delay = min(
+            self.config.base_delay_sec * self.config.backoff_multiplier ** (attempt - 1), self.config.max_delay_sec
+        )
+        jitter = delay * self.config.jitter_percent / 100
+        return max(0.0, delay + random.uniform(-jitter, jitter))
+
+    def started(self) -> None:
+        # Без await, чтобы кошелек считался в работе в тот же момент, когда его выдали воркеру
+        self.in_flight += 1
+
+    async def finished(self, item: RetryItem, failure: Optional[BaseException]) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+
+            if failure is None:
+                if item.attempt > 1:
+                    self.recovered += 1
+                    metrics.inc("wallet_requeue_total", result="recovered")
+            else:
+                self._on_failure(item, failure)
+
+            self.condition.notify_all()
+
+    def _on_failure(self, item: RetryItem, failure: BaseException) -> None:
+        failure_class = classify_failure(failure)
+
+        if failure_class not in self.config.retry_classes:
+            self._dead_letter(item, failure, failure_class, "ошибка не исправится повтором")
+            return
+        if item.attempt >= self.config.max_attempts:
+            self._dead_letter(item, failure, failure_class, f"исчерпаны попытки ({item.attempt})")
+            return
+
+        delay = self.backoff_sec(item.attempt)
+        retry = RetryItem(item.idx, item.private_key, item.other_data, item.attempt + 1)
+        heapq.heappush(self.pending, (time.monotonic() + delay, item.idx, retry))
+        self.retried += 1
+        metrics.inc("wallet_requeue_total", result="scheduled", failure=failure_class)
+        logger.warning(
+            f"Кошелек #{item.idx + 1} ({failure_class}: {describe_failure(failure)}) повторим через {int(delay)} сек в конце очереди, "
+            f"попытка {item.attempt + 1}/{self.config.max_attempts}"
+        )
+
+    def _dead_letter(self, item: RetryItem, failure: BaseException, failure_class: str, reason: str) -> None:
+        from eth_account import Account
+
+        address = Account.from_key(item.private_key).address
+        self.dead_letters[failure_class] += 1
+        metrics.inc("wallet_requeue_total", result="dead_letter", failure=failure_class)
+        logger.error(f"Кошелек {address} отложен в dead letter: {reason}, {failure_class}: {describe_failure(failure)}")
+
+        if self.config.dead_letter_path is None:
+            return
+
+        # Приватный ключ не пишем: кошелек находится в файле ключей по адресу и номеру строки
+        path = Path(self.config.dead_letter_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "ab") as f:
+            f.write(json_codec.dumps({
+                "time": datetime.now().isoformat(timespec="seconds"),
+                "wallet_idx": item.idx,
+                "address": address,
+                "attempts": item.attempt,
+                "failure": failure_class,
+                "reason": reason,
+                "error": describe_failure(failure),
+            }) + b"\n")
+
+    async def next_retry(self, stop_event: Optional[asyncio.Event] = None) -> Optional[RetryItem]:
+        async with self.condition:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return None
+
+                if self.pending:
+                    due_at = self.pending[0][0]
+                    delay = due_at - time.monotonic()
+                    if delay <= 0:
+                        self.in_flight += 1
+                        return heapq.heappop(self.pending)[2]
+                elif self.in_flight == 0:
+                    # Повторов нет и появиться им неоткуда
+                    return None
+                else:
+                    delay = None
+
+                # Просыпаемся по сроку повтора, при новом повторе или раз в несколько секунд, чтобы заметить stop_event
+                try:
+                    await asyncio.wait_for(self.condition.wait(), timeout=min(delay or 5, 5))
+                except asyncio.TimeoutError:
+                    pass
+
+    def log_summary(self) -> None:
+        if not self.retried and not self.dead_letters:
+            return
+
+        dead_letters = ", ".join(f"{name}: {count}" for name, count in self.dead_letters.items()) or "нет"
+        logger.info(
+            f"Повторы кошельков: запланировано {self.retried}, успешно после повтора {self.recovered}, "
+            f"в dead letter {sum(self.dead_letters.values())} ({dead_letters})"
+        )
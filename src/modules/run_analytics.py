@@ -0,0 +1,425 @@
+import bisect
+import csv
+import io
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from src.utils import json_codec
+from src.utils.metrics import Histogram
+
+STORE_VERSION = 1
+NO_VALUE = 0xFFFFFFFF
+READ_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Длительность действия: сборка, ожидание газа и подтверждения, поэтому корзины от секунд до часа
+LATENCY_BUCKETS = (5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200, 1800, 3600)
+
+# Колонки строк results.csv: имя -> typecode массива
+ROW_COLUMNS = {
+    "wallet": "I",
+    "ts": "I",
+    "chain": "B",
+    "prompt": "I",
+    "status": "B",
+    "duration_ds": "I",  # десятые доли секунды, NO_VALUE - нет данных
+    "gas_gwei": "d",  # NaN - нет данных
+    "points": "H",
+    "prev_row": "I",  # предыдущая строка того же кошелька, индекс по кошельку
+}
+# Агрегаты по кошелькам, переписываются целиком при каждом обновлении
+WALLET_COLUMNS = {
+    "w_success": "I",
+    "w_failure": "I",
+    "w_gas_gwei": "d",
+    "w_points": "I",
+    "w_first_ts": "I",
+    "w_last_ts": "I",
+    "w_last_row": "I",
+    "w_last_day": "I",
+}
+
+_ADDRESS_RE = re.compile(r"0x[0-9a-fA-F]{6,}")
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)?")
+
+
+def normalize_prompt(action: str) -> str:
+    # Суммы и адреса в промптах случайные, отчет группирует по шаблону
+    action = _ADDRESS_RE.sub("<address>", action)
+    action = _NUMBER_RE.sub("<n>", action)
+    return " ".join(action.split())
+
+
+def _address_key(address: str) -> bytes:
+    return bytes.fromhex(address.lower().removeprefix("0x").rjust(40, "0")[-40:])
+
+
+def _parse_float(value: str) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class RunAnalytics:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.meta: dict = {
+            "version": STORE_VERSION,
+            "source": None,
+            "offset": 0,
+            "rows": 0,
+            "wallets": 0,
+            "chains": [],
+            "prompts": [],
+            "days": {},
+            "groups": {},
+            "latency": {},
+        }
+        self.columns: Dict[str, array] = {
+            name: array(typecode) for name, typecode in {**ROW_COLUMNS, **WALLET_COLUMNS}.items()
+        }
+        self.wallets = bytearray()
+        self._wallet_ids: Dict[bytes, int] = {}
+        self._chain_ids: Dict[str, int] = {}
+        self._prompt_ids: Dict[str, int] = {}
+        self._persisted_rows = 0
+
+    @property
+    def rows(self) -> int:
+        return len(self.columns["ts"])
+
+    @property
+    def wallets_count(self) -> int:
+        return len(self.columns["w_success"])
+
+    @classmethod
+    def open(cls, path: str) -> "RunAnalytics":
+        store = cls(path)
+        meta_path = store.path / "meta.json"
+        if not meta_path.exists():
+            return store
+
+        meta = json_codec.load_file(meta_path)
+        if meta.get("version") != STORE_VERSION:
+            logger.warning(f"Хранилище аналитики версии {meta.get('version')}, пересобираем")
+            return store
+        store.meta = meta
+
+        wallets_count = len(store._read_bytes("wallets.bin", meta["wallets"] * 20)) // 20
+        for name, typecode in ROW_COLUMNS.items():
+            store.columns[name] = store._read_column(name, typecode, meta["rows"])
+        for name, typecode in WALLET_COLUMNS.items():
+            store.columns[name] = store._read_column(name, typecode, wallets_count)
+
+        store.wallets = bytearray(store._read_bytes("wallets.bin", wallets_count * 20))
+        store._wallet_ids = {bytes(store.wallets[idx * 20:(idx + 1) * 20]): idx for idx in range(wallets_count)}
+        store._chain_ids = {chain: idx for idx, chain in enumerate(meta["chains"])}
+        store._prompt_ids = {prompt: idx for idx, prompt in enumerate(meta["prompts"])}
+        store._persisted_rows = meta["rows"]
+        return store
+
+    def _read_bytes(self, name: str, size: int) -> bytes:
+        column_path = self.path / name
+        if not column_path.exists():
+            return b""
+        with open(column_path, "rb") as f:
+            return f.read(size)
+
+    def _read_column(self, name: str, typecode: str, count: int) -> array:
+        column = array(typecode)
+        column_path = self.path / f"{name}.bin"
+        if count and column_path.exists():
+            with open(column_path, "rb") as f:
+                column.fromfile(f, count)
+        return column
+
+    @staticmethod
+    def _intern(table: List[str], ids: Dict[str, int], value: str) -> int:
+        idx = ids.get(value)
+        if idx is None:
+            idx = ids[value] = len(table)
+            table.append(value)
+        return idx
+
+    def _wallet_idx(self, address: str) -> int:
+        key = _address_key(address)
+        idx = self._wallet_ids.get(key)
+        if idx is None:
+            idx = self._wallet_ids[key] = self.wallets_count
+            self.wallets += key
+            for name, default in (
+                    ("w_success", 0), ("w_failure", 0), ("w_gas_gwei", 0.0), ("w_points", 0),
+                    ("w_first_ts", NO_VALUE), ("w_last_ts", 0), ("w_last_row", NO_VALUE), ("w_last_day", 0),
+            ):
+                self.columns[name].append(default)
+        return idx
+
+    def _read_new_rows(self, source: Path) -> Iterator[List[str]]:
+        # Дочитываем только целые строки после сохраненного смещения, хвост дочитает следующий запуск
+        with open(source, "rb") as f:
+            f.seek(self.meta["offset"])
+            tail = b""
+            while True:
+                chunk = f.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                data = tail + chunk
+                end = data.rfind(b"\n") + 1
+                tail = data[end:]
+                self.meta["offset"] += end
+                yield from csv.reader(io.StringIO(data[:end].decode("utf-8", errors="replace")))
+
+    def ingest(self, source: Path) -> int:
+        source = Path(source)
+        if not source.exists():
+            return 0
+
+        if self.meta["source"] not in (None, str(source)) or source.stat().st_size < self.meta["offset"]:
+            logger.warning(f"Файл результатов {source} заменен, пересобираем аналитику")
+            self._reset()
+        self.meta["source"] = str(source)
+
+        columns = self.columns
+        days, groups, latency = self.meta["days"], self.meta["groups"], self.meta["latency"]
+        times: Dict[str, Tuple[int, str, int]] = {}
+        added = 0
+
+        for record in self._read_new_rows(source):
+            if len(record) < 5:
+                continue
+            address, time_str, chain, action, status_str = record[:5]
+            duration, gas_wei, points = (record[5:] + ["", "", ""])[:3]
+
+            # Время с точностью до минуты, строки за одну минуту разбираем один раз
+            parsed = times.get(time_str)
+            if parsed is None:
+                try:
+                    moment = datetime.strptime(time_str, "%Y-%m-%d %H:%M")
+                except ValueError:
+                    continue
+                if len(times) > 100_000:
+                    times.clear()
+                parsed = times[time_str] = (int(moment.timestamp()), time_str[:10], moment.toordinal())
+            ts, day, day_number = parsed
+
+            try:
+                wallet = self._wallet_idx(address)
+            except ValueError:
+                continue
+            row = self.rows
+            chain_idx = self._intern(self.meta["chains"], self._chain_ids, chain)
+            prompt_idx = self._intern(self.meta["prompts"], self._prompt_ids, normalize_prompt(action))
+            success = status_str == "SUCCESS"
+            duration_sec = _parse_float(duration)
+            gas_gwei = _parse_float(gas_wei)
+            gas_gwei = gas_gwei / 1e9 if gas_gwei is not None else None
+            points_count = int(_parse_float(points) or 0)
+
+            columns["wallet"].append(wallet)
+            columns["ts"].append(ts)
+            columns["chain"].append(chain_idx)
+            columns["prompt"].append(prompt_idx)
+            columns["status"].append(success)
+            columns["duration_ds"].append(
+                min(int(duration_sec * 10), NO_VALUE - 1) if duration_sec is not None else NO_VALUE
+            )
+            columns["gas_gwei"].append(gas_gwei if gas_gwei is not None else math.nan)
+            columns["points"].append(min(points_count, 0xFFFF))
+            columns["prev_row"].append(columns["w_last_row"][wallet])
+
+            columns["w_success" if success else "w_failure"][wallet] += 1
+            columns["w_gas_gwei"][wallet] += gas_gwei or 0.0
+            columns["w_points"][wallet] += points_count
+            columns["w_first_ts"][wallet] = min(columns["w_first_ts"][wallet], ts)
+            columns["w_last_ts"][wallet] = max(columns["w_last_ts"][wallet], ts)
+            columns["w_last_row"][wallet] = row
+
+            day_index = days.setdefault(day, {"start": row, "end": row, "wallets": 0})
+            day_index["end"] = row + 1
+            if columns["w_last_day"][wallet] != day_number:
+                columns["w_last_day"][wallet] = day_number
+                day_index["wallets"] += 1
+
+            group = groups.setdefault(f"{day}|{chain_idx}|{prompt_idx}", [0, 0, 0.0, 0])
+            group[0 if success else 1] += 1
+            group[2] += gas_gwei or 0.0
+            group[3] += points_count
+
+            if duration_sec is not None:
+                counts = latency.setdefault(f"{day}|{chain_idx}", [0] * (len(LATENCY_BUCKETS) + 1))
+                counts[bisect.bisect_left(LATENCY_BUCKETS, duration_sec)] += 1
+
+            added += 1
+
+        self.meta["rows"] = self.rows
+        self.meta["wallets"] = self.wallets_count
+        return added
+
+    def _reset(self) -> None:
+        self.__init__(str(self.path))
+        if self.path.exists():
+            for file_path in self.path.glob("*.bin"):
+                file_path.unlink()
+
+    def save(self) -> None:
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        # Строки только дописываются; если прошлое сохранение оборвалось, лишний хвост колонок обрезаем
+        for name, column in self.columns.items():
+            if name not in ROW_COLUMNS:
+                continue
+            column_path = self.path / f"{name}.bin"
+            persisted_size = self._persisted_rows * column.itemsize
+            if column_path.exists() and column_path.stat().st_size != persisted_size:
+                os.truncate(column_path, persisted_size)
+            with open(column_path, "ab") as f:
+                column[self._persisted_rows:].tofile(f)
+
+        for name in WALLET_COLUMNS:
+            with open(self.path / f"{name}.bin", "wb") as f:
+                self.columns[name].tofile(f)
+        (self.path / "wallets.bin").write_bytes(self.wallets)
+
+        tmp_path = self.path / "meta.json.tmp"
+        json_codec.dump_file(tmp_path, self.meta)
+        tmp_path.replace(self.path / "meta.json")
+
+        self._persisted_rows = self.rows
+
+    def _selected_days(self, since: Optional[str], until: Optional[str]) -> List[str]:
+        return sorted(
+            day for day in self.meta["days"]
+            if (since is None or day >= since) and (until is None or day <= until)
+        )
+
+    def report(self, since: Optional[str] = None, until: Optional[str] = None, top: int = 10) -> dict:
+        chains, prompts = self.meta["chains"], self.meta["prompts"]
+        days = set(self._selected_days(since, until))
+
+        per_day: Dict[str, Counter] = {}
+        per_chain: Dict[str, Counter] = {}
+        per_prompt: Dict[Tuple[str, str], Counter] = {}
+        for key, (success, failure, gas_gwei, points) in self.meta["groups"].items():
+            day, chain_idx, prompt_idx = key.split("|")
+            if day not in days:
+                continue
+            chain = chains[int(chain_idx)]
+
+            for counter in (
+                    per_day.setdefault(day, Counter()),
+                    per_chain.setdefault(chain, Counter()),
+                    per_prompt.setdefault((chain, prompts[int(prompt_idx)]), Counter()),
+            ):
+                counter["success"] += success
+                counter["failure"] += failure
+                counter["gas_gwei"] += gas_gwei
+                counter["points"] += points
+
+        latency: Dict[str, Histogram] = {}
+        for key, counts in self.meta["latency"].items():
+            day, chain_idx = key.split("|")
+            if day not in days:
+                continue
+            histogram = latency.setdefault(chains[int(chain_idx)], Histogram(LATENCY_BUCKETS))
+            histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+            histogram.count += sum(counts)
+
+        hotspots = sorted(
+            (
+                {
+                    "chain": chain,
+                    "prompt": prompt,
+                    "failures": counter["failure"],
+                    "total": counter["success"] + counter["failure"],
+                    "failure_rate": counter["failure"] / (counter["success"] + counter["failure"]),
+                }
+                for (chain, prompt), counter in per_prompt.items() if counter["failure"]
+            ),
+            key=lambda item: (-item["failures"], -item["failure_rate"]),
+        )[:top]
+
+        points = self.columns["w_points"]
+        top_wallets = sorted(range(self.wallets_count), key=points.__getitem__, reverse=True)[:top]
+
+        return {
+            "rows": self.rows,
+            "wallets": self.wallets_count,
+            "days": [
+                {
+                    "day": day,
+                    "actions": per_day[day]["success"] + per_day[day]["failure"],
+                    "success": per_day[day]["success"],
+                    "wallets": self.meta["days"][day]["wallets"],
+                }
+                for day in sorted(per_day)
+            ],
+            "chains": {
+                chain: {
+                    "actions": counter["success"] + counter["failure"],
+                    "success_rate": counter["success"] / max(counter["success"] + counter["failure"], 1),
+                    "gas_eth": counter["gas_gwei"] / 1e9,
+                    "gas_eth_per_success": counter["gas_gwei"] / 1e9 / max(counter["success"], 1),
+                    "points": counter["points"],
+                    "latency_sec": {
+                        "p50": latency[chain].quantile(0.5),
+                        "p90": latency[chain].quantile(0.9),
+                        "p99": latency[chain].quantile(0.99),
+                    } if chain in latency else None,
+                }
+                for chain, counter in per_chain.items()
+            },
+            "hotspots": hotspots,
+            "points": {
+                "wallets_with_points": sum(1 for value in points if value),
+                "per_wallet": sum(points) / max(self.wallets_count, 1),
+                "top": [{"address": self.address(idx), "points": points[idx]} for idx in top_wallets if points[idx]],
+            },
+        }
+
+    def address(self, wallet_idx: int) -> str:
+        return "0x" + self.wallets[wallet_idx * 20:(wallet_idx + 1) * 20].hex()
+
+    def wallet_report(self, address: str, limit: int = 20) -> Optional[dict]:
+        try:
+            wallet = self._wallet_ids.get(_address_key(address))
+        except ValueError:
+            return None
+        if wallet is None:
+            return None
+
+        columns = self.columns
+        history = []
+        row = columns["w_last_row"][wallet]
+        while row != NO_VALUE and len(history) < limit:
+            duration_ds = columns["duration_ds"][row]
+            gas_gwei = columns["gas_gwei"][row]
+            history.append({
+                "time": datetime.fromtimestamp(columns["ts"][row]).strftime("%Y-%m-%d %H:%M"),
+                "chain": self.meta["chains"][columns["chain"][row]],
+                "prompt": self.meta["prompts"][columns["prompt"][row]],
+                "status": "SUCCESS" if columns["status"][row] else "FAILURE",
+                "duration_sec": duration_ds / 10 if duration_ds != NO_VALUE else None,
+                "gas_eth": gas_gwei / 1e9 if not math.isnan(gas_gwei) else None,
+                "points": columns["points"][row],
+            })
+            row = columns["prev_row"][row]
+
+        return {
+            "address": self.address(wallet),
+            "success": columns["w_success"][wallet],
+            "failure": columns["w_failure"][wallet],
+            "gas_eth": columns["w_gas_gwei"][wallet] / 1e9,
+            "points": columns["w_points"][wallet],
+            "first_seen": datetime.fromtimestamp(columns["w_first_ts"][wallet]).strftime("%Y-%m-%d %H:%M"),
+            "last_seen": datetime.fromtimestamp(columns["w_last_ts"][wallet]).strftime("%Y-%m-%d %H:%M"),
+            "history": history,
+        }
+
@@ -0,0 +1,184 @@
+import asyncio
+import multiprocessing
+import queue
+import signal
+import sys
+import time
+from typing import List
+
+from loguru import logger
+
+from src.config import Config
+from src.modules.action_plan import ActionPlan
+from src.modules.data_file_iterator import DataFileIterator
+from src.modules.http_transport import setup_http_transport
+from src.utils.dns_resolver import setup_dns
+from src.utils.metrics import metrics
+from src.utils.profiler import profile_run
+
+
+class ShardQueueSink:
+    def __init__(self, shard_idx: int, message_queue):
+        self.shard_idx = shard_idx
+        self.message_queue = message_queue
+
+    def write(self, message):
+        record = message.record
+        self.message_queue.put((
+            "log",
+            self.shard_idx,
+            record["level"].name,
+            str(message).rstrip("\n"),
+            record["extra"].get("wallet", "-"),
+        ))
+
+
+def split_into_shards(rows: List[list], shards_count: int) -> List[List[list]]:
+    shards = [[] for _ in range(shards_count)]
+    for idx, row in enumerate(rows):
+        shards[idx % shards_count].append(row)
+    return [shard for shard in shards if shard]
+
+
+async def send_metrics_loop(shard_idx: int, message_queue, interval_sec: int) -> None:
+    # Метрики шарда живут в его процессе, экспортирует их родитель с меткой shard
+    while True:
+        await asyncio.sleep(interval_sec)
+        message_queue.put(("metrics", shard_idx, None, metrics.snapshot(), None))
+
+
+def shard_worker_entry(shard_idx: int, rows: List[list], config: Config, message_queue, stop_event) -> None:
+    # Ctrl+C обрабатывает родитель, воркер завершается через stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    logger.remove()
+    logger.configure(extra={"wallet": "-"})
+    logger.add(ShardQueueSink(shard_idx, message_queue), level=config.logs.level, format="{message}")
+
+    from src.main import create_activity_index, run_account
+
+    setup_dns(config.dns)
+    setup_http_transport(config.http)
+
+    try:
+        # План строит родитель, шард только отмечает в нем свои строки
+        action_plan = ActionPlan.load(config.plan.path) if config.plan.enabled else None
+        # Индекс активности сжал родитель, шарды только читают его и дописывают свои строки
+        activity_index = create_activity_index(config, compact=False)
+
+        async def run_shard():
+            metrics_task = asyncio.create_task(
+                send_metrics_loop(shard_idx, message_queue, config.metrics.json_dump_interval_sec)
+            )
+            try:
+                async with profile_run(config.profiling, f"shard-{shard_idx}"):
+                    await run_account(
+                        config,
+                        keys_file_iterator=DataFileIterator.from_rows(rows),
+                        stop_event=stop_event,
+                        action_plan=action_plan,
+                        activity_index=activity_index,
+                    )
+            finally:
+                metrics_task.cancel()
+                message_queue.put(("metrics", shard_idx, None, metrics.snapshot(), None))
+
+        asyncio.run(run_shard())
+        message_queue.put(("done", shard_idx, None, None, None))
+    except BaseException as e:
+        message_queue.put(("failed", shard_idx, "ERROR", repr(e), None))
+
+
+async def run_sharded(config: Config) -> None:
+    keys_file_iterator = DataFileIterator(path=config.keys_file_path, shuffle=config.shuffle_keys)
+    shards = split_into_shards(keys_file_iterator.data_infos, config.processes)
+
+    activity_index = None
+    if config.activity.enabled:
+        from src.main import create_activity_index
+
+        # Сжимаем журнал индекса до запуска шардов, пока в него никто не пишет
+        activity_index = create_activity_index(config)
+
+    if config.plan.enabled:
+        from eth_account import Account
+
+        from src.main import create_chain_registry, prepare_action_plan
+        from src.modules.balance_prefetcher import BalancePrefetcher
+        from src.modules.chain_registry import close_rpc_session
+
+        chain_registry = create_chain_registry(config)
+        try:
+            # Без балансов план не отсеет действия, на которые кошельку не хватит средств
+            balance_prefetcher = None
+            if config.balances.enabled:
+                balance_prefetcher = BalancePrefetcher(config.balances, chain_registry)
+                await balance_prefetcher.prefetch([
+                    Account.from_key(private_key).address for private_key, *_ in keys_file_iterator
+                    if activity_index is None or activity_index.is_eligible(private_key)
+                ])
+            await prepare_action_plan(config, keys_file_iterator, chain_registry, balance_prefetcher)
+        finally:
+            chain_registry.close()
+            await close_rpc_session()
+
+    logger.info(f"Запускаем {len(shards)} процессов, ключей: {len(keys_file_iterator)}")
+
+    context = multiprocessing.get_context("spawn")
+    message_queue = context.Queue()
+    stop_event = context.Event()
+
+    processes = []
+    for shard_idx, rows in enumerate(shards):
+        process = context.Process(
+            target=shard_worker_entry,
+            args=(shard_idx, rows, config, message_queue, stop_event),
+            name=f"shard-{shard_idx}",
+        )
+        process.start()
+        processes.append(process)
+
+    loop = asyncio.get_running_loop()
+    finished = set()
+
+    try:
+        while len(finished) < len(processes):
+            try:
+                kind, shard_idx, level, text, wallet = await loop.run_in_executor(
+                    None, message_queue.get, True, 0.5
+                )
+            except queue.Empty:
+                for shard_idx, process in enumerate(processes):
+                    if not process.is_alive() and shard_idx not in finished:
+                        logger.error(f"Процесс shard-{shard_idx} завершился с кодом {process.exitcode}")
+                        finished.add(shard_idx)
+                continue
+
+            if kind == "metrics":
+                metrics.set_remote(f"shard-{shard_idx}", text)
+            elif kind == "log":
+                with logger.contextualize(wallet=wallet):
+                    logger.opt(depth=0).log(level, f"[shard-{shard_idx}] {text}")
+            elif kind == "done":
+                logger.info(f"Процесс shard-{shard_idx} закончил работу")
+                finished.add(shard_idx)
+            elif kind == "failed":
+                logger.error(f"Процесс shard-{shard_idx} упал: {text}")
+                finished.add(shard_idx)
+    finally:
+        stop_event.set()
+
+        # Общий срок на все процессы, иначе ожидание растет с числом шардов
+        deadline = time.monotonic() + config.shutdown_timeout_sec
+        for process in processes:
+            await loop.run_in_executor(None, process.join, max(deadline - time.monotonic(), 0))
+        for process in processes:
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не завершился вовремя, останавливаем принудительно")
+                process.terminate()
+
+    if config.plan.enabled:
+        ActionPlan.load(config.plan.path).log_summary()
@@ -1,77 +1,87 @@
+import asyncio
 import random
+import time
 
-from typing import List
+from typing import Dict, List, Tuple
 from typing import Optional
 
+from eth_account import Account
 from loguru import logger
-from pydantic import BaseModel
 from web3 import Web3
-from web3.eth import AsyncEth
 
-from src.modules.web3_transaction_exectutor import (
-    Web3TransactionExecutor,
-    Web3TransactionExecutorConfig,
-)
+from src.config import StepExecutorConfig, Web3TransactionExecutorConfig
 
+from src.modules.activity_index import ActivityIndex
+from src.modules.action_plan import STATUS_FAILURE, STATUS_SUCCESS, ActionPlan, PlannedAction
+from src.modules.balance_prefetcher import BalancePrefetcher, WalletBalances
+from src.modules.chain_registry import ChainRegistry, make_http_provider
 from src.modules.wrapper import network_error_handler_decorator
 from src.modules.brianknows_client import BrianknowsClient
+from src.modules.build_lookahead import BuildLookahead
 from src.modules.browser_client import BrowserClient
+from src.modules.exceptions import DeadlineExceeded
+from src.modules.wallet_context import WalletContext
 
+from src.utils.deadline import run_with_deadline
 from src.utils.helper import write_file
+from src.utils.metrics import metrics
 from src.utils.progress_bar import wait
 from src.utils.requests import make_async_request
 
 
-class PromptConfig(BaseModel):
-    title: str
-    enabled: bool
-    start: List
-    end: List
-
-
-class StepExecutorConfig(BaseModel):
-    rpc_base: str
-
-    prompts: List[PromptConfig]
-    chains: List
-
-    swap_eth_amount: tuple[float, float]
-    swap_eth_percent: tuple[int, int]
-    bridge_eth_percent: tuple[int, int]
-    wrap_eth_percent: tuple[int, int]
-    deposit_dollars_of_eth: tuple[int, int]
-
-    wait_before_after_authorization_sec: tuple[int, int]
-    wait_before_action_sec: tuple[int, int]
-    timeout_between_wallets_src: tuple[int, int]
-
-
 class StepExecutor:
     def __init__(
             self,
             config: StepExecutorConfig,
             base_web3_transaction_executor_config: Web3TransactionExecutorConfig,
+            chain_registry: Optional[ChainRegistry] = None,
+            balance_prefetcher: Optional[BalancePrefetcher] = None,
+            action_plan: Optional[ActionPlan] = None,
+            activity_index: Optional[ActivityIndex] = None,
     ) -> None:
         self.config = config
 
         self.base_web3_transaction_executor_config = base_web3_transaction_executor_config
 
-        self.w3_base: Optional[Web3] = None
+        if chain_registry is None:
+            chain_registry = ChainRegistry(
+                config.networks, config.chains, base_web3_transaction_executor_config
+            )
+        self.chain_registry = chain_registry
+        self.balance_prefetcher = balance_prefetcher
+        self.action_plan = action_plan
+        self.activity_index = activity_index
+
+        self.w3s: Dict[str, Web3] = {}
         self.proxy: Optional[str] = None
 
-    def setup_w3(self, proxy: Optional[str] = None):
-        request_kwargs = {"proxy": proxy}
+    def _make_provider(self, rpc: str, proxy: Optional[str] = None):
+        return make_http_provider(rpc, proxy)
 
-        self.w3_base = Web3(
-            Web3.AsyncHTTPProvider(self.config.rpc_base, request_kwargs=request_kwargs),
-            modules={"eth": (AsyncEth,)},
-            middlewares=[],
+    def _make_browser_client(self, address: str) -> BrowserClient:
+        return BrowserClient(
+            username=address,
+            proxy=self.proxy
         )
 
+    def _make_brianknows_client(self, browser_client, transaction_executors, address) -> BrianknowsClient:
+        return BrianknowsClient(
+            browser_client=browser_client,
+            transaction_executors=transaction_executors,
+            address=address,
+            proxy=self.proxy
+        )
+
+    def setup_w3(self, proxy: Optional[str] = None):
+        self.w3s = {
+            chain: self.chain_registry.get_w3(chain, proxy, self._make_provider)
+            for chain in self.chain_registry.chains
+        }
+
         self.proxy = proxy
 
     def cleanup_w3(self):
-        self.w3_base = None
+        self.w3s = {}
         self.proxy = None
 
     async def _wait_before_action(self, min_sec: int, max_sec: int, action_name: str) -> None:
@@ -108,38 +118,264 @@ class StepExecutor:
 
         return virtuals_tokens
 
+    def _render_prompt(self, prompt: str, chain: str, values: dict) -> str:
+        prompt = prompt.replace("{chain}", chain)
+        for key, value in values.items():
+            prompt = prompt.replace("{" + key + "}", str(value))
+        return prompt
+
+    def check_activity(self, private_key: str) -> None:
+        if self.activity_index is not None:
+            self.activity_index.check(private_key)
+
+    def is_wallet_funded(self, address: str) -> bool:
+        if self.balance_prefetcher is None:
+            return True
+        return self.balance_prefetcher.is_funded(address)
+
+    def plan_actions(
+            self,
+            chain: str,
+            virtuals_tokens: List[str],
+            balances: Optional[WalletBalances] = None,
+            verbose: bool = True,
+    ) -> List[Tuple[str, dict]]:
+        actions = []
+
+        if balances is not None:
+            gas_reserve_wei = Web3.to_wei(self.balance_prefetcher.config.gas_reserve_eth, "ether")
+            held_tokens = [symbol for symbol, amount in balances.tokens.items() if amount > 0]
+            available_wei = balances.eth
+
+        log = logger.info if verbose else logger.debug
+
+        prompts = [
+            prompt for prompt in self.config.prompts
+            if prompt.enabled and (prompt.chains is None or chain in prompt.chains)
+        ]
+
+        random.shuffle(prompts)
+
+        for prompt in prompts:
+            start_prompt = random.choice(prompt.start)
+            end_prompt = random.choice(prompt.end)
+
+            values = {
+                "swap_eth_amount": round(random.uniform(*self.config.swap_eth_amount), 6),
+                "swap_eth_percent": random.randint(*self.config.swap_eth_percent),
+                "bridge_eth_percent": random.randint(*self.config.bridge_eth_percent),
+                "wrap_eth_percent": random.randint(*self.config.wrap_eth_percent),
+                "random_virtual_token": random.choice(virtuals_tokens) if virtuals_tokens else "",
+                "deposit_dollars_of_eth": random.randint(*self.config.deposit_dollars_of_eth),
+            }
+
+            if balances is not None:
+                required_wei = gas_reserve_wei
+                if "{swap_eth_amount}" in start_prompt:
+                    required_wei += Web3.to_wei(values["swap_eth_amount"], "ether")
+                if "{deposit_dollars_of_eth}" in start_prompt:
+                    # Без курса ETH/USD сумму не оценить, действие считается доступным
+                    required_wei += self.balance_prefetcher.usd_to_wei(values["deposit_dollars_of_eth"]) or 0
+
+                if available_wei < required_wei:
+                    # Стартовое действие не по карману, но закрывающее имеет смысл, если токен уже на кошельке
+                    action_end = self._render_prompt(end_prompt, chain, values)
+                    if any(symbol in action_end.upper() for symbol in held_tokens):
+                        log(f"- {prompt.title} ({chain}): только '{action_end}', на старт не хватает баланса.")
+                        actions.append((end_prompt, values))
+                    else:
+                        log(f"- {prompt.title} ({chain}): пропускаем '{start_prompt}', не хватает баланса.")
+                        metrics.inc("actions_skipped_total", chain=chain, reason="balance")
+                    continue
+
+                available_wei -= required_wei
+
+            log(f"- {prompt.title} ({chain}): '{start_prompt}' и '{end_prompt}'.")
+
+            actions.append((start_prompt, values))
+            actions.append((end_prompt, values))
+
+        return actions
+
+    def _build_actions(
+            self, chain: str, virtuals_tokens: List[str], balances: Optional[WalletBalances] = None
+    ) -> List[PlannedAction]:
+        return [
+            PlannedAction(None, chain, self._render_prompt(template, chain, values), None)
+            for template, values in self.plan_actions(chain, virtuals_tokens, balances)
+        ]
+
+    async def _run_chain(
+            self,
+            context: WalletContext,
+            chain: str,
+            actions: Optional[List[PlannedAction]] = None,
+    ) -> None:
+        address = context.address
+
+        if actions is None:
+            logger.info(f"Загружаем Virtuals tokens для сети {chain}...")
+
+            virtuals_tokens = await self.get_virtual_tokens(chain)
+
+            balances = None
+            if self.balance_prefetcher is not None:
+                balances = await self.balance_prefetcher.get_fresh(chain, address)
+
+            logger.info(f"Приступаем к формированию действий, сеть: {chain}")
+
+            actions = self._build_actions(chain, virtuals_tokens, balances)
+
+        lookahead = None
+        if self.config.lookahead.enabled:
+            lookahead = BuildLookahead(
+                self.config.lookahead, context.brianknows_client, context.transaction_executors[chain], chain
+            )
+
+        try:
+            await self._run_actions(context, chain, actions, lookahead)
+        finally:
+            if lookahead is not None:
+                lookahead.cancel()
+
+        if self.balance_prefetcher is not None and actions:
+            await self.balance_prefetcher.refresh(chain, address)
+
+    async def _run_actions(
+            self,
+            context: WalletContext,
+            chain: str,
+            actions: List[PlannedAction],
+            lookahead: Optional[BuildLookahead],
+    ) -> None:
+        address = context.address
+
+        for idx, planned in enumerate(actions):
+            action = planned.text
+            logger.info(f"Запускаем действие '{action}' в сети {chain}...")
+
+            results = None
+            if lookahead is not None:
+                results = await lookahead.take(action)
+
+            transaction_executor = context.transaction_executors[chain]
+            gas_before = transaction_executor.gas_spent_wei
+            points_before = context.brianknows_client.chain_points[chain]
+            started_at = time.perf_counter()
+
+            try:
+                success = await run_with_deadline(
+                    context.brianknows_client.build_and_run_promt(chain, action, results),
+                    self.config.action_timeout_sec,
+                    "действие",
+                )
+            except DeadlineExceeded:
+                # Строка плана остается невыполненной и повторится при следующем запуске.
+                # Транзакция могла остаться в мемпуле, поэтому остальные действия сети не трогаем
+                metrics.inc("actions_total", chain=chain, status="timeout")
+                write_file(address, chain, action, 0, duration_sec=time.perf_counter() - started_at)
+                raise
+
+            if success:
+                logger.info(f"Успешно выполнено {action}!")
+                context.actions_done += 1
+                status = 1
+            else:
+                status = 0
+
+            metrics.inc("actions_total", chain=chain, status="success" if status == 1 else "failure")
+            write_file(
+                address,
+                chain,
+                action,
+                status,
+                duration_sec=time.perf_counter() - started_at,
+                gas_wei=transaction_executor.gas_spent_wei - gas_before,
+                points=context.brianknows_client.chain_points[chain] - points_before,
+            )
+
+            if planned.row is not None:
+                self.action_plan.mark(planned.row, STATUS_SUCCESS if status == 1 else STATUS_FAILURE)
+
+            # Следующее действие собираем во время паузы, уже после квитанции текущего: Brian считает
+            # суммы от баланса, и сборка до транзакции почти всегда выбрасывалась бы как устаревшая
+            if lookahead is not None and idx + 1 < len(actions):
+                lookahead.start(actions[idx + 1].text)
+
+            if planned.delay_sec is not None:
+                logger.info(f"Ждем {planned.delay_sec} сек перед выполнением следующего действия")
+                await wait(planned.delay_sec)
+            else:
+                await self._wait_before_action(
+                    min_sec=self.config.wait_before_action_sec[0],
+                    max_sec=self.config.wait_before_action_sec[1],
+                    action_name="выполнением следующего действия"
+                )
+
+    @metrics.timed("run_step")
     async def run_step(self, private_key: str) -> None:
+        account = Account.from_key(private_key)
 
-        account = self.w3_base.eth.account.from_key(private_key)
-        address = account.address
+        with logger.contextualize(wallet=account.address):
+            # Пауза между кошельками в бюджет кошелька не входит
+            wallet_delay_sec = await run_with_deadline(
+                self._run_step(account, private_key), self.config.wallet_timeout_sec, "кошелек"
+            )
+            if wallet_delay_sec is not None:
+                await wait(wallet_delay_sec)
 
-        logger.info(f"Запускаем аккаунт {address}...")
+    def make_wallet_context(self, account) -> WalletContext:
+        transaction_executors = self.chain_registry.make_executors(self.w3s, account)
 
-        base_transaction_executor = Web3TransactionExecutor(
-            w3=self.w3_base, config=self.base_web3_transaction_executor_config, account=account
-        )
+        browser_client = self._make_browser_client(account.address)
 
-        browser_client = BrowserClient(
-            username=address,
-            proxy=self.proxy
-        )
+        brianknows_client = self._make_brianknows_client(browser_client, transaction_executors, account.address)
 
-        transaction_executors = {
-            "base": base_transaction_executor
-        }
+        return WalletContext(account, self.proxy, transaction_executors, browser_client, brianknows_client)
 
-        brianknows_client = BrianknowsClient(
-            browser_client=browser_client,
-            transaction_executors=transaction_executors,
-            address=address,
-            proxy=self.proxy
-        )
+    async def _run_step(self, account, private_key: str) -> Optional[int]:
+        address = account.address
 
-        chain = random.choice(self.config.chains)
+        logger.info(f"Запускаем аккаунт {address}...")
 
-        if chain not in list(transaction_executors.keys()):
-            logger.error("Сеть chain в данный момент не поддерживается софтом...")
-            return
+        context = self.make_wallet_context(account)
+        browser_client = context.browser_client
+        brianknows_client = context.brianknows_client
+
+        planned_actions: Optional[Dict[str, List[PlannedAction]]] = None
+        wallet_delay_sec = None
+        if self.action_plan is not None:
+            wallet_idx = self.action_plan.wallet_index(private_key)
+            if wallet_idx is None:
+                logger.warning(f"Кошелька {address} нет в плане, пропускаем")
+                return None
+
+            planned_actions = {}
+            for planned in self.action_plan.pending_actions(wallet_idx, self._render_prompt):
+                planned_actions.setdefault(planned.chain, []).append(planned)
+            wallet_delay_sec = self.action_plan.wallet_delay_sec(wallet_idx)
+            context.plan_cursor = wallet_idx
+
+            if not planned_actions:
+                logger.info(f"Все запланированные действия кошелька {address} уже выполнены, пропускаем")
+                return None
+
+            chains = list(planned_actions)
+        else:
+            chains = self.chain_registry.chains
+
+        if self.balance_prefetcher is not None:
+            min_eth_wei = Web3.to_wei(self.balance_prefetcher.config.min_eth_balance, "ether")
+            chains = [
+                chain for chain in chains
+                if (balances := self.balance_prefetcher.get(chain, address)) is None or balances.eth >= min_eth_wei
+            ]
+            if not chains:
+                logger.warning(f"На кошельке {address} нет баланса ни в одной сети, пропускаем")
+                return None
+
+        if planned_actions is None:
+            chains = random.sample(chains, k=min(self.config.chains_per_wallet, len(chains)))
 
         if not await brianknows_client.authorized():
             logger.info("Начинаем авторизацию...")
@@ -160,68 +396,31 @@ class StepExecutor:
                     action_name="выполненияем действий",
                 )
 
-        logger.info(f"Загружаем Virtuals tokens...")
-
-        virtuals_tokens = await self.get_virtual_tokens(chain)
-
-        logger.info(f"Приступаем к формированию действий, сеть: {chain}")
-
-        actions = []
+        # У каждой сети свое пространство nonce, поэтому сети отрабатываются параллельно
+        try:
+            results = await asyncio.gather(
+                *[
+                    self._run_chain(context, chain, planned_actions[chain] if planned_actions is not None else None)
+                    for chain in chains
+                ],
+                return_exceptions=True,
+            )
+        finally:
+            # Куки сохраняем и при отмене по бюджету времени
+            await browser_client.close()
 
-        prompts = self.config.prompts
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors and len(errors) == len(chains):
+            raise errors[0]
 
-        random.shuffle(prompts)
+        for chain, result in zip(chains, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка при отработке сети {chain}: {result}")
 
-        for prompt in prompts:
-            if prompt.enabled:
-                start_prompt = random.choice(prompt.start)
-                end_prompt = random.choice(prompt.end)
-
-                swap_eth_amount = round(random.uniform(*self.config.swap_eth_amount), 6)
-                swap_eth_percent = random.randint(*self.config.swap_eth_percent)
-                bridge_eth_percent = random.randint(*self.config.bridge_eth_percent)
-                wrap_eth_percent = random.randint(*self.config.wrap_eth_percent)
-                random_virtual_token = random.choice(virtuals_tokens)
-                deposit_dollars_of_eth = random.randint(*self.config.deposit_dollars_of_eth)
-
-                action_start = start_prompt
-
-                action_start = action_start.replace("{swap_eth_amount}", str(swap_eth_amount))
-                action_start = action_start.replace("{swap_eth_percent}", str(swap_eth_percent))
-                action_start = action_start.replace("{bridge_eth_percent}", str(bridge_eth_percent))
-                action_start = action_start.replace("{wrap_eth_percent}", str(wrap_eth_percent))
-                action_start = action_start.replace("{random_virtual_token}", str(random_virtual_token))
-                action_start = action_start.replace("{deposit_dollars_of_eth}", str(deposit_dollars_of_eth))
-
-                action_end = end_prompt
-
-                action_end = action_end.replace("{swap_eth_amount}", str(swap_eth_amount))
-                action_end = action_end.replace("{swap_eth_percent}", str(swap_eth_percent))
-                action_end = action_end.replace("{bridge_eth_percent}", str(bridge_eth_percent))
-                action_end = action_end.replace("{wrap_eth_percent}", str(wrap_eth_percent))
-                action_end = action_end.replace("{random_virtual_token}", str(random_virtual_token))
-                action_end = action_end.replace("{deposit_dollars_of_eth}", str(deposit_dollars_of_eth))
-
-                logger.info(f"- {prompt.title}: '{action_start}' и '{action_end}'.")
-
-                actions.append(action_start)
-                actions.append(action_end)
-
-        for action in actions:
-            logger.info(f"Запускаем действие '{action}'...")
-            if await brianknows_client.build_and_run_promt(chain, action):
-                logger.info(f"Успешно выполнено {action}!")
-                status = 1
-            else:
-                status = 0
-
-            write_file(address, chain, action, status)
-
-            await self._wait_before_action(
-                min_sec=self.config.wait_before_action_sec[0],
-                max_sec=self.config.wait_before_action_sec[1],
-                action_name="выполнением следующего действия"
-            )
+        if self.activity_index is not None:
+            self.activity_index.record_run(private_key, context.actions_done, brianknows_client.points_claimed)
 
         logger.success(f"Аккаунт {address} отработан...")
-        await wait(random.randint(*self.config.timeout_between_wallets_src))
+        if wallet_delay_sec is None:
+            wallet_delay_sec = random.randint(*self.config.timeout_between_wallets_src)
+        return wallet_delay_sec
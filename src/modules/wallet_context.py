@@ -0,0 +1,37 @@
+from typing import Dict, Optional
+
+from src.modules.brianknows_client import BrianknowsClient
+from src.modules.browser_client import BrowserClient
+from src.modules.web3_transaction_exectutor import Web3TransactionExecutor
+
+
+class WalletContext:
+    # Только данные кошелька: провайдеры, HTTP-сессия и конфиги общие и хранятся по ссылке
+    __slots__ = (
+        "account",
+        "address",
+        "proxy",
+        "transaction_executors",
+        "browser_client",
+        "brianknows_client",
+        "plan_cursor",
+        "actions_done",
+    )
+
+    def __init__(
+            self,
+            account,
+            proxy: Optional[str],
+            transaction_executors: Dict[str, Web3TransactionExecutor],
+            browser_client: BrowserClient,
+            brianknows_client: BrianknowsClient,
+            plan_cursor: Optional[int] = None,
+    ):
+        self.account = account
+        self.address = account.address
+        self.proxy = proxy
+        self.transaction_executors = transaction_executors
+        self.browser_client = browser_client
+        self.brianknows_client = brianknows_client
+        self.plan_cursor = plan_cursor
+        self.actions_done = 0
@@ -1,38 +1,62 @@
 import math
 import time
+from asyncio import TimeoutError as AsyncTimeoutError
 from decimal import Decimal
-from typing import Optional, Tuple
+from typing import TYPE_CHECKING, Optional, Tuple
 
+from aiohttp import ClientConnectionError, ClientResponseError
 from eth_utils import to_hex
 from loguru import logger
-from pydantic import BaseModel
 from web3 import Web3
-from web3.exceptions import ContractLogicError
+from web3.exceptions import ContractLogicError, TransactionNotFound
 
+from src.config import Web3TransactionExecutorConfig
 from src.utils.base_classes import ZERO_ADDRESS
 from src.utils.base_types import Account
+from src.utils.deadline import check_deadline
+from src.utils.metrics import metrics
 from src.utils.progress_bar import wait
 from src.modules.exceptions import NotEnoughtBalanceToSend, InsufficientFunds
+from src.modules.gas_estimate_cache import CacheKey, GasEstimateCache
 
+# Минимальное повышение комиссии, при котором ноды принимают замену транзакции
+MIN_REPLACEMENT_BUMP_PERCENT = 10
 
-class Web3TransactionExecutorConfig(BaseModel):
-    gas_price_multiplier: float
-    balance_check_interval: int
-    transaction_wait_attempts: int
-    transaction_wait_retry_interval: int
-    max_gas_price_eth_gwei_bridge_action: Optional[Decimal] = None
-    max_gas_price_eth_gwei_usual_actions: Optional[Decimal] = None
+if TYPE_CHECKING:
+    from src.modules.fee_strategy import FeeStrategy
+    from src.modules.gas_scheduler import GasScheduler
+
+
+def rpc_error_kind(e: Exception) -> str:
+    # overload - нода или сеть не справляются (транспорт, таймаут, 429/5xx), rpc - ошибка самого вызова
+    if isinstance(e, ClientResponseError):
+        return "overload" if e.status == 429 or e.status >= 500 else "rpc"
+    if isinstance(e, (ClientConnectionError, AsyncTimeoutError, OSError)):
+        return "overload"
+    return "rpc"
 
 
 def rpc_error_handler_decorator():
     def decorator(func):
         async def wrapper(*args, **kwargs):
-            for _ in range(10):
+            method = func.__name__
+            for retry in range(10):
+                if retry > 0:
+                    check_deadline()
+                    metrics.inc("rpc_retries_total", method=method)
+
+                start = time.perf_counter()
                 try:
-                    return await func(*args, **kwargs)
+                    result = await func(*args, **kwargs)
+                    metrics.observe("rpc_call_duration_seconds", time.perf_counter() - start, method=method)
+                    return result
                 except ContractLogicError as e:
+                    metrics.observe("rpc_call_duration_seconds", time.perf_counter() - start, method=method)
+                    metrics.inc("rpc_errors_total", method=method, error=type(e).__name__, kind="rpc")
                     raise e
                 except Exception as e:
+                    metrics.observe("rpc_call_duration_seconds", time.perf_counter() - start, method=method)
+                    metrics.inc("rpc_errors_total", method=method, error=type(e).__name__, kind=rpc_error_kind(e))
                     error = str(e)
 
                     if "insufficient funds for gas" in error:
@@ -48,22 +72,49 @@ def rpc_error_handler_decorator():
 
 
 class Web3TransactionExecutor:
+    __slots__ = (
+        "config",
+        "w3",
+        "account",
+        "eth_w3_trans_executor",
+        "gas_scheduler",
+        "gas_estimate_cache",
+        "fee_strategy",
+        "gas_spent_wei",
+        "_chain_id",
+    )
+
     def __init__(
             self,
             w3: Web3,
             account: Account,
             config: Web3TransactionExecutorConfig,
             eth_w3_trans_executor: Optional["Web3TransactionExecutor"] = None,
+            gas_scheduler: Optional["GasScheduler"] = None,
+            gas_estimate_cache: Optional[GasEstimateCache] = None,
+            fee_strategy: Optional["FeeStrategy"] = None,
     ) -> None:
         self.config = config
         self.w3 = w3
         self.account = account
         self.eth_w3_trans_executor: Optional["Web3TransactionExecutor"] = eth_w3_trans_executor
+        self.gas_scheduler = gas_scheduler
+        self.gas_estimate_cache = gas_estimate_cache
+        self.fee_strategy = fee_strategy
+        # Сколько кошелек потратил на газ через этот исполнитель, для results.csv и аналитики
+        self.gas_spent_wei = 0
+        self._chain_id: Optional[int] = None
 
     async def wait_for_gas_price(
             self, max_gas_price: int, timeout: int = 30, log_success=True
     ) -> None:
+        if self.gas_scheduler is not None:
+            # Общая очередь всех кошельков, действия выпускаются постепенно в окна низкого газа
+            await self.gas_scheduler.acquire(max_gas_price)
+            return
+
         while True:
+            check_deadline()
             current_gas_price = await self.get_gas_price()
 
             if current_gas_price <= max_gas_price:
@@ -107,6 +158,10 @@ class Web3TransactionExecutor:
     async def get_gas_price(self) -> int:
         return int(await self.w3.eth.gas_price)
 
+    @rpc_error_handler_decorator()
+    async def get_fee_history(self, block_count: int, newest_block: str, reward_percentiles: list) -> dict:
+        return await self.w3.eth.fee_history(block_count, newest_block, reward_percentiles)
+
     @rpc_error_handler_decorator()
     async def get_balance(self, address: Optional[str] = None) -> int:
         if address is None:
@@ -117,51 +172,227 @@ class Web3TransactionExecutor:
     async def get_transaction_count(self, address: str) -> int:
         return await self.w3.eth.get_transaction_count(address)
 
-    @rpc_error_handler_decorator()
     async def get_chain_id(self) -> int:
+        # chain id сети не меняется, запрашиваем его один раз на исполнителя
+        if self._chain_id is None:
+            self._chain_id = await self._get_chain_id()
+        return self._chain_id
+
+    @rpc_error_handler_decorator()
+    async def _get_chain_id(self) -> int:
         return await self.w3.eth.chain_id
 
     @rpc_error_handler_decorator()
     async def estimate_gas(self, tx: dict) -> int:
-        nonce = await self.get_transaction_count(tx["from"])
-        tx = {**tx, "nonce": nonce}
-
         return await self.w3.eth.estimate_gas(tx)
 
+    async def get_gas_limit(self, tx: dict, scale_gas: float = 1.1) -> Tuple[int, Optional[CacheKey]]:
+        if self.gas_estimate_cache is None:
+            return int(await self.estimate_gas(tx) * scale_gas), None
+
+        cache_key = GasEstimateCache.make_key(tx["chainId"], tx)
+        gas = self.gas_estimate_cache.get(cache_key)
+        if gas is not None:
+            return gas, cache_key
+
+        estimate = await self.estimate_gas(tx)
+        self.gas_estimate_cache.put(cache_key, estimate)
+        return int(estimate * scale_gas), cache_key
+
     @rpc_error_handler_decorator()
     async def send_transaction(self, tx: dict) -> str:
-        nonce = await self.get_transaction_count(tx["from"])
-        tx = {**tx, "nonce": nonce}
-        sign = self.account.sign_transaction(tx)
+        # nonce остается в tx: по нему отправляются замены зависшей транзакции
+        tx["nonce"] = await self.get_transaction_count(tx["from"])
+        return await self._sign_and_send(tx)
 
+    async def _sign_and_send(self, tx: dict) -> str:
+        sign = self.account.sign_transaction(tx)
         return await self.w3.eth.send_raw_transaction(sign.rawTransaction)
 
     async def get_scaled_gas_price(self) -> int:
         return int(await self.get_gas_price() * self.config.gas_price_multiplier)
 
+    def _cap_max_fee(self, max_fee_per_gas: int) -> int:
+        if self.config.max_gas_price_eth_gwei_usual_actions is None:
+            return max_fee_per_gas
+        return min(max_fee_per_gas, Web3.to_wei(self.config.max_gas_price_eth_gwei_usual_actions, "gwei"))
+
+    async def get_max_fee_per_gas(self) -> int:
+        if self.fee_strategy is not None:
+            fees = await self.fee_strategy.get_fees()
+            if fees is not None:
+                return self._cap_max_fee(fees.max_fee_per_gas)
+        return await self.get_gas_price()
+
+    async def apply_fees(self, tx: dict, max_fee_per_gas: Optional[int] = None) -> int:
+        tx["type"] = "0x2"
+
+        fees = await self.fee_strategy.get_fees() if self.fee_strategy is not None else None
+        if fees is None:
+            # Без истории комиссий вся цена газа уходит в maxFee и в чаевые, как раньше
+            if max_fee_per_gas is None:
+                max_fee_per_gas = await self.get_scaled_gas_price()
+            tx["maxPriorityFeePerGas"] = max_fee_per_gas
+            tx["maxFeePerGas"] = max_fee_per_gas
+            return max_fee_per_gas
+
+        if max_fee_per_gas is None:
+            max_fee_per_gas = self._cap_max_fee(fees.max_fee_per_gas)
+        tx["maxFeePerGas"] = max_fee_per_gas
+        tx["maxPriorityFeePerGas"] = min(fees.max_priority_fee_per_gas, max_fee_per_gas)
+
+        logger.info(
+            f"Комиссия ({fees.profile}): base fee {float(self.w3.from_wei(fees.base_fee_per_gas, 'gwei'))} gwei, "
+            f"чаевые {float(self.w3.from_wei(tx['maxPriorityFeePerGas'], 'gwei'))} gwei, "
+            f"ожидаемое включение ~{fees.expected_inclusion_sec:.0f} сек"
+        )
+        return max_fee_per_gas
+
     async def wait_for_tx(self, tx_hash: str, retry_n=0) -> None:
-        # logger.info(f"Ожидание выполнения транзакции {to_hex(tx_hash)}... попытка {retry_n}")
+        trx_receipt = await self.wait_for_receipt(tx_hash, retry_n)
+        return self.check_receipt(tx_hash, trx_receipt)
+
+    @metrics.timed("wait_for_tx")
+    async def wait_for_receipt(self, tx_hash: str, retry_n=0):
+        while True:
+            # logger.info(f"Ожидание выполнения транзакции {to_hex(tx_hash)}... попытка {retry_n}")
+            check_deadline()
+            metrics.inc("wait_for_tx_polls_total")
 
+            try:
+                trx_receipt = await self.w3.eth.get_transaction_receipt(tx_hash)
+                break
+            except Exception as e:
+                # logger.info(f"Информация о транзакции: {e}")
+                if (
+                        self.config.transaction_wait_attempts != -1
+                        and retry_n >= self.config.transaction_wait_attempts
+                ):
+                    raise Exception(f"Транзакция {to_hex(tx_hash)} не найдена")
+
+                await wait(self.config.transaction_wait_retry_interval)
+                retry_n += 1
+
+        return trx_receipt
+
+    async def wait_for_confirmation(self, tx: dict, tx_hash: str):
+        if not self.config.replacement.enabled:
+            return tx_hash, await self.wait_for_receipt(tx_hash)
+        return await self.wait_for_receipt_with_replacement(tx, tx_hash)
+
+    async def _get_receipt_or_none(self, tx_hash: str):
         try:
-            trx_receipt = await self.w3.eth.get_transaction_receipt(tx_hash)
-        except Exception as e:
-            # logger.info(f"Информация о транзакции: {e}")
+            return await self.w3.eth.get_transaction_receipt(tx_hash)
+        except TransactionNotFound:
+            return None
+
+    def _bump_fees(self, tx: dict, network_gas_price: int, original_fee: int) -> Optional[dict]:
+        policy = self.config.replacement
+        fee_field = "maxFeePerGas" if "maxFeePerGas" in tx else "gasPrice"
+        bump_percent = max(policy.bump_percent, MIN_REPLACEMENT_BUMP_PERCENT)
+
+        fee_cap = int(original_fee * policy.max_fee_multiplier)
+        if policy.max_fee_gwei is not None:
+            fee_cap = min(fee_cap, Web3.to_wei(policy.max_fee_gwei, "gwei"))
+
+        # Нода принимает замену только со строго большей на 10% комиссией, поэтому min_fee входит в max до потолка
+        min_fee = tx[fee_field] * (100 + MIN_REPLACEMENT_BUMP_PERCENT) // 100 + 1
+        new_fee = min(max(tx[fee_field] * (100 + bump_percent) // 100, min_fee, network_gas_price), fee_cap)
+        if new_fee < min_fee:
+            return None
+
+        bumped = {**tx, fee_field: new_fee}
+        if "maxPriorityFeePerGas" in tx:
+            # Чаевые тоже должны вырасти минимум на 10%, но не выше maxFeePerGas
+            min_tip = tx["maxPriorityFeePerGas"] * (100 + MIN_REPLACEMENT_BUMP_PERCENT) // 100 + 1
+            bumped["maxPriorityFeePerGas"] = min(
+                max(tx["maxPriorityFeePerGas"] * (100 + bump_percent) // 100, min_tip), new_fee
+            )
+        return bumped
+
+    @metrics.timed("wait_for_tx")
+    async def wait_for_receipt_with_replacement(self, tx: dict, tx_hash: str):
+        policy = self.config.replacement
+        fee_field = "maxFeePerGas" if "maxFeePerGas" in tx else "gasPrice"
+        original_fee = tx[fee_field]
+
+        hashes = [tx_hash]
+        current_tx = tx
+        sent_at = time.monotonic()
+        cap_reached = False
+        retry_n = 0
+
+        while True:
+            check_deadline()
+            metrics.inc("wait_for_tx_polls_total")
+
+            # Подтвердиться может любая из отправленных версий, свежие проверяем первыми
+            for sent_hash in reversed(hashes):
+                try:
+                    trx_receipt = await self._get_receipt_or_none(sent_hash)
+                except Exception as e:
+                    logger.warning(f"Ошибка при получении квитанции {to_hex(sent_hash)}: {e}")
+                    trx_receipt = None
+
+                if trx_receipt is not None:
+                    if len(hashes) > 1:
+                        metrics.inc("tx_replacement_confirmed_total", replaced=sent_hash != tx_hash)
+                    return sent_hash, trx_receipt
+
             if (
                     self.config.transaction_wait_attempts != -1
                     and retry_n >= self.config.transaction_wait_attempts
             ):
                 raise Exception(f"Транзакция {to_hex(tx_hash)} не найдена")
 
+            pending_sec = time.monotonic() - sent_at
+            if (
+                    not cap_reached
+                    and pending_sec >= policy.stuck_after_sec
+                    and len(hashes) - 1 < policy.max_replacements
+            ):
+                bumped_tx = self._bump_fees(current_tx, await self.get_scaled_gas_price(), original_fee)
+
+                if bumped_tx is None:
+                    cap_reached = True
+                    logger.warning(
+                        f"Транзакция {to_hex(hashes[-1])} висит {int(pending_sec)} сек, "
+                        f"но комиссия уже у потолка, ждем без замены"
+                    )
+                else:
+                    try:
+                        new_hash = await self._sign_and_send(bumped_tx)
+                    except Exception as e:
+                        # nonce too low/already known: одна из версий уже в блоке, найдем ее квитанцию
+                        logger.warning(f"Не удалось заменить транзакцию {to_hex(hashes[-1])}: {e}")
+                    else:
+                        logger.warning(
+                            f"Транзакция {to_hex(hashes[-1])} висит {int(pending_sec)} сек, заменяем на "
+                            f"{to_hex(new_hash)} с комиссией "
+                            f"{float(self.w3.from_wei(bumped_tx[fee_field], 'gwei'))} gwei"
+                        )
+                        metrics.inc("tx_replacements_total")
+                        hashes.append(new_hash)
+                        current_tx = bumped_tx
+                    sent_at = time.monotonic()
+
             await wait(self.config.transaction_wait_retry_interval)
-            await self.wait_for_tx(tx_hash, retry_n + 1)
-            return
+            retry_n += 1
 
+    def _record_gas(self, trx_receipt) -> None:
+        # В L2 на OP Stack к комиссии исполнения добавляется плата за публикацию в L1
+        self.gas_spent_wei += trx_receipt["gasUsed"] * trx_receipt.get("effectiveGasPrice", 0)
+        l1_fee = trx_receipt.get("l1Fee")
+        if l1_fee:
+            self.gas_spent_wei += int(l1_fee, 16) if isinstance(l1_fee, str) else l1_fee
+
+    def check_receipt(self, tx_hash: str, trx_receipt) -> int:
         status = trx_receipt["status"]
 
         if status == 0:
             raise Exception(f"Транзакция {to_hex(tx_hash)} была отменена EVM")
         else:
-            logger.info(f"Транзакция успешно выполнена: https://basescan.org/tx/{to_hex(tx_hash)}")
+            logger.info(f"Транзакция успешно выполнена: {self.config.explorer_url}/tx/{to_hex(tx_hash)}")
 
         return status
 
@@ -188,25 +419,23 @@ class Web3TransactionExecutor:
             f'Отправляем {amount_eth} eth из {address} на {to_addr} в chain id {tx["chainId"]}'
         )
 
-        if gas_price is None:
-            gas_price = await self.get_scaled_gas_price()
-
         # tx["gas"] = self.config.transaction_gas
         if gas is None:
-            gas = int(await self.estimate_gas(tx) * scale_gas)
+            gas, _ = await self.get_gas_limit(tx, scale_gas)
 
-        tx["type"] = "0x2"
+        gas_price = await self.apply_fees(tx, gas_price)
         tx["gas"] = gas
-        tx["maxPriorityFeePerGas"] = gas_price
-        tx["maxFeePerGas"] = gas_price
 
         logger.info(f'Итоговые расходы: {self.w3.from_wei(gas_price * gas, "ether")} eth')
 
         tx_hash = await self.send_transaction(tx)
-        await self.wait_for_tx(tx_hash)
+        tx_hash, trx_receipt = await self.wait_for_confirmation(tx, tx_hash)
+        self._record_gas(trx_receipt)
+        self.check_receipt(tx_hash, trx_receipt)
 
         return tx_hash, Web3.to_wei(amount_eth, "ether")
 
+    @metrics.timed("send_contract_transaction")
     async def send_contract_transaction(
             self, tx_data: str, to_addr: str, amount_eth: Decimal, scale_gas: float = 1.1, tx_type : int = 2
     ):
@@ -220,28 +449,33 @@ class Web3TransactionExecutor:
             "chainId": await self.get_chain_id(),
         }
 
-        gas_price = await self.get_scaled_gas_price()
-
-        gas = int(await self.estimate_gas(tx) * scale_gas)
+        gas, cache_key = await self.get_gas_limit(tx, scale_gas)
 
         if tx_type == 2:
-            tx["type"] = "0x2"
+            await self.apply_fees(tx)
             tx["gas"] = gas
-            tx["maxPriorityFeePerGas"] = gas_price
-            tx["maxFeePerGas"] = gas_price
         else:
             tx["gas"] = gas
-            tx["gasPrice"] = gas_price
+            tx["gasPrice"] = await self.get_scaled_gas_price()
 
         hash_ = await self.send_transaction(tx)
-        status = await self.wait_for_tx(hash_)
+        hash_, trx_receipt = await self.wait_for_confirmation(tx, hash_)
+        self._record_gas(trx_receipt)
+
+        if cache_key is not None:
+            self.gas_estimate_cache.observe(cache_key, gas, trx_receipt["gasUsed"])
+            if trx_receipt["status"] == 0:
+                # После отката следующая попытка пойдет с живой оценкой газа
+                self.gas_estimate_cache.invalidate(cache_key)
+
+        status = self.check_receipt(hash_, trx_receipt)
 
         return status, hash_
 
     async def get_transfer_price_wei(self, scale_gas: float = 1.1):
         address = self.account.address
 
-        gas_price = await self.get_gas_price()
+        gas_price = await self.get_max_fee_per_gas()
 
         mock_tx = {
             "from": ZERO_ADDRESS,
@@ -250,7 +484,7 @@ class Web3TransactionExecutor:
             "chainId": await self.get_chain_id(),
         }
 
-        gas = int(await self.estimate_gas(mock_tx) * scale_gas)
+        gas, _ = await self.get_gas_limit(mock_tx, scale_gas)
 
         return gas_price * gas, gas, gas_price
 
@@ -262,7 +496,7 @@ class Web3TransactionExecutor:
         await self.wait_for_usual_actions_gas_price()
 
         balance = await self.get_balance(address)
-        gas_price = await self.get_gas_price()
+        gas_price = await self.get_max_fee_per_gas()
 
         mock_tx = {
             "from": address,
@@ -271,7 +505,7 @@ class Web3TransactionExecutor:
             "chainId": await self.get_chain_id(),
         }
 
-        gas = int(await self.estimate_gas(mock_tx) * scale_gas)
+        gas, _ = await self.get_gas_limit(mock_tx, scale_gas)
 
         amount_wei = balance - gas_price * gas
 
@@ -1,7 +1,9 @@
-import asyncio
-
 from loguru import logger
 
+from src.modules.exceptions import DeadlineExceeded
+from src.utils.deadline import check_deadline
+from src.utils.progress_bar import wait
+
 
 def solve_captcha_retry(async_func):
     async def wrapper(idx, *args, **kwargs):
@@ -20,11 +22,15 @@ def network_error_handler_decorator(max_retry=5):
     def decorator(func):
         async def wrapper(*args, **kwargs):
             for retry in range(max_retry):
+                check_deadline()
                 try:
                     return await func(*args, **kwargs)
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     logger.error(f"Ошибка сети {e}, повторим {retry}/{max_retry}.")
-                    await asyncio.sleep(10)
+                    # Пауза укладывается в бюджет времени: без остатка на нее wait бросит DeadlineExceeded
+                    await wait(10)
 
         return wrapper
 
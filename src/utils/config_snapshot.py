@@ -0,0 +1,84 @@
+import hashlib
+import pickle
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Optional, Set, Type
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.config import Config
+
+
+def _model_modules(model: Type[BaseModel], seen: Set[type]) -> Set[str]:
+    if model in seen:
+        return set()
+    seen.add(model)
+
+    modules = {model.__module__}
+    for field in model.model_fields.values():
+        annotation = field.annotation
+        candidates = [annotation, *getattr(annotation, "__args__", ())]
+        for candidate in candidates:
+            for nested in (candidate, *getattr(candidate, "__args__", ())):
+                if isinstance(nested, type) and issubclass(nested, BaseModel):
+                    modules |= _model_modules(nested, seen)
+
+    return modules
+
+
+def snapshot_key(config_path: Path, config_overrides: Optional[str]) -> str:
+    digest = hashlib.sha256()
+    digest.update(config_path.read_bytes())
+    digest.update((config_overrides or "").encode())
+    # ${now:...} в конфиге резолвится на дату запуска
+    digest.update(date.today().isoformat().encode())
+
+    # Изменение схемы конфига инвалидирует снапшот
+    for module_name in sorted(_model_modules(Config, set())):
+        module_file = getattr(sys.modules.get(module_name), "__file__", None)
+        if module_file:
+            digest.update(Path(module_file).read_bytes())
+
+    return digest.hexdigest()[:24]
+
+
+def load_config(
+        config_dir: str,
+        config_name: str = "config",
+        config_overrides: Optional[str] = None,
+        cache_dir: str = ".cache/config",
+) -> Config:
+    config_path = Path(config_dir) / f"{config_name}.yaml"
+    snapshot_path = Path(config_dir) / cache_dir / f"{config_name}-{snapshot_key(config_path, config_overrides)}.pkl"
+
+    if snapshot_path.exists():
+        try:
+            with open(snapshot_path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.debug(f"Не удалось прочитать снапшот конфига {snapshot_path}: {e}")
+
+    from src.utils.hydra import load_hydra_config
+
+    config = Config(**load_hydra_config(
+        config_dir=config_dir,
+        config_name=config_name,
+        return_hydra_section=False,
+        config_overrides=config_overrides,
+    ))
+
+    try:
+        snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+        for stale_path in snapshot_path.parent.glob(f"{config_name}-*.pkl"):
+            stale_path.unlink()
+
+        tmp_path = snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(snapshot_path)
+    except OSError as e:
+        logger.debug(f"Не удалось сохранить снапшот конфига: {e}")
+
+    return config
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Awaitable, Optional, Tuple, TypeVar
+
+from src.modules.exceptions import DeadlineExceeded
+from src.utils.metrics import metrics
+
+T = TypeVar("T")
+
+# Запас к бюджету, после которого задачу отменяем принудительно, если она сама не остановилась
+HARD_TIMEOUT_GRACE_SEC = 5
+
+# (срок по time.monotonic, название бюджета, длительность); asyncio копирует контекст в дочерние задачи
+_deadline: ContextVar[Optional[Tuple[float, str, float]]] = ContextVar("deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current[0] - time.monotonic()
+
+
+def _exceeded(kind: str) -> DeadlineExceeded:
+    _, scope, timeout_sec = _deadline.get()
+    metrics.inc("deadline_exceeded_total", scope=scope, kind=kind)
+    return DeadlineExceeded(f"Истек бюджет времени на {scope} ({timeout_sec:g} сек)")
+
+
+def check_deadline() -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise _exceeded("soft")
+
+
+async def ensure_time_for(delay: float) -> None:
+    # Если до срока меньше, чем предстоит ждать, ждем только до срока и прерываемся
+    left = remaining()
+    if left is not None and left < delay:
+        await asyncio.sleep(max(left, 0))
+        raise _exceeded("soft")
+
+
+async def wait_for(awaitable: Awaitable[T]) -> T:
+    left = remaining()
+    if left is None:
+        return await awaitable
+
+    try:
+        return await asyncio.wait_for(awaitable, max(left, 0))
+    except asyncio.TimeoutError:
+        if remaining() > 0:
+            raise
+        raise _exceeded("soft")
+
+
+async def run_with_deadline(coro: Awaitable[T], timeout_sec: Optional[float], scope: str) -> T:
+    if timeout_sec is None:
+        return await coro
+
+    expires_at = time.monotonic() + timeout_sec
+    current = _deadline.get()
+    if current is not None and current[0] <= expires_at:
+        # Внешний бюджет заканчивается раньше, действует он
+        return await coro
+
+    token = _deadline.set((expires_at, scope, timeout_sec))
+    try:
+        return await asyncio.wait_for(coro, timeout_sec + HARD_TIMEOUT_GRACE_SEC)
+    except asyncio.TimeoutError:
+        # Таймаут мог прийти и изнутри (например, HTTP), это не наш бюджет
+        if remaining() > 0:
+            raise
+        raise _exceeded("hard")
+    finally:
+        _deadline.reset(token)
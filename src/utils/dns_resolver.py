@@ -0,0 +1,141 @@
+import asyncio
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from loguru import logger
+from src.config import DnsConfig
+from src.utils.metrics import metrics
+
+try:
+    import aiodns
+except ImportError:  # без aiodns резолвим через getaddrinfo в пуле потоков, кеш остается
+    aiodns = None
+
+DNS_ERRORS = (OSError, aiodns.error.DNSError) if aiodns is not None else (OSError,)
+
+
+_config = DnsConfig()
+
+# Кеш общий для всех сессий и коннекторов процесса: (хост, порт) -> (истекает, адреса)
+_cache: Dict[Tuple[str, int], Tuple[float, List[Tuple[int, str]]]] = {}
+_resolvers: Dict[int, "CachingResolver"] = {}
+
+
+def setup_dns(config: DnsConfig) -> None:
+    global _config
+
+    _config = config
+    _cache.clear()
+
+
+class CachingResolver(AbstractResolver):
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.dns = aiodns.DNSResolver(loop=loop) if aiodns is not None else None
+        self.in_flight: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def _lookup(self, host: str, port: int) -> Tuple[float, List[Tuple[int, str]]]:
+        family = socket.AF_UNSPEC if _config.allow_ipv6 else socket.AF_INET
+
+        if self.dns is not None:
+            result = await self.dns.getaddrinfo(host, family=family, port=port, type=socket.SOCK_STREAM)
+            nodes = [(node.family, node.addr[0].decode(), node.ttl) for node in result.nodes]
+        else:
+            infos = await self.loop.getaddrinfo(host, port, family=family, type=socket.SOCK_STREAM)
+            nodes = [(info[0], info[4][0], 0) for info in infos]
+
+        addresses = [(node_family, address) for node_family, address, _ in nodes]
+        if _config.prefer_ipv4:
+            addresses.sort(key=lambda item: item[0] != socket.AF_INET)
+        if not addresses:
+            raise OSError(f"Нет адресов для {host}")
+
+        ttl = min((node_ttl for _, _, node_ttl in nodes), default=0)
+        ttl = min(max(ttl, _config.min_ttl_sec), _config.max_ttl_sec)
+        return time.monotonic() + ttl, addresses
+
+    async def _lookup_or_stale(self, host: str, port: int, cached) -> List[Tuple[int, str]]:
+        try:
+            expires_at, addresses = await self._lookup(host, port)
+        except DNS_ERRORS as e:
+            metrics.inc("dns_lookups_total", result="error")
+            if cached is None:
+                raise OSError(f"Ошибка DNS для {host}: {e}") from e
+
+            # Устаревший адрес лучше, чем ошибка: отдаем его еще немного
+            logger.warning(f"Ошибка DNS для {host}: {e}, используем адрес из кеша")
+            expires_at, addresses = time.monotonic() + _config.negative_ttl_sec, cached[1]
+        else:
+            metrics.inc("dns_lookups_total", result="resolved")
+
+        _cache[(host, port)] = (expires_at, addresses)
+        return addresses
+
+    async def _resolve_cached(self, host: str, port: int) -> List[Tuple[int, str]]:
+        key = (host, port)
+        cached = _cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            metrics.inc("dns_lookups_total", result="cache")
+            return cached[1]
+
+        # Одновременные запросы одного хоста ждут один и тот же резолв
+        future = self.in_flight.get(key)
+        if future is not None:
+            metrics.inc("dns_lookups_total", result="shared")
+            return await asyncio.shield(future)
+
+        future = self.in_flight[key] = self.loop.create_future()
+        try:
+            addresses = await self._lookup_or_stale(host, port, cached)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получит вызывающий, ожидающих на future может и не быть
+            future.exception()
+            raise
+        else:
+            future.set_result(addresses)
+            return addresses
+        finally:
+            self.in_flight.pop(key, None)
+
+    async def resolve(self, host: str, port: int = 0, family: int = socket.AF_INET) -> List[dict]:
+        addresses = await self._resolve_cached(host, port)
+        return [
+            {
+                "hostname": host,
+                "host": address,
+                "port": port,
+                "family": address_family,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            }
+            for address_family, address in addresses
+        ]
+
+    async def close(self) -> None:
+        # Резолвер общий для всех коннекторов, закрывать его при закрытии сессии нельзя
+        pass
+
+
+def get_resolver() -> CachingResolver:
+    loop = asyncio.get_running_loop()
+    resolver = _resolvers.get(id(loop))
+    if resolver is None or resolver.loop is not loop:
+        resolver = _resolvers[id(loop)] = CachingResolver(loop)
+    return resolver
+
+
+def local_address() -> Optional[str]:
+    # Привязка к IPv4-адресу не дает клиентам без своего резолвера уйти по IPv6
+    return None if _config.allow_ipv6 else "0.0.0.0"
+
+
+def make_connector(**kwargs) -> aiohttp.TCPConnector:
+    # Свой кеш в коннекторе не нужен: он живет только пока жива сессия
+    return aiohttp.TCPConnector(resolver=get_resolver(), use_dns_cache=False, **kwargs)
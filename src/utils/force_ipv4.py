@@ -1,11 +0,0 @@
-import socket
-
-
-def force_ipv4():
-    old_getaddrinfo = socket.getaddrinfo
-
-    def new_getaddrinfo(*args, **kwargs):
-        responses = old_getaddrinfo(*args, **kwargs)
-        return [response for response in responses if response[0] == socket.AF_INET]
-
-    socket.getaddrinfo = new_getaddrinfo
\ No newline at end of file
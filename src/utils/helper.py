@@ -1,15 +1,29 @@
 import csv
+import hashlib
 
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from src.modules import global_constants as cst
 
+RESULTS_PATH = Path(__file__).resolve().parent.parent.parent / "results.csv"
 
-def write_file(wallet: str, chain: str, action: str, status: int):
-    root_path = Path(__file__).resolve().parent.parent.parent
-    fila_path = root_path / "results.csv"
 
+def wallet_id(private_key: str) -> str:
+    # Стабильный идентификатор кошелька для журналов и индексов, сам ключ в них не пишется
+    return hashlib.sha256(private_key.encode()).hexdigest()[:16]
+
+
+def write_file(
+        wallet: str,
+        chain: str,
+        action: str,
+        status: int,
+        duration_sec: Optional[float] = None,
+        gas_wei: Optional[int] = None,
+        points: Optional[int] = None,
+):
     data = [
         {
             "Wallet": wallet,
@@ -17,10 +31,13 @@ def write_file(wallet: str, chain: str, action: str, status: int):
             "Chain": chain,
             "Action": action,
             "Status": "SUCCESS" if status == 1 else "FAILURE",
+            "Duration": round(duration_sec, 1) if duration_sec is not None else "",
+            "GasWei": gas_wei if gas_wei is not None else "",
+            "Points": points if points is not None else "",
         }
     ]
 
-    with open(str(fila_path), "a", newline="") as file:
+    with open(str(RESULTS_PATH), "a", newline="") as file:
         writer = csv.DictWriter(file, cst.CSV_COLUMNS, quoting=csv.QUOTE_NONNUMERIC)
         writer.writerows(data)
         file.close()
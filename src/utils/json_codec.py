@@ -0,0 +1,82 @@
+import json
+import re
+from pathlib import Path
+from typing import Any, Union
+
+# Самый быстрый из доступных кодеков: orjson, затем msgspec, затем стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# orjson превращает целые за пределами 64 бит в float (uint256 из RPC, суммы в wei).
+# 19 цифр подряд - возможное такое число, его разбирает стандартный json
+_LONG_INT_BYTES = re.compile(rb"\d{19,}")
+_LONG_INT_STR = re.compile(r"\d{19,}")
+
+
+def _may_lose_ints(data: Union[bytes, str]) -> bool:
+    pattern = _LONG_INT_STR if isinstance(data, str) else _LONG_INT_BYTES
+    return pattern.search(data) is not None
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def loads(data: Union[bytes, str]) -> Any:
+        if _may_lose_ints(data):
+            return json.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # Стандартный json мягче (NaN, Infinity, суррогаты), невалидный документ он тоже отвергнет
+            return json.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+elif msgspec is not None:
+    BACKEND = "msgspec"
+
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def loads(data: Union[bytes, str]) -> Any:
+        if _may_lose_ints(data):
+            return json.loads(data)
+        try:
+            return _decoder.decode(data)
+        except msgspec.DecodeError as e:
+            # Остальные бэкенды бросают ValueError, вызывающий код рассчитывает на него
+            raise ValueError(str(e)) from e
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj)
+
+else:
+    BACKEND = "json"
+
+    def loads(data: Union[bytes, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+
+def load_file(path: Union[str, Path]) -> Any:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump_file(path: Union[str, Path], obj: Any) -> None:
+    with open(path, "wb") as f:
+        f.write(dumps(obj))
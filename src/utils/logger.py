@@ -1,53 +1,140 @@
 import asyncio
 import re
 import sys
-from asyncio import Queue, create_task
+import time
+from asyncio import create_task
+from collections import Counter, deque
 from pathlib import Path
+from typing import List
 
 from loguru import logger
-from telegram import Bot
-from telegram.request import HTTPXRequest
 
 from src.config import LogsConfig
 
 tasks = set()
+handlers = []
 
 
 class TelegramLoggerHandler:
     ERROR_MSG = "Не могу отправить лог в телеграм"
-
-    def __init__(self, token: str, chat_id: int):
+    MAX_MESSAGE_LENGTH = 4096
+    # Записи ниже WARNING при переполнении буфера отбрасываются первыми
+    LOW_PRIORITY_LEVEL_NO = 30
+
+    def __init__(
+            self,
+            token: str,
+            chat_id: int,
+            flush_interval_sec: float = 10,
+            min_send_interval_sec: float = 3,
+            max_buffer_size: int = 500,
+    ):
         self.token = token
         self.chat_id = int(chat_id)
+        self.flush_interval_sec = flush_interval_sec
+        self.min_send_interval_sec = min_send_interval_sec
+        self.max_buffer_size = max_buffer_size
+
+        # python-telegram-bot импортируется только если логирование в телеграм включено
+        from telegram import Bot
+        from telegram.request import HTTPXRequest
 
-        self.bot = Bot(token, request=HTTPXRequest(connection_pool_size=10**10))
+        self.bot = Bot(token, request=HTTPXRequest(connection_pool_size=1))
 
-        self.queue = Queue()
+        self.buffer = deque()
+        self.dropped = Counter()
+        self.last_send_time = 0.0
 
         self.log_types_emoji = {"INFO": "🟢", "ERROR": "🔴", "WARNING": "🟠"}
 
     async def send_message(self, message):
-        await self.bot.send_message(chat_id=self.chat_id, text=message)
+        from telegram.error import RetryAfter
+
+        wait_sec = self.last_send_time + self.min_send_interval_sec - time.monotonic()
+        if wait_sec > 0:
+            await asyncio.sleep(wait_sec)
+
+        try:
+            await self.bot.send_message(chat_id=self.chat_id, text=message)
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            await asyncio.sleep(retry_after)
+            await self.bot.send_message(chat_id=self.chat_id, text=message)
+        finally:
+            self.last_send_time = time.monotonic()
 
     async def sender_task(self):
         while True:
+            await asyncio.sleep(self.flush_interval_sec)
+            await self.send_buffered()
+
+    async def send_buffered(self):
+        for message in self.collect_messages():
             try:
-                message = await self.queue.get()
                 await self.send_message(message)
             except Exception as e:
                 logger.debug(f"{self.ERROR_MSG}: {e}")
-            await asyncio.sleep(3)
 
     def write(self, message):
-        if self.ERROR_MSG not in message:
-            message = self.prepare_message(message)
-            self.queue.put_nowait(message)
+        if self.ERROR_MSG in message:
+            return
+
+        level = message.record["level"]
+
+        if len(self.buffer) >= self.max_buffer_size:
+            if level.no < self.LOW_PRIORITY_LEVEL_NO:
+                self.dropped[level.name] += 1
+                return
+            self.evict()
+
+        self.buffer.append((level.no, self.prepare_message(message)))
+
+    def evict(self):
+        for idx, (level_no, _) in enumerate(self.buffer):
+            if level_no < self.LOW_PRIORITY_LEVEL_NO:
+                del self.buffer[idx]
+                self.dropped["INFO"] += 1
+                return
+
+        self.buffer.popleft()
+        self.dropped["WARNING+"] += 1
+
+    def collect_messages(self) -> List[str]:
+        lines = []
+        while self.buffer:
+            _, text = self.buffer.popleft()
+            if lines and lines[-1][0] == text:
+                lines[-1][1] += 1
+            else:
+                lines.append([text, 1])
+
+        if self.dropped:
+            dropped = ", ".join(f"{name}: {count}" for name, count in self.dropped.items())
+            lines.append([f"⚪ Пропущено записей из-за переполнения: {dropped}", 1])
+            self.dropped.clear()
+
+        messages = []
+        current = ""
+        for text, repeats in lines:
+            if repeats > 1:
+                text = f"{text} (x{repeats})"
+            text = text[:self.MAX_MESSAGE_LENGTH]
+
+            if current and len(current) + len(text) + 2 > self.MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n\n{text}" if current else text
+
+        if current:
+            messages.append(current)
+
+        return messages
 
     def prepare_message(self, message):
         message = self.add_emojies(message)
         message = self.remove_colors_from_message(message)
         message = self.split_to_lines(message)
-        return message
+        return message.strip()
 
     @staticmethod
     def remove_colors_from_message(message: str) -> str:
@@ -70,19 +157,53 @@ async def setup_logging(config: LogsConfig):
     file_path = Path(config.file_path)
     file_path.parent.mkdir(parents=True, exist_ok=True)
 
+    # Кошелек привязывается через logger.contextualize(wallet=...) в StepExecutor.run_step
+    logger.configure(extra={"wallet": "-"})
+
     formatter = (
         "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> "
         "| <level>{level: <8}</level> "
+        "| <cyan>{extra[wallet]}</cyan> "
         "| <level>{message}</level>"
     )
-    logger.add(sys.stdout, level=config.level, format=formatter)
-    logger.add(file_path, level=config.level, format=formatter)
+    # enqueue=True переносит запись в фоновый поток, event loop не блокируется на I/O.
+    # Файлы построчно сбрасываются на диск, чтобы хвост лога не терялся при падении
+    logger.add(sys.stdout, level=config.level, format=formatter, enqueue=config.enqueue)
+    logger.add(file_path, level=config.level, format=formatter, enqueue=config.enqueue, buffering=1)
+    if config.json_file_path is not None:
+        json_file_path = Path(config.json_file_path)
+        json_file_path.parent.mkdir(parents=True, exist_ok=True)
+        logger.add(
+            json_file_path,
+            level=config.level,
+            serialize=True,
+            enqueue=config.enqueue,
+            buffering=1,
+        )
     logger.remove(0)
 
     if config.telegram.enabled:
         telegram_logger_handler = TelegramLoggerHandler(
-            config.telegram.token, config.telegram.chat_id
+            config.telegram.token,
+            config.telegram.chat_id,
+            flush_interval_sec=config.telegram.flush_interval_sec,
+            min_send_interval_sec=config.telegram.min_send_interval_sec,
+            max_buffer_size=config.telegram.max_buffer_size,
         )
-        logger.add(telegram_logger_handler)
+        # Без времени в формате одинаковые записи подряд склеиваются в одну с (xN)
+        logger.add(telegram_logger_handler, level=config.telegram.level, format="{level} | {message}")
+        handlers.append(telegram_logger_handler)
         task = create_task(telegram_logger_handler.sender_task())
-        tasks.add(task)
\ No newline at end of file
+        tasks.add(task)
+
+
+async def shutdown_logging():
+    for task in tasks:
+        task.cancel()
+    tasks.clear()
+
+    for handler in handlers:
+        await handler.send_buffered()
+    handlers.clear()
+
+    await logger.complete()
\ No newline at end of file
@@ -0,0 +1,265 @@
+import asyncio
+import bisect
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+tasks = set()
+
+
+class MetricsConfig(BaseModel):
+    prometheus_port: Optional[int] = None
+    prometheus_host: str = "127.0.0.1"
+    json_dump_path: Optional[str] = None
+    json_dump_interval_sec: int = 60
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def delta(self, previous: "Histogram") -> "Histogram":
+        result = Histogram(self.buckets)
+        result.counts = [a - b for a, b in zip(self.counts, previous.counts)]
+        result.sum = self.sum - previous.sum
+        result.count = self.count - previous.count
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[idx] if idx < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+def _labels_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[dict] = None) -> str:
+    items = list(labels) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, Dict[tuple, float]] = {}
+        self.histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        # Получают (имя, начало, конец) каждого замера timed, например профилировщик
+        self.span_listeners: List[Callable[[str, float, float], None]] = []
+        # Последние снимки метрик дочерних процессов (шардов) по имени источника
+        self.remote: Dict[str, dict] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        series = self.counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def timed(self, name: str, **labels):
+        def decorator(func):
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as e:
+                    self.inc(f"{name}_errors_total", error=type(e).__name__, **labels)
+                    raise
+                finally:
+                    end = time.perf_counter()
+                    self.observe(f"{name}_duration_seconds", end - start, **labels)
+                    for listener in self.span_listeners:
+                        listener(name, start, end)
+
+            return wrapper
+
+        return decorator
+
+    def merged_histogram(self, name: str, predicate: Optional[Callable[[dict], bool]] = None) -> Histogram:
+        merged = Histogram()
+        for labels, histogram in self.histograms.get(name, {}).items():
+            if predicate is None or predicate(dict(labels)):
+                merged.merge(histogram)
+        return merged
+
+    def counter_total(self, name: str, predicate: Optional[Callable[[dict], bool]] = None) -> float:
+        return sum(
+            value for labels, value in self.counters.get(name, {}).items()
+            if predicate is None or predicate(dict(labels))
+        )
+
+    def reset(self) -> None:
+        self.counters.clear()
+        self.histograms.clear()
+        self.remote.clear()
+
+    def snapshot(self) -> dict:
+        # Накопленные значения без объектов Histogram, чтобы снимок проходил через multiprocessing.Queue
+        return {
+            "counters": {name: dict(series) for name, series in self.counters.items()},
+            "histograms": {
+                name: {
+                    labels: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count)
+                    for labels, histogram in series.items()
+                }
+                for name, series in self.histograms.items()
+            },
+        }
+
+    def set_remote(self, source: str, snapshot: dict) -> None:
+        # Снимки накопительные, поэтому новый заменяет прежний от того же источника
+        self.remote[source] = snapshot
+
+    def _all_series(self) -> Tuple[Dict[str, Dict[tuple, float]], Dict[str, Dict[tuple, Histogram]]]:
+        if not self.remote:
+            return self.counters, self.histograms
+
+        counters = {name: dict(series) for name, series in self.counters.items()}
+        histograms = {name: dict(series) for name, series in self.histograms.items()}
+        for source, snapshot in self.remote.items():
+            for name, series in snapshot["counters"].items():
+                target = counters.setdefault(name, {})
+                for labels, value in series.items():
+                    target[_labels_key({**dict(labels), "shard": source})] = value
+            for name, series in snapshot["histograms"].items():
+                target = histograms.setdefault(name, {})
+                for labels, (buckets, counts, total, count) in series.items():
+                    histogram = Histogram(buckets)
+                    histogram.counts, histogram.sum, histogram.count = list(counts), total, count
+                    target[_labels_key({**dict(labels), "shard": source})] = histogram
+        return counters, histograms
+
+    def to_dict(self) -> dict:
+        result = {"counters": {}, "histograms": {}}
+        counters, histograms = self._all_series()
+
+        for name, series in counters.items():
+            result["counters"][name] = [
+                {"labels": dict(labels), "value": value} for labels, value in series.items()
+            ]
+
+        for name, series in histograms.items():
+            result["histograms"][name] = [
+                {
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                }
+                for labels, histogram in series.items()
+            ]
+
+        return result
+
+    def to_prometheus(self) -> str:
+        lines: List[str] = []
+        counters, histograms = self._all_series()
+
+        for name, series in counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name, series in histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def dump_metrics_json(path: str) -> None:
+    file_path = Path(path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = file_path.with_suffix(file_path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"time": time.time(), **metrics.to_dict()}, f, indent=2)
+    tmp_path.replace(file_path)
+
+
+async def json_dump_task(path: str, interval_sec: int) -> None:
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            dump_metrics_json(path)
+        except Exception as e:
+            logger.debug(f"Не удалось сохранить метрики: {e}")
+
+
+async def start_prometheus_server(host: str, port: int):
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.to_prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    logger.info(f"Метрики Prometheus доступны на http://{host}:{port}/metrics")
+    return runner
+
+
+async def setup_metrics(config: MetricsConfig) -> None:
+    if config.prometheus_port is not None:
+        await start_prometheus_server(config.prometheus_host, config.prometheus_port)
+
+    if config.json_dump_path is not None:
+        task = asyncio.create_task(json_dump_task(config.json_dump_path, config.json_dump_interval_sec))
+        tasks.add(task)
+
+
+def shutdown_metrics(config: MetricsConfig) -> None:
+    if config.json_dump_path is not None:
+        dump_metrics_json(config.json_dump_path)
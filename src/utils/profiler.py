@@ -0,0 +1,238 @@
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Literal, Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+
+from src.utils import json_codec
+from src.utils.metrics import metrics
+
+
+class ProfilingConfig(BaseModel):
+    enabled: bool = False
+    engine: Literal["auto", "yappi", "cprofile"] = "auto"
+    # yappi меряет одними часами за запуск: cpu - процессорное время, wall - с ожиданием I/O внутри корутин
+    yappi_clock: Literal["cpu", "wall"] = "cpu"
+    output_dir: str = "profiles"
+    loop_lag_interval_sec: float = 0.05
+    slow_callback_sec: float = 0.1
+    top_functions: int = 20
+
+
+class SlowCallbackHandler(logging.Handler):
+    # asyncio в debug-режиме пишет о медленных колбэках в стандартный logging, пересылаем в loguru
+    def __init__(self, profiler: "RunProfiler"):
+        super().__init__(level=logging.WARNING)
+        self.profiler = profiler
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if "took" in message and "seconds" in message:
+            self.profiler.slow_callbacks += 1
+            metrics.inc("event_loop_slow_callbacks_total")
+            logger.warning(f"Медленный колбэк event loop: {message}")
+
+
+class RunProfiler:
+    def __init__(self, config: ProfilingConfig, name: str = "run"):
+        self.config = config
+        self.name = name
+        self.output_path = Path(config.output_dir) / f"{datetime.now():%Y-%m-%d_%H-%M-%S}_{name}"
+
+        self.engine = self._select_engine()
+        self._profile: Optional[cProfile.Profile] = None
+
+        self.spans: List[Tuple[int, str, str, float, float]] = []
+        self.loop_lags: List[float] = []
+        self.slow_callbacks = 0
+        self.started_at = 0.0
+        self.started_cpu = 0.0
+
+        self._lag_task: Optional[asyncio.Task] = None
+        self._log_handler: Optional[SlowCallbackHandler] = None
+        self._loop_debug = False
+
+    def _select_engine(self) -> str:
+        if self.config.engine in ("auto", "yappi"):
+            try:
+                import yappi  # noqa: F401
+                return "yappi"
+            except ImportError:
+                if self.config.engine == "yappi":
+                    logger.warning("yappi не установлен, профилируем через cProfile")
+        return "cprofile"
+
+    def record_span(self, name: str, start: float, end: float) -> None:
+        task = asyncio.current_task()
+        task_id = id(task) if task is not None else 0
+        task_name = task.get_name() if task is not None else "main"
+        self.spans.append((task_id, task_name, name, start, end))
+
+    async def _monitor_loop_lag(self) -> None:
+        interval = self.config.loop_lag_interval_sec
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - start - interval)
+            self.loop_lags.append(lag)
+            metrics.observe("event_loop_lag_seconds", lag)
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        self._loop_debug = loop.get_debug()
+        loop.slow_callback_duration = self.config.slow_callback_sec
+        loop.set_debug(True)
+        self._log_handler = SlowCallbackHandler(self)
+        logging.getLogger("asyncio").addHandler(self._log_handler)
+
+        metrics.span_listeners.append(self.record_span)
+        self._lag_task = asyncio.create_task(self._monitor_loop_lag())
+
+        if self.engine == "yappi":
+            import yappi
+
+            yappi.set_clock_type(self.config.yappi_clock)
+            yappi.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self.started_at = time.perf_counter()
+        self.started_cpu = time.process_time()
+        logger.info(f"Профилирование включено ({self.engine}), результаты будут в {self.output_path}")
+
+    def stop(self) -> None:
+        wall_sec = time.perf_counter() - self.started_at
+        cpu_sec = time.process_time() - self.started_cpu
+
+        if self.engine == "yappi":
+            import yappi
+
+            yappi.stop()
+        else:
+            self._profile.disable()
+
+        self._lag_task.cancel()
+        metrics.span_listeners.remove(self.record_span)
+        logging.getLogger("asyncio").removeHandler(self._log_handler)
+        asyncio.get_running_loop().set_debug(self._loop_debug)
+
+        self.output_path.mkdir(parents=True, exist_ok=True)
+        self._save_pstats()
+        self._save_speedscope()
+        summary = self._summary(wall_sec, cpu_sec)
+        json_codec.dump_file(self.output_path / "summary.json", summary)
+        self._log_summary(summary)
+
+    def _save_pstats(self) -> None:
+        path = self.output_path / "profile.pstats"
+        if self.engine == "yappi":
+            import yappi
+
+            yappi.get_func_stats().save(str(path), type="pstat")
+            yappi.clear_stats()
+        else:
+            self._profile.dump_stats(str(path))
+
+    def _save_speedscope(self) -> None:
+        frames: Dict[str, int] = {}
+        by_task: Dict[int, List[Tuple[str, str, float, float]]] = {}
+        for task_id, task_name, name, start, end in self.spans:
+            frames.setdefault(name, len(frames))
+            by_task.setdefault(task_id, []).append((task_name, name, start, end))
+
+        profiles = []
+        for spans in by_task.values():
+            events = []
+            for _, name, start, end in spans:
+                # Вложенные спаны: при равном времени внешний открывается первым и закрывается последним
+                events.append((start - self.started_at, 1, -end, "O", frames[name]))
+                events.append((end - self.started_at, 0, -start, "C", frames[name]))
+            events.sort()
+
+            profiles.append({
+                "type": "evented",
+                "name": spans[0][0],
+                "unit": "seconds",
+                "startValue": events[0][0],
+                "endValue": events[-1][0],
+                "events": [{"type": kind, "frame": frame, "at": at} for at, _, _, kind, frame in events],
+            })
+
+        json_codec.dump_file(self.output_path / "spans.speedscope.json", {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "brianknows-profiler",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": profiles,
+        })
+
+    def _summary(self, wall_sec: float, cpu_sec: float) -> dict:
+        spans: Dict[str, List[float]] = {}
+        for _, _, name, start, end in self.spans:
+            spans.setdefault(name, []).append(end - start)
+
+        lags = sorted(self.loop_lags)
+        return {
+            "engine": self.engine,
+            "clock": self.config.yappi_clock if self.engine == "yappi" else "wall",  # cProfile считает по perf_counter
+            "wall_sec": wall_sec,
+            "cpu_sec": cpu_sec,
+            "spans": {
+                name: {
+                    "count": len(durations),
+                    "total_sec": sum(durations),
+                    "mean_sec": sum(durations) / len(durations),
+                    "max_sec": max(durations),
+                }
+                for name, durations in spans.items()
+            },
+            "loop_lag_ms": {
+                "p50": lags[len(lags) // 2] * 1000 if lags else 0,
+                "p99": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000 if lags else 0,
+                "max": lags[-1] * 1000 if lags else 0,
+            },
+            "slow_callbacks": self.slow_callbacks,
+        }
+
+    def _log_summary(self, summary: dict) -> None:
+        logger.info(
+            f"Профиль: {summary['wall_sec']:.1f} сек wall, {summary['cpu_sec']:.1f} сек CPU, "
+            f"лаг event loop p99 {summary['loop_lag_ms']['p99']:.1f} мс, "
+            f"медленных колбэков {summary['slow_callbacks']}"
+        )
+        for name, span in sorted(summary["spans"].items(), key=lambda item: -item[1]["total_sec"]):
+            logger.info(
+                f"- {name}: {span['count']} раз, всего {span['total_sec']:.1f} сек, "
+                f"в среднем {span['mean_sec']:.2f} сек, максимум {span['max_sec']:.2f} сек"
+            )
+
+        stream = io.StringIO()
+        stats = pstats.Stats(str(self.output_path / "profile.pstats"), stream=stream)
+        stats.sort_stats("cumulative").print_stats(self.config.top_functions)
+        logger.debug(stream.getvalue())
+        logger.info(f"Профиль сохранен в {self.output_path}")
+
+
+@asynccontextmanager
+async def profile_run(config: ProfilingConfig, name: str = "run"):
+    if not config.enabled:
+        yield None
+        return
+
+    profiler = RunProfiler(config, name)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
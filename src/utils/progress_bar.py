@@ -1,10 +1,30 @@
 import asyncio
 import sys
 
-from tqdm import tqdm
+from src.utils.deadline import ensure_time_for
+from src.utils.metrics import metrics
+
+# Множитель всех задержек, бенчмарк выставляет 0, чтобы не ждать реальные паузы
+time_scale = 1.0
+
+
+def set_time_scale(scale: float) -> None:
+    global time_scale
+    time_scale = scale
 
 
 async def wait(delay: int):
+    metrics.inc("sleep_seconds_total", delay)
+
+    # Пауза не переживет бюджет времени действия или кошелька
+    await ensure_time_for(delay * time_scale)
+
+    if time_scale != 1.0:
+        await asyncio.sleep(delay * time_scale)
+        return
+
+    from tqdm import tqdm
+
     for _ in tqdm(
         range(delay),
         ncols=100,
@@ -14,4 +34,4 @@ async def wait(delay: int):
         colour="GREEN",
         desc=f"Ждем {delay} сек",
     ):
-        await asyncio.sleep(1)
\ No newline at end of file
+        await asyncio.sleep(1)
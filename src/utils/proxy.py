@@ -1,10 +1,13 @@
-import aiohttp
 from loguru import logger
 
+from src.utils.dns_resolver import make_connector
+
 
 async def check_proxy(proxy: str) -> bool:
+    import aiohttp
+
     try:
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(connector=make_connector()) as session:
             async with session.get("https://www.brianknows.org/app", proxy=proxy) as response:
                 if response.status == 200:
                     logger.info(f"Прокси работает: {proxy}")
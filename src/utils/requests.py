@@ -1,8 +1,11 @@
 import aiohttp
 
+from src.utils import json_codec
+from src.utils.dns_resolver import make_connector
+
 
 async def make_async_request(url: str, method: str = "GET", **kwargs) -> dict:
-    async with aiohttp.ClientSession() as session:
+    async with aiohttp.ClientSession(connector=make_connector(), json_serialize=json_codec.dumps_str) as session:
         async with session.request(method=method, url=url, **kwargs) as response:
             response.raise_for_status()
-            return await response.json()
\ No newline at end of file
+            return json_codec.loads(await response.read())
\ No newline at end of file